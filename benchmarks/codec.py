@@ -0,0 +1,74 @@
+'''
+JSON encoding and decoding of a realistic agent step: the web agent system prompt, a dozen steps of history
+and several screenshots of a few hundred KB each, plus a completion response and a DOM snapshot.
+
+Run from the repository root with `python -m benchmarks.codec`
+'''
+from src.inference.compiler import PayloadCompiler,encode_openai
+from src.message import AIMessage,HumanMessage,ImageMessage,SystemMessage
+from importlib.util import find_spec
+from timeit import repeat
+import random
+import json
+
+STEPS=12
+SCREENSHOTS=3
+SCREENSHOT_SIZE=300_000
+
+def build_messages()->list:
+    random.seed(0)
+    with open('./src/agent/web/prompt/system.md') as f:
+        system_prompt=f.read()
+    messages=[SystemMessage(system_prompt),HumanMessage('Task: Find the cheapest flight from Berlin to Lisbon next Friday')]
+    for step in range(STEPS):
+        messages.append(AIMessage(f'<Option>\n<Thought>Step {step}: looking at the results</Thought>\n<Action-Name>Click Tool</Action-Name>\n<Action-Input>{{"index":{step}}}</Action-Input>\n<Route>Action</Route>\n</Option>'))
+        messages.append(HumanMessage('<Observation>'+'\n'.join(f'{i} - Tag: button Role: button Name: Result {i}' for i in range(60))+'</Observation>'))
+    for _ in range(SCREENSHOTS):
+        messages.append(ImageMessage(text='Current page',image_obj=random.randbytes(SCREENSHOT_SIZE)))
+    return messages
+
+def build_response()->bytes:
+    return json.dumps({
+        'id':'chatcmpl-0','object':'chat.completion','model':'gpt-4o-mini',
+        'choices':[{'index':0,'finish_reason':'stop','message':{'role':'assistant','content':'<Option>\n<Thought>'+'x'*2000+'</Thought>\n</Option>'}}],
+        'usage':{'prompt_tokens':12000,'completion_tokens':300,'total_tokens':12300,'prompt_tokens_details':{'cached_tokens':8000}}
+    }).encode()
+
+def build_dom()->bytes:
+    return json.dumps([{
+        'tag':'a','role':'link','name':f'Result {i}',
+        'attributes':{'href':f'https://example.com/{i}','class':'result-link','aria-label':f'Result {i}'},
+        'box':{'left':10,'top':20*i,'width':200,'height':18}
+    } for i in range(500)]).encode()
+
+def backends()->dict:
+    codecs={'json':(lambda obj:json.dumps(obj).encode(),json.loads)}
+    if find_spec('orjson') is not None:
+        import orjson
+        codecs['orjson']=(orjson.dumps,orjson.loads)
+    if find_spec('msgspec') is not None:
+        import msgspec
+        codecs['msgspec']=(msgspec.json.encode,msgspec.json.decode)
+    return codecs
+
+def measure(function,number:int=20)->float:
+    '''Best time of a call in milliseconds'''
+    return min(repeat(function,number=number,repeat=5))/number*1000
+
+def main():
+    messages=build_messages()
+    payload={'model':'gpt-4o-mini','messages':[encode_openai(message) for message in messages],'temperature':0.5,'stream':False}
+    response=build_response()
+    dom=build_dom()
+    print(f'Request body: {len(json.dumps(payload))/1e6:.2f} MB, response: {len(response)/1e3:.1f} KB, DOM snapshot: {len(dom)/1e3:.1f} KB\n')
+    print(f'{"backend":<10}{"encode request":>16}{"decode response":>17}{"decode DOM":>12}')
+    for name,(dumps,loads) in backends().items():
+        print(f'{name:<10}{measure(lambda:dumps(payload)):>14.2f}ms{measure(lambda:loads(response)):>15.3f}ms{measure(lambda:loads(dom)):>10.3f}ms')
+    # The next step only adds messages, the compiler reuses the encodings of the rest of the history
+    compiler=PayloadCompiler(encode_openai)
+    compiler.compile(messages)
+    step=messages+[AIMessage('<Option>...</Option>'),HumanMessage('<Observation>...</Observation>')]
+    print(f'\nPayloadCompiler, next step with a warm memo: {measure(lambda:compiler.compile(step)):.3f}ms')
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,62 @@
+'''
+Extraction of the interactive elements by the DOM script on large synthetic pages: rows of links, buttons and inputs,
+deeply nested containers, pointer-styled divs and hidden subtrees, measured in the page so only the walk is timed.
+
+Run from the repository root with `python -m benchmarks.dom` (needs Playwright with Chromium installed)
+'''
+from playwright.async_api import async_playwright
+import asyncio
+
+SIZES=[500,2000,8000]
+RUNS=10
+DEPTH=8
+
+MEASURE='''async runs => {
+    const times = [];
+    let count = 0;
+    for (let i = 0; i < runs; i++) {
+        window.__agentDOM.invalidate();
+        const start = performance.now();
+        count = (await window.__agentDOM.getInteractiveElements()).length;
+        times.push(performance.now() - start);
+    }
+    const start = performance.now();
+    await window.__agentDOM.getInteractiveElements();
+    const cached = performance.now() - start;
+    times.sort((a, b) => a - b);
+    return { nodes: document.getElementsByTagName('*').length, count, best: times[0], median: times[Math.floor(runs / 2)], cached };
+}'''
+
+def build_fixture(rows:int)->str:
+    '''A long page where every row nests its controls in a few containers and carries a hidden menu'''
+    body=[]
+    for i in range(rows):
+        nested=f'<a href="/item/{i}">Item {i}</a> <button type="button">Add {i}</button>'
+        for depth in range(DEPTH):
+            nested=f'<div class="level-{depth}">{nested}</div>'
+        hidden=''.join(f'<li><a href="/menu/{i}/{j}">Option {j}</a></li>' for j in range(5))
+        body.append(f'''<section class="row">{nested}
+<input type="text" name="note-{i}" placeholder="Note {i}">
+<div class="card" style="cursor:pointer"><span>Card {i}</span><img alt="" src=""></div>
+<ul style="display:none">{hidden}</ul>
+<label><input type="checkbox" name="pick-{i}" style="opacity:0">Pick {i}</label>
+<table><tr><td>{i}</td><td><a href="#" role="button">Details</a></td></tr></table>
+</section>''')
+    return f'<!DOCTYPE html><html><head><title>Fixture</title></head><body>{"".join(body)}</body></html>'
+
+async def main():
+    with open('./src/agent/web/dom/script.js') as f:
+        script=f.read()
+    async with async_playwright() as playwright:
+        browser=await playwright.chromium.launch(headless=True)
+        page=await browser.new_page(viewport={'width':1280,'height':800})
+        print(f'{"rows":>6}{"nodes":>8}{"elements":>10}{"best":>10}{"median":>10}{"cached":>10}')
+        for rows in SIZES:
+            await page.set_content(build_fixture(rows))
+            await page.evaluate(script)
+            result=await page.evaluate(MEASURE,RUNS)
+            print(f'{rows:>6}{result["nodes"]:>8}{result["count"]:>10}{result["best"]:>8.1f}ms{result["median"]:>8.1f}ms{result["cached"]:>8.3f}ms')
+        await browser.close()
+
+if __name__=='__main__':
+    asyncio.run(main())
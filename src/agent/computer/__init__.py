@@ -2,10 +2,13 @@ from src.agent.computer.utils import extract_agent_data,read_markdown_file
 from src.message import AIMessage,HumanMessage,SystemMessage
 from langgraph.graph import StateGraph,START,END
 from src.agent.web import WebAgent,BrowserConfig
+from src.agent.web.browser.pool import BrowserPool
 from src.agent.computer.state import AgentState
+from src.agent.parser import StreamParser
 from src.agent.terminal import TerminalAgent
 from src.agent.system import SystemAgent
 from src.inference import BaseInference
+from src.inference.usage import UsageLedger
 from src.agent import BaseAgent
 from termcolor import colored
 from datetime import datetime
@@ -15,7 +18,7 @@ import platform
 
 class ComputerAgent(BaseAgent):
     def __init__(self, llm:BaseInference=None, use_vision:bool=False, max_iteration:int=10, 
-                 token_usage:bool=False, verbose:bool=False, use_tts:bool=False, tts=None):
+                 token_usage:bool=False, verbose:bool=False, use_tts:bool=False, tts=None, streaming:bool=False, browser_pool:BrowserPool=None):
         self.name='Computer Agent'
         self.description='This agent tries to simulate a human using the computer'
         self.system_prompt=read_markdown_file('src/agent/computer/prompt/system.md')
@@ -26,12 +29,20 @@ class ComputerAgent(BaseAgent):
         self.verbose=verbose
         self.token_usage=token_usage
         self.use_vision=use_vision
+        self.streaming=streaming
         self.use_tts = use_tts
         self.tts = tts
+        # Created on the first web task and kept open so later tasks reuse the browser
+        self.browser_pool=browser_pool
         self.graph=self.create_graph()
 
     def reason(self,state:AgentState):    
-        message=self.llm.invoke(state.get('messages'))
+        if self.streaming:
+            # Stop reading the completion as soon as the delegated request is known
+            parser=StreamParser(stop_tags={'Request':'Agent','Final-Answer':'Final'}).parse_stream(self.llm.stream(state.get('messages')))
+            message=AIMessage(parser.text)
+        else:
+            message=self.llm.invoke(state.get('messages'))
         agent_data=extract_agent_data(message.content)
         thought=agent_data.get('Thought')
         route=agent_data.get('Route')
@@ -59,8 +70,9 @@ class ComputerAgent(BaseAgent):
         if self.use_tts and self.tts:
             self.tts.speak(f"Using {agent_name} to {agent_request}")
             
-        config=BrowserConfig(browser='edge',headless=False)
-        agent=WebAgent(config=config,llm=self.llm,max_iteration=self.max_iteration,verbose=self.verbose,use_vision=self.use_vision,token_usage=self.token_usage)
+        if self.browser_pool is None:
+            self.browser_pool=BrowserPool(BrowserConfig(browser='edge',headless=False))
+        agent=WebAgent(pool=self.browser_pool,llm=self.llm,max_iteration=self.max_iteration,verbose=self.verbose,use_vision=self.use_vision,token_usage=self.token_usage,streaming=self.streaming)
         agent_response=agent.invoke(agent_request)
         human_prompt=self.human_prompt.format(agent=agent_name,response=agent_response)
         message=HumanMessage(human_prompt)
@@ -93,7 +105,7 @@ class ComputerAgent(BaseAgent):
         if self.use_tts and self.tts:
             self.tts.speak(f"Using {agent_name} to {agent_request}")
             
-        agent=TerminalAgent(llm=self.llm,max_iteration=self.max_iteration,verbose=self.verbose,token_usage=self.token_usage)
+        agent=TerminalAgent(llm=self.llm,max_iteration=self.max_iteration,verbose=self.verbose,token_usage=self.token_usage,streaming=self.streaming)
         agent_response=agent.invoke(agent_request)
         human_prompt=self.human_prompt.format(agent=agent_name,response=agent_response)
         message=HumanMessage(human_prompt)
@@ -126,7 +138,7 @@ class ComputerAgent(BaseAgent):
         if self.use_tts and self.tts:
             self.tts.speak(f"Using {agent_name} to {agent_request}")
             
-        agent=SystemAgent(llm=self.llm,max_iteration=self.max_iteration,verbose=self.verbose,use_vision=self.use_vision,token_usage=self.token_usage)
+        agent=SystemAgent(llm=self.llm,max_iteration=self.max_iteration,verbose=self.verbose,use_vision=self.use_vision,token_usage=self.token_usage,streaming=self.streaming)
         agent_response=agent.invoke(agent_request)
         human_prompt=self.human_prompt.format(agent=agent_name,response=agent_response)
         message=HumanMessage(human_prompt)
@@ -208,26 +220,36 @@ class ComputerAgent(BaseAgent):
        if self.use_tts and self.tts:
             self.tts.speak(f"Starting new task: {input}")
             
-       parameters={
-           'username': getuser(),
-           'os': platform.platform(),
-           'pc_name': platform.node(),
-           'home_dir': Path.home().as_posix(),
-           'datetime': datetime.now().strftime('%Y-%m-%d'),
-       }
-       state={
-           'input':input,
-           'agent_data':{},
-           'messages':[SystemMessage(self.system_prompt.format(**parameters)),HumanMessage(f'Task: {input}')],
-           'output':'',
-           'route':'',
-           'agent_name':'',
-           'agent_request':'',
-           'agent_response':''
-       }
-       agent_response=self.graph.invoke(state)
-       return agent_response.get('output')
+       with UsageLedger() as self.usage:
+           parameters={
+               'username': getuser(),
+               'os': platform.platform(),
+               'pc_name': platform.node(),
+               'home_dir': Path.home().as_posix(),
+               'datetime': datetime.now().strftime('%Y-%m-%d'),
+           }
+           state={
+               'input':input,
+               'agent_data':{},
+               'messages':[SystemMessage(self.system_prompt.format(**parameters)),HumanMessage(f'Task: {input}')],
+               'output':'',
+               'route':'',
+               'agent_name':'',
+               'agent_request':'',
+               'agent_response':''
+           }
+           agent_response=self.graph.invoke(state)
+           output=agent_response.get('output')
+       if self.token_usage:
+           print(self.usage.summary(self.name))
+       return output
 
     def stream(self,input:str):
         pass
 
+    def close(self):
+        '''Close the browsers kept for the web tasks'''
+        if self.browser_pool is not None:
+            self.browser_pool.close()
+            self.browser_pool=None
+
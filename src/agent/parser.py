@@ -0,0 +1,75 @@
+from typing import Generator,AsyncGenerator
+import re
+
+TAGS=['Thought','Action-Name','Action-Input','Agent-Name','Request','Final-Answer','Route']
+
+# Only the tags of the response format, so markup quoted inside a thought is not mistaken for one
+TAG_PATTERN=re.compile(rf'<({"|".join(TAGS)})>(.*?)</\1>',re.DOTALL)
+
+class StreamParser:
+    '''
+    Incrementally parses the `<Tag>...</Tag>` response format of the agents while the tokens are streamed.
+
+    `stop_tags` maps a tag to the route it implies, once any of them is closed the response is actionable
+    and the rest of the completion (usually just the `<Route>` tag) no longer needs to be awaited.
+    '''
+    def __init__(self,stop_tags:dict[str,str]={'Action-Input':'Action','Final-Answer':'Final'}):
+        self.stop_tags=stop_tags
+        self.buffer=''
+        self.position=0
+        self.tags:dict[str,str]={}
+        self.stop_tag:str=None
+
+    @property
+    def done(self)->bool:
+        return self.stop_tag is not None
+
+    @property
+    def route(self)->str|None:
+        return self.tags.get('Route') or self.stop_tags.get(self.stop_tag)
+
+    @property
+    def text(self)->str:
+        '''The response so far, closed with the implied route if the stream was cut short'''
+        if self.done and 'Route' not in self.tags:
+            # The buffer may already hold the start of the next tag, only what precedes it is kept
+            return f'{self.buffer[:self.position].rstrip()}\n<Route>{self.route}</Route>\n</Option>'
+        return self.buffer
+
+    def feed(self,chunk:str)->list[tuple[str,str]]:
+        '''Add a chunk of the stream and return the tags that got closed by it'''
+        self.buffer+=chunk
+        closed=[]
+        while not self.done:
+            match=TAG_PATTERN.search(self.buffer,self.position)
+            if match is None:
+                break
+            tag,value=match.group(1),match.group(2).strip()
+            self.position=match.end()
+            self.tags[tag]=value
+            closed.append((tag,value))
+            if tag in self.stop_tags:
+                self.stop_tag=tag
+        return closed
+
+    def parse_stream(self,stream:Generator[str,None,None])->'StreamParser':
+        '''Consume the stream until the response is actionable'''
+        try:
+            for chunk in stream:
+                self.feed(chunk)
+                if self.done:
+                    break
+        finally:
+            stream.close()
+        return self
+
+    async def async_parse_stream(self,stream:AsyncGenerator[str,None])->'StreamParser':
+        '''Consume the stream until the response is actionable'''
+        try:
+            async for chunk in stream:
+                self.feed(chunk)
+                if self.done:
+                    break
+        finally:
+            await stream.aclose()
+        return self
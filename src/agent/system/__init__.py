@@ -5,8 +5,11 @@ from langgraph.graph import StateGraph,START,END
 from src.agent.system.state import AgentState
 from src.memory.episodic import EpisodicMemory
 from src.agent.system.registry import Registry
+from src.agent.parser import StreamParser
 from src.agent.system.desktop import Desktop
+from src.image.config import ImageConfig
 from src.inference import BaseInference
+from src.inference.usage import UsageLedger
 from src.agent import BaseAgent
 from datetime import datetime
 from termcolor import colored
@@ -26,11 +29,11 @@ tools=[
 ]
 
 class SystemAgent(BaseAgent):
-    def __init__(self,instructions:list[str]=[],llm:BaseInference=None,episodic_memory:EpisodicMemory=None,use_vision:bool=False,max_iteration:int=10,verbose:bool=False,token_usage:bool=False) -> None:
+    def __init__(self,instructions:list[str]=[],llm:BaseInference=None,episodic_memory:EpisodicMemory=None,use_vision:bool=False,image_config:ImageConfig=None,max_iteration:int=10,verbose:bool=False,token_usage:bool=False,streaming:bool=False) -> None:
         self.name='System Agent'
         self.description='The System Agent is an AI-powered automation tool designed to interact with the operating system. It simulates human actions, such as opening applications, clicking buttons, typing, scrolling, and performing other system-level tasks.'
         self.registry=Registry(tools)
-        self.desktop=Desktop()
+        self.desktop=Desktop(image_config)
         self.instructions=self.format_instructions(instructions)
         self.system_prompt=read_markdown_file(f'./src/agent/system/prompt/system.md')
         self.observation_prompt=read_markdown_file(f'./src/agent/system/prompt/observation.md')
@@ -40,6 +43,7 @@ class SystemAgent(BaseAgent):
         self.graph=self.create_graph()
         self.max_iteration=max_iteration
         self.use_vision=use_vision
+        self.streaming=streaming
         self.token_usage=token_usage
         self.verbose=verbose
         self.iteration=0
@@ -49,7 +53,12 @@ class SystemAgent(BaseAgent):
         return '\n'.join([f'{i+1}. {instruction}' for (i,instruction) in enumerate(instructions)])
 
     def reason(self,state:AgentState):
-        ai_message=self.llm.invoke(state.get('messages'))
+        if self.streaming:
+            # Stop reading the completion as soon as the action is known
+            parser=StreamParser().parse_stream(self.llm.stream(state.get('messages')))
+            ai_message=AIMessage(parser.text)
+        else:
+            ai_message=self.llm.invoke(state.get('messages'))
         agent_data=extract_agent_data(ai_message.content)
         thought=agent_data.get('Thought')
         route=agent_data.get('Route')
@@ -70,18 +79,28 @@ class SystemAgent(BaseAgent):
         observation=action_result.content
         if self.verbose:
             print(colored(f'Observation: {observation}',color='green',attrs=['bold']))
+        desktop_state=self.desktop.get_state(use_vision=self.use_vision)
+        image_obj=desktop_state.screenshot
+        # No screenshot in vision mode means the screen has not changed
+        unchanged=self.use_vision and image_obj is None
         state['messages'].pop() # Remove the last message (AI Message) for modification
         last_message=state['messages'][-1] #ImageMessage/HumanMessage
-        if isinstance(last_message,(ImageMessage,HumanMessage)):
+        if unchanged and isinstance(last_message,ImageMessage):
+            # The last screenshot stays in the history instead of the same one being sent again
+            state['messages'][-1]=last_message.with_text(f'<Observation>{state.get('prev_observation')}</Observation>')
+        elif isinstance(last_message,(ImageMessage,HumanMessage)):
             state['messages'][-1]=HumanMessage(f'<Observation>{state.get('prev_observation')}</Observation>')
+        if self.use_vision and not unchanged:
+            # Only the latest screenshot is kept
+            state['messages'][:]=[HumanMessage(message.content[0]) if isinstance(message,ImageMessage) else message for message in state['messages']]
         if self.verbose and self.token_usage:
             print(f'Input Tokens: {self.llm.tokens.input} Output Tokens: {self.llm.tokens.output} Total Tokens: {self.llm.tokens.total}')
-        desktop_state=self.desktop.get_state(use_vision=self.use_vision)
-        image_obj=desktop_state.screenshot
         # print(desktop_state.tree_state.elements_to_string())
         ai_prompt=self.action_prompt.format(thought=thought,action_name=action_name,action_input=json.dumps(action_input,indent=2),route=route)
         user_prompt=self.observation_prompt.format(observation=observation,active_app=desktop_state.active_app,apps=desktop_state.apps_to_string(),interactive_elements=desktop_state.tree_state.elements_to_string())
-        messages=[AIMessage(ai_prompt),ImageMessage(text=user_prompt,image_obj=image_obj) if self.use_vision else HumanMessage(user_prompt)]
+        if unchanged:
+            user_prompt+='\nThe screen has not changed since the last screenshot.'
+        messages=[AIMessage(ai_prompt),ImageMessage(text=user_prompt,image_obj=image_obj) if self.use_vision and not unchanged else HumanMessage(user_prompt)]
         return {**state,'agent_data':agent_data,'messages':messages,'prev_observation':observation}
 
     def final(self,state:AgentState):
@@ -125,33 +144,39 @@ class SystemAgent(BaseAgent):
     def invoke(self,input:str):
         if self.verbose:
             print(f'Entering '+colored(self.name,'black','on_white'))
-        system_prompt=self.system_prompt.format(**{
-            'instructions':self.instructions,
-            'current_datetime':datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'actions_prompt':self.registry.actions_prompt(),
-            'os':platform.system(),
-            'home_dir':Path.home().as_posix(),
-            'user':getuser()
-        })
-        # Attach episodic memory to the system prompt 
-        if self.episodic_memory and self.episodic_memory.retrieve(input):
-            system_prompt=self.episodic_memory.attach_memory(system_prompt)
-        desktop_state=self.desktop.get_state(use_vision=self.use_vision)
-        image_obj=desktop_state.screenshot
-        interactive_elements=desktop_state.tree_state.elements_to_string()
-        apps=desktop_state.apps_to_string()
-        active_app=desktop_state.active_app
-        human_prompt=self.observation_prompt.format(observation="No Action",active_app=active_app,apps=apps,interactive_elements=interactive_elements)
-        messages=[SystemMessage(system_prompt),HumanMessage(f'Task: {input}')]+[ImageMessage(text=human_prompt,image_obj=image_obj) if self.use_vision else HumanMessage(human_prompt)]
-        state={
-            'input':input,
-            'agent_data':{},
-            'route':'',
-            'output':'',
-            'messages':messages
-        }
-        graph_response=self.graph.invoke(state)
-        return graph_response.get('output')
+        with UsageLedger() as self.usage:
+            system_prompt=self.system_prompt.format(**{
+                'instructions':self.instructions,
+                'current_datetime':datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'actions_prompt':self.registry.actions_prompt(),
+                'os':platform.system(),
+                'home_dir':Path.home().as_posix(),
+                'user':getuser()
+            })
+            # Attach episodic memory to the system prompt 
+            if self.episodic_memory and self.episodic_memory.retrieve(input):
+                system_prompt=self.episodic_memory.attach_memory(system_prompt)
+            # The frames of a previous run were never seen by this conversation
+            self.desktop.images.reset()
+            desktop_state=self.desktop.get_state(use_vision=self.use_vision)
+            image_obj=desktop_state.screenshot
+            interactive_elements=desktop_state.tree_state.elements_to_string()
+            apps=desktop_state.apps_to_string()
+            active_app=desktop_state.active_app
+            human_prompt=self.observation_prompt.format(observation="No Action",active_app=active_app,apps=apps,interactive_elements=interactive_elements)
+            messages=[SystemMessage(system_prompt),HumanMessage(f'Task: {input}')]+[ImageMessage(text=human_prompt,image_obj=image_obj) if self.use_vision else HumanMessage(human_prompt)]
+            state={
+                'input':input,
+                'agent_data':{},
+                'route':'',
+                'output':'',
+                'messages':messages
+            }
+            graph_response=self.graph.invoke(state)
+            output=graph_response.get('output')
+        if self.token_usage:
+            print(self.usage.summary(self.name))
+        return output
 
     def stream(self,input:str):
         pass
\ No newline at end of file
@@ -1,17 +1,18 @@
 from src.agent.system.desktop.views import DesktopState,App
 from src.agent.system.tree import Tree,TreeElementNode
+from src.image import ImagePipeline,ImageConfig
 from pygetwindow import getActiveWindow
 from uiautomation import GetRootControl
 from datetime import datetime
 from pathlib import Path
-from io import BytesIO
 from PIL import Image
 from os import getcwd
 import pyautogui
 
 class Desktop:
-    def __init__(self):
+    def __init__(self,image_config:ImageConfig=None):
         self.desktop_state=None
+        self.images=ImagePipeline(image_config)
     def get_state(self,use_vision:bool=False):
         tree=Tree(self)
         active_window=getActiveWindow()
@@ -31,15 +32,16 @@ class Desktop:
             raise ValueError(f'Invalid index {index}')
         return selector_map.get(index)
     
+    def screen_unchanged(self,screenshot:Image)->bool:
+        '''Whether the screen looks as it did on the previous call'''
+        return self.images.config.skip_unchanged and self.images.unchanged(screenshot)
+
     def get_screenshot(self)->Image:
         screenshot=pyautogui.screenshot()
         return screenshot
     
     def screenshot_in_bytes(self,screenshot:Image)->bytes:
-        io=BytesIO()
-        screenshot.save(io,format='PNG')
-        bytes=io.getvalue()
-        return bytes
+        return self.images.process(screenshot)
     
     def save_screenshot(self,screenshot:Image):
         date_time=datetime.now().strftime('%Y_%m_%d_%H_%M_%S')
@@ -2,12 +2,23 @@ from src.agent.system.tree.views import TreeElementNode,BoundingBox,CenterCord,T
 from uiautomation import GetRootControl,Control,ControlFromPoint
 from src.agent.system.tree.config import INTERACTIVE_CONTROL_TYPE_NAMES
 from PIL import Image,ImageDraw,ImageFont
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING,Container
+from hashlib import blake2b
 import random
 
 if TYPE_CHECKING:
     from src.agent.system.desktop import Desktop
 
+# Ids are derived from the content of an element, so it keeps its id across observations and sessions
+ID_SPACE=1_000_000
+
+def stable_id(key:str,taken:Container[int])->int:
+    '''The hash of the key folded into ID_SPACE, a collision takes the next free id'''
+    id=int.from_bytes(blake2b(key.encode(),digest_size=4).digest())%ID_SPACE
+    while id in taken:
+        id=(id+1)%ID_SPACE
+    return id
+
 class Tree:
     def __init__(self,desktop:'Desktop'):
         self.desktop=desktop
@@ -15,12 +26,14 @@ class Tree:
     def get_state(self,use_vision:bool=False)->tuple[bytes,TreeState]:
         root=GetRootControl()
         nodes=self.get_interactive_nodes(node=root)
-        if use_vision:
-            annotate=self.annotate(nodes=nodes,save_screenshot=False)
+        selector_map=self.build_selector_map(nodes=nodes)
+        screenshot=self.desktop.get_screenshot() if use_vision else None
+        # The labels are only drawn when the screen differs from what the agent last saw
+        if use_vision and not self.desktop.screen_unchanged(screenshot):
+            annotate=self.annotate(selector_map=selector_map,screenshot=screenshot,save_screenshot=False)
             screenshot=self.desktop.screenshot_in_bytes(screenshot=annotate)
         else:
             screenshot=None
-        selector_map=self.build_selector_map(nodes=nodes)
         return (screenshot,TreeState(nodes=nodes,selector_map=selector_map))
 
     def get_interactive_nodes(self, node: Control) -> list[TreeElementNode]:
@@ -43,7 +56,7 @@ class Tree:
             is_offscreen=not node.IsOffscreen
             return area > threshold and is_offscreen
             
-        def tree_traversal(node: Control):
+        def tree_traversal(node: Control, window: str = ''):
             if is_element_interactive(node) and not is_window_minimized(node):
                 box = node.BoundingRectangle
                 bounding_box = BoundingBox(
@@ -59,20 +72,22 @@ class Tree:
                     shortcut=node.AcceleratorKey,
                     bounding_box=bounding_box,
                     center=center,
-                    handle=node
+                    handle=node,
+                    window=window
                 ))
-            # Recursively check all children
+            # Recursively check all children, the children of the root are the top level windows
             for child in node.GetChildren():
-                tree_traversal(child)
+                tree_traversal(child, window or child.Name)
 
         tree_traversal(node)
         return interactive_nodes
 
-    def get_random_color(self):
-        return "#{:06x}".format(random.randint(0, 0xFFFFFF))
+    def get_random_color(self,label:int):
+        # Seeded with the label so an unchanged element is drawn the same on every screenshot
+        return "#{:06x}".format(random.Random(label).randint(0, 0xFFFFFF))
 
-    def annotate(self,nodes:list[TreeElementNode],save_screenshot:bool=False)->Image:
-        screenshot=self.desktop.get_screenshot()
+    def annotate(self,selector_map:dict[int,TreeElementNode],screenshot:Image=None,save_screenshot:bool=False)->Image:
+        screenshot=screenshot if screenshot else self.desktop.get_screenshot()
         # Include padding to the screenshot
         padding=20
         width=screenshot.width+(2*padding)
@@ -86,9 +101,9 @@ class Tree:
             font=ImageFont.truetype('arial.ttf',font_size)
         except:
             font=ImageFont.load_default()
-        for label,node in enumerate(nodes):
+        for label,node in selector_map.items():
             box=node.bounding_box
-            color=self.get_random_color()
+            color=self.get_random_color(label)
             # Adjust bounding box to fit padded image
             adjusted_box = (
                 box.left + padding, box.top + padding,  # Adjust top-left corner
@@ -124,8 +139,16 @@ class Tree:
     def get_annotated_image_data(self,save_screenshot=False)->tuple[Image,list[TreeElementNode]]:
         root=GetRootControl()
         nodes=self.get_interactive_nodes(node=root)
-        screenshot=self.annotate(nodes=nodes,save_screenshot=save_screenshot)
+        screenshot=self.annotate(selector_map=self.build_selector_map(nodes=nodes),save_screenshot=save_screenshot)
         return screenshot,nodes
 
     def build_selector_map(self, nodes: list[TreeElementNode]) -> dict[int, TreeElementNode]:
-        return {index:node for index,node in enumerate(nodes)}
\ No newline at end of file
+        '''Key the nodes on ids derived from their window, control type, name and shortcut, identical nodes are told apart by their order'''
+        selector_map={}
+        occurrences={}
+        for node in nodes:
+            key=f'{node.window}|{node.control_type}|{node.name}|{node.shortcut}'
+            occurrence=occurrences.get(key,0)
+            occurrences[key]=occurrence+1
+            selector_map[stable_id(f'{key}#{occurrence}',selector_map)]=node
+        return selector_map
\ No newline at end of file
@@ -7,7 +7,7 @@ class TreeState:
     selector_map:dict[int,'TreeElementNode']=field(default_factory={})
 
     def elements_to_string(self)->str:
-        return '\n'.join([f'Label: {index} - ControlType: {node.control_type} Name: {node.name}' for index,node in enumerate(self.nodes)])
+        return '\n'.join([f'Label: {id} - ControlType: {node.control_type} Name: {node.name}' for id,node in self.selector_map.items()])
 
 @dataclass
 class BoundingBox:
@@ -29,6 +29,8 @@ class TreeElementNode:
     bounding_box:BoundingBox
     center:CenterCord
     handle:Control
+    # The name of the top level window holding the element
+    window:str=''
 
     def __repr__(self):
         return f'TreeElementNode(name={self.name},control_type={self.control_type},shortcut={self.shortcut},bounding_box={self.bounding_box},center={self.center})'
\ No newline at end of file
@@ -1,11 +1,13 @@
 from src.agent.terminal.utils import extract_agent_data,read_markdown_file
 from src.message import AIMessage,HumanMessage,SystemMessage
 from src.agent.terminal.registry import Registry
+from src.agent.parser import StreamParser
 from langgraph.graph import StateGraph,START,END
 from src.agent.terminal.tools import shell_tool
 from src.agent.terminal.state import AgentState
 from src.memory.episodic import EpisodicMemory
 from src.inference import BaseInference
+from src.inference.usage import UsageLedger
 from src.agent import BaseAgent
 from termcolor import colored
 from platform import platform
@@ -20,11 +22,12 @@ tools=[
 ]
 
 class TerminalAgent(BaseAgent):
-    def __init__(self,instructions:list[str]=[],episodic_memory:EpisodicMemory=None,additional_tools:list[Tool]=[],llm:BaseInference=None,verbose:bool=False,max_iteration:int=10,token_usage:bool=False):
+    def __init__(self,instructions:list[str]=[],episodic_memory:EpisodicMemory=None,additional_tools:list[Tool]=[],llm:BaseInference=None,verbose:bool=False,max_iteration:int=10,token_usage:bool=False,streaming:bool=False):
         self.name='Terminal Agent'
         self.description='The Terminal Agent is an AI-powered automation tool designed to interact with the terminal. It simulates human actions, such as running shell commands, executing scripts, and performing other terminal-level tasks.'
         self.llm=llm
         self.verbose=verbose
+        self.streaming=streaming
         self.max_iteration=max_iteration
         self.iteration=0
         self.instructions=self.format_instructions(instructions)
@@ -41,7 +44,12 @@ class TerminalAgent(BaseAgent):
         return '\n'.join([f'{i+1}. {instruction}' for (i,instruction) in enumerate(instructions)])
 
     def reason(self,state:AgentState):
-        llm_response=self.llm.invoke(state.get('messages'))
+        if self.streaming:
+            # Stop reading the completion as soon as the action is known
+            parser=StreamParser().parse_stream(self.llm.stream(state.get('messages')))
+            llm_response=AIMessage(parser.text)
+        else:
+            llm_response=self.llm.invoke(state.get('messages'))
         # print(llm_response.content)
         agent_data=extract_agent_data(llm_response.content)
         thought=agent_data.get('Thought')
@@ -110,31 +118,35 @@ class TerminalAgent(BaseAgent):
     def invoke(self,input:str):
         if self.verbose:
             print(f'Entering '+colored(self.name,'black','on_white'))
-        parameters={
-            'instructions':self.instructions,
-            'current_datetime':datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'actions_prompt':self.registry.actions_prompt(),
-            'os':platform(),
-            'home_dir':Path.home().as_posix(),
-            'user':getuser(),
-        }
-        system_prompt=self.system_prompt.format(**parameters)
-        # Attach episodic memory to the system prompt 
-        if self.episodic_memory and self.episodic_memory.retrieve(input):
-            system_prompt=self.episodic_memory.attach_memory(system_prompt)
-        human_prompt=f'Task: {input}'
-        state={
-            'input':input,
-            'messages':[SystemMessage(system_prompt),HumanMessage(human_prompt)],
-            'agent_data':{},
-            'router':'',
-            'output':''
-        }
-        response=self.graph.invoke(state)
-        # Extract and store the key takeaways of the task performed by the agent
-        if self.episodic_memory:
-            self.episodic_memory.store(response.get('messages'))
-        return response.get('output')
+        with UsageLedger() as self.usage:
+            parameters={
+                'instructions':self.instructions,
+                'current_datetime':datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'actions_prompt':self.registry.actions_prompt(),
+                'os':platform(),
+                'home_dir':Path.home().as_posix(),
+                'user':getuser(),
+            }
+            system_prompt=self.system_prompt.format(**parameters)
+            # Attach episodic memory to the system prompt 
+            if self.episodic_memory and self.episodic_memory.retrieve(input):
+                system_prompt=self.episodic_memory.attach_memory(system_prompt)
+            human_prompt=f'Task: {input}'
+            state={
+                'input':input,
+                'messages':[SystemMessage(system_prompt),HumanMessage(human_prompt)],
+                'agent_data':{},
+                'router':'',
+                'output':''
+            }
+            response=self.graph.invoke(state)
+            # Extract and store the key takeaways of the task performed by the agent
+            if self.episodic_memory:
+                self.episodic_memory.store(response.get('messages'))
+            output=response.get('output')
+        if self.token_usage:
+            print(self.usage.summary(self.name))
+        return output
 
     def stream(self,input:str):
         pass
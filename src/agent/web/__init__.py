@@ -2,27 +2,34 @@ from src.agent.web.tools import click_tool,goto_tool,type_tool,scroll_tool,wait_
 from src.message import SystemMessage,HumanMessage,ImageMessage,AIMessage
 from src.agent.web.utils import read_markdown_file,extract_agent_data
 from src.agent.web.browser import Browser,BrowserConfig
+from src.agent.web.browser.pool import BrowserPool
 from src.agent.web.context import Context,ContextConfig
 from langgraph.graph import StateGraph,END,START
 from src.memory.episodic import EpisodicMemory
 from src.agent.web.registry import Registry
+from src.agent.parser import StreamParser
 from src.agent.web.state import AgentState
 from src.inference import BaseInference
+from src.inference.usage import UsageLedger
 from src.agent import BaseAgent
 from datetime import datetime
 from termcolor import colored
+from copy import copy
 from src.tool import Tool
+from typing import Coroutine,TypeVar
 import nest_asyncio
 import asyncio
 import json
 
+T=TypeVar('T')
+
 main_tools=[
     download_tool,click_tool,goto_tool,type_tool,scroll_tool,
     wait_tool,back_tool,key_tool,tab_tool,upload_tool
 ]
 
 class WebAgent(BaseAgent):
-    def __init__(self,config:BrowserConfig=None,additional_tools:list[Tool]=[],instructions:list=[],episodic_memory:EpisodicMemory=None,llm:BaseInference=None,max_iteration:int=10,use_vision:bool=False,verbose:bool=False,token_usage:bool=False) -> None:
+    def __init__(self,config:BrowserConfig=None,additional_tools:list[Tool]=[],instructions:list=[],context_config:ContextConfig=None,pool:BrowserPool=None,episodic_memory:EpisodicMemory=None,llm:BaseInference=None,max_iteration:int=10,use_vision:bool=False,verbose:bool=False,token_usage:bool=False,streaming:bool=False) -> None:
         self.name='Web Agent'
         self.description='The web agent is designed to automate the process of gathering information from the internet, such as to navigate websites, perform searches, and retrieve data.'
         self.observation_prompt=read_markdown_file('./src/agent/web/prompt/observation.md')
@@ -31,12 +38,15 @@ class WebAgent(BaseAgent):
         self.answer_prompt=read_markdown_file('./src/agent/web/prompt/answer.md')
         self.instructions=self.format_instructions(instructions)
         self.registry=Registry(main_tools+additional_tools)
-        self.browser=Browser(config=config)
-        self.context=Context(self.browser,ContextConfig())
+        # With a pool the browser and the context are borrowed for each task
+        self.pool=pool
+        self.browser=Browser(config=config) if pool is None else None
+        self.context=Context(self.browser,context_config if context_config else ContextConfig()) if pool is None else None
         self.episodic_memory=episodic_memory
         self.max_iteration=max_iteration
         self.token_usage=token_usage
         self.use_vision=use_vision
+        self.streaming=streaming
         self.verbose=verbose
         self.iteration=0
         self.llm=llm
@@ -47,7 +57,12 @@ class WebAgent(BaseAgent):
 
     async def reason(self,state:AgentState):
         "Call LLM to make decision"
-        ai_message=await self.llm.async_invoke(state.get('messages'))
+        if self.streaming:
+            # Stop reading the completion as soon as the action is known
+            parser=await StreamParser().async_parse_stream(self.llm.async_stream(state.get('messages')))
+            ai_message=AIMessage(parser.text)
+        else:
+            ai_message=await self.llm.async_invoke(state.get('messages'))
         # print(ai_message.content)
         agent_data=extract_agent_data(ai_message.content)
         thought=agent_data.get('Thought')
@@ -71,20 +86,35 @@ class WebAgent(BaseAgent):
         observation=action_result.content
         if self.verbose:
             print(colored(f'Observation: {observation}',color='green',attrs=['bold']))
+        # The first screenshot of a conversation is always sent
+        if self.use_vision and not any(isinstance(message,ImageMessage) for message in state['messages']):
+            self.context.images.reset()
+        # Get the current browser state
+        browser_state=await self.context.get_state(use_vision=self.use_vision)
+        image_obj=browser_state.screenshot
+        # No screenshot in vision mode means the screen has not changed
+        unchanged=self.use_vision and image_obj is None
         state['messages'].pop() # Remove the last message for modification
         last_message=state['messages'][-1] # ImageMessage/HumanMessage
-        if isinstance(last_message,(ImageMessage,HumanMessage)):
+        if unchanged and isinstance(last_message,ImageMessage):
+            # The last screenshot stays in the history instead of the same one being sent again
+            state['messages'][-1]=last_message.with_text(f'<Observation>{state.get('prev_observation')}</Observation>')
+        elif isinstance(last_message,(ImageMessage,HumanMessage)):
             state['messages'][-1]=HumanMessage(f'<Observation>{state.get('prev_observation')}</Observation>')
+        if self.use_vision and not unchanged:
+            # Only the latest screenshot is kept
+            state['messages'][:]=[HumanMessage(message.content[0]) if isinstance(message,ImageMessage) else message for message in state['messages']]
         if self.verbose and self.token_usage:
             print(f'Input Tokens: {self.llm.tokens.input} Output Tokens: {self.llm.tokens.output} Total Tokens: {self.llm.tokens.total}')
-        # Get the current browser state
-        browser_state=await self.context.get_state(use_vision=self.use_vision)
-        image_obj=browser_state.screenshot
         # print('Tabs',browser_state.tabs_to_string())
         # Redefining the AIMessage and adding the new observation
         action_prompt=self.action_prompt.format(thought=thought,action_name=action_name,action_input=json.dumps(action_input,indent=2),route=route)
-        observation_prompt=self.observation_prompt.format(observation=observation,current_url=browser_state.url,tabs=browser_state.tabs_to_string(),interactive_elements=browser_state.dom_state.elements_to_string())
-        messages=[AIMessage(action_prompt),ImageMessage(text=observation_prompt,image_obj=image_obj) if self.use_vision else HumanMessage(observation_prompt)]
+        config=self.context.config
+        interactive_elements=browser_state.dom_state.elements_to_string(state.get('input'),budget=config.observation_budget,max_length=config.max_value_length)
+        observation_prompt=self.observation_prompt.format(observation=observation,current_url=browser_state.url,tabs=browser_state.tabs_to_string(),interactive_elements=interactive_elements)
+        if unchanged:
+            observation_prompt+='\nThe screen has not changed since the last screenshot.'
+        messages=[AIMessage(action_prompt),ImageMessage(text=observation_prompt,image_obj=image_obj) if self.use_vision and not unchanged else HumanMessage(observation_prompt)]
         return {**state,'agent_data':agent_data,'messages':messages,'prev_observation':observation}
 
     def final(self,state:AgentState):
@@ -128,7 +158,7 @@ class WebAgent(BaseAgent):
 
         return graph.compile(debug=False)
     
-    async def async_invoke(self, input: str):
+    def initial_state(self,input:str)->AgentState:
         actions_prompt=self.registry.actions_prompt()
         current_datetime=datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         system_prompt=self.system_prompt.format(**{
@@ -141,30 +171,100 @@ class WebAgent(BaseAgent):
             system_prompt=self.episodic_memory.attach_memory(system_prompt)
         human_prompt=f'Task: {input}'
         messages=[SystemMessage(system_prompt),HumanMessage(human_prompt)]
-        state={
+        return {
             'input':input,
             'agent_data':{},
             'output':'',
             'route':'',
             'messages':messages
         }
-        response=await self.graph.ainvoke(state)
-        await self.close()
-        # Extract and store the key takeaways of the task performed by the agent
-        if self.episodic_memory:
-            self.episodic_memory.store(response.get('messages'))
-        return response.get('output')
-        
-    def invoke(self, input: str)->str:
-        if self.verbose:
-            print(f'Entering '+colored(self.name,'black','on_white'))
+
+    async def run(self,coroutine:Coroutine[None,None,T])->T:
+        '''Await the coroutine with a browser, borrowed from the pool or closed once it is done'''
+        if self.pool is None:
+            self.context.images.reset()
+            try:
+                return await coroutine
+            finally:
+                await self.close()
+        lease=await self.pool.acquire()
+        self.browser,self.context=lease.browser,lease.context
+        # A kept session still holds the frames of the previous task
+        self.context.images.reset()
+        try:
+            return await coroutine
+        finally:
+            self.browser,self.context=None,None
+            await self.pool.release(lease)
+    
+    async def async_invoke(self, input: str):
+        with UsageLedger() as self.usage:
+            state=self.initial_state(input)
+            response=await self.run(self.graph.ainvoke(state))
+            # Extract and store the key takeaways of the task performed by the agent
+            if self.episodic_memory:
+                self.episodic_memory.store(response.get('messages'))
+            output=response.get('output')
+        if self.token_usage:
+            print(self.usage.summary(self.name))
+        return output
+
+    async def async_parallel_invoke(self,tasks:list[str],concurrency:int=3)->str:
+        '''
+        Run independent tasks side by side, each by its own reasoning loop on its own tab of the same browser context,
+        at most `concurrency` at a time, and merge their answers.
+        '''
+        with UsageLedger() as self.usage:
+            outputs=await self.run(self.gather(tasks,concurrency))
+        if self.token_usage:
+            print(self.usage.summary(self.name))
+        return '\n\n'.join(f'Task: {task}\nAnswer: {output}' for task,output in zip(tasks,outputs))
+
+    async def gather(self,tasks:list[str],concurrency:int)->list[str]:
+        semaphore=asyncio.Semaphore(concurrency)
+        async def solve(task:str)->str:
+            async with semaphore:
+                context=await self.context.new_tab_context()
+                agent=self.tab_agent(context)
+                try:
+                    response=await agent.graph.ainvoke(agent.initial_state(task))
+                    return response.get('output')
+                except Exception as e:
+                    # One failed lookup should not lose the answers of the others
+                    return f'Failed: {e}'
+                finally:
+                    await context.close_session()
+        return await asyncio.gather(*[solve(task) for task in tasks])
+
+    def tab_agent(self,context:Context)->'WebAgent':
+        '''A copy of the agent with its own iteration count and graph, working on the given tab'''
+        agent=copy(self)
+        agent.context=context
+        agent.iteration=0
+        agent.graph=agent.create_graph()
+        return agent
+
+    def run_sync(self,coroutine:Coroutine[None,None,T])->T:
+        if self.pool is not None:
+            # The borrowed browser belongs to the loop of the pool
+            return self.pool.run(coroutine)
         try:
             # If there's no running event loop, use asyncio.run
-            return asyncio.run(self.async_invoke(input))
+            return asyncio.run(coroutine)
         except RuntimeError:
             nest_asyncio.apply()  # Allow nested event loops in notebooks
             loop = asyncio.get_event_loop()
-            return loop.run_until_complete(self.async_invoke(input))
+            return loop.run_until_complete(coroutine)
+        
+    def invoke(self, input: str)->str:
+        if self.verbose:
+            print(f'Entering '+colored(self.name,'black','on_white'))
+        return self.run_sync(self.async_invoke(input))
+
+    def parallel_invoke(self,tasks:list[str],concurrency:int=3)->str:
+        if self.verbose:
+            print(f'Entering '+colored(self.name,'black','on_white'))
+        return self.run_sync(self.async_parallel_invoke(tasks,concurrency))
 
     def stream(self, input:str):
         pass
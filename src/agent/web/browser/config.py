@@ -15,6 +15,15 @@ class BrowserConfig:
     timeout:int=60*1000
     slow_mo:int=300
 
+@dataclass
+class PoolConfig:
+    size:int=1
+    # Seconds before a browser is relaunched
+    max_age:float=30*60
+    health_timeout:float=5
+    # Carry the cookies and the last tab over to the next task instead of opening a fresh context
+    keep_session:bool=True
+
 SECURITY_ARGS = [
 	'--disable-web-security',
 	'--disable-site-isolation-trials',
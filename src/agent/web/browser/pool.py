@@ -0,0 +1,167 @@
+from src.agent.web.browser.config import BrowserConfig,PoolConfig
+from src.agent.web.context import Context,ContextConfig
+from src.agent.web.browser import Browser
+from dataclasses import dataclass,field
+from typing import Coroutine,TypeVar
+from threading import Thread
+from time import monotonic
+import asyncio
+import atexit
+
+T=TypeVar('T')
+
+@dataclass
+class Lease:
+    browser:Browser
+    context:Context
+    created:float=field(default_factory=monotonic)
+    uses:int=0
+
+class BrowserPool:
+    '''
+    Keeps browsers running between tasks so an agent borrows a warm browser instead of launching one.
+
+    Playwright objects belong to the event loop that created them, so the pool owns a loop on a background thread
+    and every agent using it runs its task there through `run`. A browser is recycled when it fails the health check
+    or is older than `max_age`, with `keep_session` the cookies and the last open tab carry over to the next task.
+    A browser that has to be relaunched or given a fresh context is refilled in the background after the task returns.
+
+    pool=BrowserPool(BrowserConfig(browser='edge',user_data_dir=None),PoolConfig(size=2))
+    agent=WebAgent(llm=llm,pool=pool)
+    '''
+    def __init__(self,config:BrowserConfig=None,pool_config:PoolConfig=None,context_config:ContextConfig=None):
+        self.config=config if config else BrowserConfig()
+        self.pool_config=pool_config if pool_config else PoolConfig()
+        self.context_config=context_config if context_config else ContextConfig()
+        if self.pool_config.size>1 and self.config.wss_url is None and self.config.user_data_dir is not None:
+            # Every browser of the pool would open the same persistent profile
+            raise ValueError('A pool of more than one browser needs a BrowserConfig without user_data_dir')
+        self.idle:list[Lease]=[]
+        self.leased=0
+        self.refills:set[asyncio.Task]=set()
+        self.loop=asyncio.new_event_loop()
+        self.thread=Thread(target=self.loop.run_forever,daemon=True,name='browser-pool')
+        self.thread.start()
+        self.available=asyncio.Condition()
+        atexit.register(self.close)
+
+    def run(self,coroutine:Coroutine[None,None,T])->T:
+        '''Run a coroutine on the loop of the pool and wait for its result'''
+        return asyncio.run_coroutine_threadsafe(coroutine,self.loop).result()
+
+    def warm(self):
+        '''Launch browsers until `size` are running'''
+        self.run(self.async_warm())
+
+    async def async_warm(self):
+        async with self.available:
+            while len(self.idle)+self.leased<self.pool_config.size:
+                self.idle.append(await self.launch())
+
+    async def launch(self)->Lease:
+        browser=Browser(config=self.config)
+        context=Context(browser,self.context_config)
+        await context.init_session()
+        return Lease(browser,context)
+
+    async def is_healthy(self,lease:Lease)->bool:
+        if monotonic()-lease.created>self.pool_config.max_age:
+            return False
+        session=lease.context.session
+        if session is None or session.current_page.is_closed():
+            return False
+        try:
+            await asyncio.wait_for(session.current_page.evaluate('1'),timeout=self.pool_config.health_timeout)
+        except Exception:
+            return False
+        return True
+
+    async def acquire(self)->Lease:
+        async with self.available:
+            while not self.idle and self.leased>=self.pool_config.size:
+                await self.available.wait()
+            self.leased+=1
+            lease=self.idle.pop() if self.idle else None
+        try:
+            if lease is not None and not await self.is_healthy(lease):
+                await self.discard(lease)
+                lease=None
+            if lease is None:
+                lease=await self.launch()
+        except Exception:
+            async with self.available:
+                self.leased-=1
+                self.available.notify()
+            raise
+        lease.uses+=1
+        return lease
+
+    async def release(self,lease:Lease):
+        '''Give the lease back, a kept session is tidied at once and anything slower is refilled in the background'''
+        if self.pool_config.keep_session and await self.is_healthy(lease):
+            try:
+                await self.reset(lease)
+            except Exception:
+                await self.discard(lease)
+                lease=None
+            await self.restore(lease)
+        else:
+            # The slot stays leased until the refill is done so waiting tasks are not handed a half closed browser
+            task=asyncio.create_task(self.refill(lease))
+            self.refills.add(task)
+            task.add_done_callback(self.refills.discard)
+
+    async def refill(self,lease:Lease):
+        try:
+            if await self.is_healthy(lease):
+                # A fresh context for the next task, with a persistent profile this relaunches the browser
+                await lease.context.close_session()
+                lease.context.session=None
+                await lease.context.init_session()
+            else:
+                await self.discard(lease)
+                lease=await self.launch()
+        except Exception:
+            await self.discard(lease)
+            lease=None
+        await self.restore(lease)
+
+    async def restore(self,lease:Lease|None):
+        async with self.available:
+            self.leased-=1
+            if lease is not None:
+                self.idle.append(lease)
+            self.available.notify()
+
+    async def reset(self,lease:Lease):
+        context=lease.context
+        session=context.session
+        # The cookies stay, only the tabs the task opened are closed
+        for page in session.context.pages[1:]:
+            await page.close()
+        session.current_page=session.context.pages[0]
+        session.state=await context.initial_state(session.current_page)
+
+    async def discard(self,lease:Lease):
+        try:
+            if lease.context.session is not None:
+                await lease.context.close_session()
+            await lease.browser.close_browser()
+        except Exception as e:
+            print('Browser failed to close',e)
+
+    async def async_close(self):
+        await asyncio.gather(*self.refills,return_exceptions=True)
+        async with self.available:
+            idle,self.idle=self.idle,[]
+        for lease in idle:
+            await self.discard(lease)
+
+    def close(self):
+        '''Close the idle browsers and stop the loop of the pool'''
+        if not self.loop.is_running():
+            return
+        self.run(self.async_close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        atexit.unregister(self.close)
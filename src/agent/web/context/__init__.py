@@ -1,14 +1,32 @@
-from playwright.async_api import Page,Browser as PlaywrightBrowser, Frame,ElementHandle,BrowserContext as PlaywrightBrowserContext
-from src.agent.web.context.views import BrowserSession,BrowserState,Tab
+from playwright.async_api import Page,Browser as PlaywrightBrowser, Frame,ElementHandle,BrowserContext as PlaywrightBrowserContext,Route,Request,Error
+from src.agent.web.context.config import ContextConfig,IGNORED_URL_PATTERNS,LEAN_RESOURCE_TYPES,RELEVANT_RESOURCE_TYPES
+from src.agent.web.context.views import BrowserSession,BrowserState,NetworkStats,Tab,request_page
 from src.agent.web.browser.config import BROWSER_ARGS,SECURITY_ARGS
-from src.agent.web.context.config import ContextConfig
-from src.agent.web.dom.views import DOMElementNode
+from src.agent.web.context.download import Downloader
+from src.agent.web.dom.views import DOMElementNode,DOMState
 from src.agent.web.browser import Browser
-from src.agent.web.dom import DOM
+from src.image import ImagePipeline
+from src.agent.web.dom import DOM,SCRIPT
+from dataclasses import replace
 from datetime import datetime
+from time import monotonic
 from pathlib import Path
 from uuid import uuid4
 from os import getcwd
+import asyncio
+import json
+import re
+
+def url_pattern(patterns:list[str])->re.Pattern:
+    '''Match the patterns as whole words, so that `ping` blocks a ping endpoint but not a shopping site'''
+    alternatives=[]
+    for pattern in patterns:
+        before=r'(?<![a-z0-9])' if pattern[0].isalnum() else ''
+        after=r'(?![a-z0-9])' if pattern[-1].isalnum() else ''
+        alternatives.append(f'{before}{re.escape(pattern)}{after}')
+    return re.compile('|'.join(alternatives),re.IGNORECASE)
+
+IGNORED_URLS=url_pattern(IGNORED_URL_PATTERNS)
 
 class Context:
     def __init__(self,browser:Browser,config:ContextConfig=ContextConfig()):
@@ -16,6 +34,13 @@ class Context:
         self.config=config
         self.context_id=str(uuid4())
         self.session:BrowserSession=None
+        self.network=NetworkStats()
+        self.images=ImagePipeline(config.image)
+        self.downloads=Downloader(config.download)
+        # A tab context works on a page of the browser context of another one and only owns that page
+        self.shared=False
+        # The pages a tab context owns, the tab it was opened on and those it opened itself, None for all of them
+        self.pages:list[Page]|None=None
 
     async def __aenter__(self):
         await self.init_session()
@@ -26,13 +51,23 @@ class Context:
 
     async def close_session(self):
         try:
-            await self.session.context.close()
+            if self.shared:
+                for page in self.pages:
+                    self.network.last_activity.pop(page,None)
+                    if not page.is_closed():
+                        await page.close()
+            else:
+                if self.config.save_storage_state_on_close and isinstance(self.config.storage_state,str):
+                    await self.save_storage_state()
+                await self.session.context.close()
+                await self.downloads.aclose()
         except Exception as e:
             print('Context failed to close',e)
         finally:
             self.browser_context=None
 
     async def init_session(self):
+        self.network=NetworkStats()
         browser=await self.browser.get_playwright_browser()
         context=await self.setup_context(browser)
         if browser is not None: # The case whether is no user_data provided
@@ -40,10 +75,25 @@ class Context:
         else: # The case where the user_data is provided
             page=context.pages[0]
         state=await self.initial_state(page)
-        self.session=BrowserSession(context,page,state)
+        self.session=BrowserSession(context,page,state,self.network)
         
+    async def new_tab_context(self)->'Context':
+        '''A context on a new tab of this browser context, agents running side by side share the cookies but not the page'''
+        session=await self.get_session()
+        page=await session.context.new_page()
+        context=Context(self.browser,self.config)
+        context.shared=True
+        context.pages=[page]
+        # Pages opened from the tab, e.g. by a link with a target, belong to it too
+        page.on('popup',context.pages.append)
+        # The request listeners of the browser context update the stats of this context
+        context.network=self.network
+        context.downloads=self.downloads
+        context.session=BrowserSession(session.context,page,await context.initial_state(page),self.network)
+        return context
+
     async def initial_state(self,page:Page):
-        dom_state=[]
+        dom_state=DOMState()
         tabs=[]
         screenshot=None
         state=BrowserState(url=page.url,title=await page.title(),tabs=tabs,screenshot=screenshot,dom_state=dom_state)
@@ -51,13 +101,78 @@ class Context:
     
     async def update_state(self,use_vision:bool=False):
         page=await self.get_current_page()
+        settle_time=await self.wait_for_settle(page)
         dom=DOM(self)
         screenshot,dom_state=await dom.get_state(use_vision=use_vision)
         # print(dom_state.elements_to_string())
         tabs=await self.get_tabs()
-        state=BrowserState(url=page.url,title=await page.title(),tabs=tabs,screenshot=screenshot,dom_state=dom_state)
+        state=BrowserState(url=page.url,title=await page.title(),tabs=tabs,screenshot=screenshot,dom_state=dom_state,settle_time=settle_time)
         return state
+
+    async def wait_for_settle(self,page:Page)->float:
+        '''Wait until the page is stable within the load bounds of the config and return the time it took'''
+        config=self.config
+        start=monotonic()
+        await asyncio.sleep(config.minimum_wait_page_load_time)
+        while monotonic()-start<config.wait_for_network_idle_page_load_time:
+            # Only the requests of this page count, agents on the other tabs keep theirs going
+            if self.network.is_quiet(page,config.quiet_time):
+                break
+            await asyncio.sleep(0.05)
+        dom_start=monotonic()
+        # A page whose content never stops changing is taken as it is once the DOM quiet time is up
+        while monotonic()-start<config.maximum_wait_page_load_time and monotonic()-dom_start<config.wait_for_dom_quiet_time:
+            try:
+                quiet=await page.evaluate('()=>window.__agentDOM?window.__agentDOM.quietFor():1e9')/1000
+            except Error:
+                # The document is being replaced by a navigation
+                quiet=0
+            if quiet>=config.quiet_time:
+                break
+            await asyncio.sleep(max(0.05,config.quiet_time-quiet))
+        return monotonic()-start
+
+    def on_request(self,request:Request):
+        if request.resource_type in RELEVANT_RESOURCE_TYPES and not IGNORED_URLS.search(request.url):
+            self.network.inflight.add(request)
+            self.network.last_activity[request_page(request)]=monotonic()
+
+    def on_request_done(self,request:Request):
+        if request in self.network.inflight:
+            self.network.inflight.discard(request)
+            self.network.last_activity[request_page(request)]=monotonic()
     
+    async def get_storage_state(self)->dict:
+        session=await self.get_session()
+        try:
+            return await session.context.storage_state(indexed_db=True)
+        except TypeError:
+            # Playwright before 1.51 cannot snapshot IndexedDB
+            return await session.context.storage_state()
+
+    def load_storage_state(self)->dict|None:
+        storage_state=self.config.storage_state
+        if storage_state is None or isinstance(storage_state,dict):
+            return storage_state
+        path=Path(storage_state)
+        # Nothing was saved yet, the context starts empty
+        return json.loads(path.read_text()) if path.exists() else None
+
+    async def save_storage_state(self,path:str=None)->Path:
+        '''Save the cookies, local storage and IndexedDB of the context to a file later contexts can start from'''
+        path=Path(path if path else self.config.storage_state)
+        path.parent.mkdir(parents=True,exist_ok=True)
+        path.write_text(json.dumps(await self.get_storage_state()))
+        return path
+
+    async def clone(self)->'Context':
+        '''A new context on the same browser starting from the cookies and storage of this one, isolated from it afterwards'''
+        if await self.browser.get_playwright_browser() is None:
+            raise Exception('A persistent profile cannot be cloned, save its storage state and start a browser without user_data_dir from it')
+        context=Context(self.browser,replace(self.config,storage_state=await self.get_storage_state()))
+        await context.init_session()
+        return context
+
     async def get_state(self,use_vision=False)->BrowserState:
         session=await self.get_session()
         state=await self.update_state(use_vision=use_vision)
@@ -83,8 +198,11 @@ class Context:
             'accept_downloads':True
         }
 
+        storage_state=self.load_storage_state()
         if browser is not None:
-           context=await browser.new_context(**parameters)
+            if storage_state is not None:
+                parameters['storage_state']=storage_state
+            context=await browser.new_context(**parameters)
         else:
             parameters.update({
                 'headless':self.browser.config.headless,
@@ -105,26 +223,76 @@ class Context:
                 context=await self.browser.playwright.chromium.launch_persistent_context(channel='msedge',**parameters)
             else:
                 raise Exception('Invalid Browser Type')
-            
+            # A persistent profile keeps its own storage, only the saved cookies can be added to it
+            if storage_state is not None:
+                await context.add_cookies(storage_state.get('cookies',[]))
+
         with open('./src/agent/web/context/script.js') as f:
             script=f.read()
         await context.add_init_script(script)
+        await context.add_init_script(SCRIPT)
+        context.on('request',self.on_request)
+        context.on('requestfinished',self.on_request_done)
+        context.on('requestfailed',self.on_request_done)
+        if self.config.lean:
+            await context.route('**/*',self.route_request)
+        elif self.config.block_ignored_urls:
+            # Only the matching requests are handed over from the browser
+            await context.route(IGNORED_URLS,self.route_request)
         return context
+
+    def is_blocked(self,resource_type:str,url:str)->bool:
+        # Navigations are never blocked, the agent has to see the page it asked for
+        if resource_type=='document':
+            return False
+        if self.config.lean and resource_type in LEAN_RESOURCE_TYPES:
+            return True
+        return self.config.block_ignored_urls and IGNORED_URLS.search(url) is not None
+
+    async def route_request(self,route:Route):
+        request=route.request
+        if not self.is_blocked(request.resource_type,request.url):
+            return await route.fallback()
+        self.network.record(request.resource_type)
+        await route.abort('blockedbyclient')
     
     async def get_selector_map(self)->dict[int,DOMElementNode]:
         session=await self.get_session()
         return session.state.dom_state.selector_map
         
     async def get_element_by_index(self,index:int)->tuple[DOMElementNode,ElementHandle]:
-        selector_map=await self.get_selector_map()
+        session=await self.get_session()
+        selector_map=session.state.dom_state.selector_map
         if index not in selector_map.keys():
             raise Exception('Index not found')
-        element,handle=selector_map.get(index)
-        return element,handle
+        element=selector_map.get(index)
+        handles=session.state.dom_state.handles
+        if index not in handles:
+            # Only the elements a tool acts on cost a round trip
+            handle=await self.execute_script('index => window.__agentDOM.getElementByIndex(index)',index,enable_handle=True)
+            element_handle=handle.as_element()
+            if element_handle is None:
+                raise Exception('Element is no longer on the page')
+            handles[index]=element_handle
+        return element,handles[index]
     
-    async def get_tabs(self)->list[Tab]:
+    async def get_pages(self)->list[Page]:
+        '''The open pages of the context, only its own for a tab context'''
+        session=await self.get_session()
+        if self.pages is None:
+            return session.context.pages
+        return [page for page in self.pages if not page.is_closed()]
+
+    async def new_page(self)->Page:
         session=await self.get_session()
-        pages=session.context.pages
+        page=await session.context.new_page()
+        if self.pages is not None:
+            self.pages.append(page)
+            page.on('popup',self.pages.append)
+        return page
+
+    async def get_tabs(self)->list[Tab]:
+        pages=await self.get_pages()
         return [Tab(index,page.url,await page.title()) for index,page in enumerate(pages)]
 
     
@@ -140,12 +308,21 @@ class Context:
             date_time=datetime.now().strftime('%Y_%m_%d_%H_%M_%S')
             folder_path=Path(getcwd()).joinpath('./screenshots')
             folder_path.mkdir(parents=True,exist_ok=True)
-            path=folder_path.joinpath(f'screenshot_{date_time}.jpeg')
+            path=folder_path.joinpath(f'screenshot_{date_time}.png')
         else:
             path=None
-        await page.wait_for_timeout(2*1000)
-        screenshot=await page.screenshot(path=path,full_page=full_page,animations='disabled',type='jpeg')
-        return screenshot
+        # CSS pixels, a high density display would otherwise double the size of the capture
+        # Lossless, the pipeline does the only lossy encode
+        screenshot=await page.screenshot(path=path,full_page=full_page,animations='disabled',type='png',scale='css')
+        return self.images.process(screenshot)
+    
+    async def screen_unchanged(self)->bool:
+        '''Whether the page looks as it did on the previous call, judged on a quick capture without the labels'''
+        if not self.config.image.skip_unchanged:
+            return False
+        page=await self.get_current_page()
+        frame=await page.screenshot(animations='disabled',type='jpeg',quality=50,scale='css')
+        return self.images.unchanged(frame)
     
     async def get_parent_iframe(self,node:ElementHandle)->Frame|None:
         parent_iframe=await self.execute_script("[node]=>node.closest('iframe')",[node],enable_handle=True)
@@ -1,12 +1,45 @@
-from dataclasses import dataclass
+from dataclasses import dataclass,field
+from src.image.config import ImageConfig
 from typing import Optional
 
+@dataclass
+class DownloadConfig:
+    # Files fetched over HTTP are streamed to disk in chunks of this many bytes
+    chunk_size:int=1024*1024
+    # Downloads running at once across all the tabs of the context
+    max_concurrent:int=3
+    # An interrupted download is resumed from where it stopped this many times
+    retries:int=3
+    timeout:float=30
+
 @dataclass
 class ContextConfig:
+    # A page settles once no relevant request is in flight and its DOM has not changed for `quiet_time` seconds,
+    # waiting at least the minimum, at most the network idle time for the requests, at most the DOM quiet time
+    # for the content and at most the maximum overall
     minimum_wait_page_load_time:float=0.5
     wait_for_network_idle_page_load_time:float=1
+    wait_for_dom_quiet_time:float=2
     maximum_wait_page_load_time:float=5
+    quiet_time:float=0.5
     disable_security:bool=False
+    # Abort the requests matching IGNORED_URL_PATTERNS
+    block_ignored_urls:bool=True
+    # Also abort LEAN_RESOURCE_TYPES, pages load faster and lighter but without their images
+    lean:bool=False
+    # Screenshots sent in vision mode
+    image:ImageConfig=field(default_factory=ImageConfig)
+    # Estimated tokens the element listing of an observation may take, the elements in view and relevant to the task
+    # are listed first and the rest are only counted, None lists every element
+    observation_budget:int|None=None
+    # Names and attribute values in the listing are cut to this many characters, None keeps them whole
+    max_value_length:int|None=None
+    download:DownloadConfig=field(default_factory=DownloadConfig)
+    # Cookies, local storage and IndexedDB a new context starts with, so flows behind a login skip it: the path of a file
+    # written by Context.save_storage_state or the state itself. A missing file starts empty, persistent profiles only take the cookies
+    storage_state:str|dict|None=None
+    # Write the state back to the `storage_state` file when the session closes, the next run picks up where this one stopped
+    save_storage_state_on_close:bool=False
     user_agent:str='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/85.0.4183.102 Safari/537.36'
 
 
@@ -62,7 +95,11 @@ IGNORED_URL_PATTERNS = [
 	'webrtc',
 	'rtmp://',
 	'wss://',
-	# Common CDNs for dynamic content
-	'cloudfront.net',
-	'fastly.net',
+]
+
+# Resource types the page can be read and operated without
+LEAN_RESOURCE_TYPES = [
+	'image',
+	'font',
+	'media',
 ]
\ No newline at end of file
@@ -0,0 +1,102 @@
+from src.agent.web.context.config import DownloadConfig
+from httpx import AsyncClient,Limits,Timeout,TransportError
+from typing import Callable
+from pathlib import Path
+import hashlib
+import asyncio
+
+# Called with the bytes written so far and the total size if the server sent it
+Progress=Callable[[int,int|None],None]
+
+def print_progress(name:str,fraction:float=0.1)->Progress:
+    '''A progress callback printing a line every `fraction` of the file, or every 10 MB when its size is unknown'''
+    printed=0
+    def report(done:int,total:int|None):
+        nonlocal printed
+        interval=total*fraction if total else 10e6
+        if done-printed<interval and done!=total:
+            return
+        printed=done
+        size=f' of {total/1e6:.1f} MB ({done/total:.0%})' if total else ' MB'
+        print(f'Downloading {name}: {done/1e6:.1f}{size}')
+    return report
+
+class Downloader:
+    '''
+    Streams files to disk chunk by chunk through a pooled client, at most `max_concurrent` at a time.
+
+    A file is written next to its destination with a `.part` suffix and renamed once complete, an interrupted
+    download resumes from the size of the part with a ranged request, or starts over if the server ignores the range.
+    '''
+    def __init__(self,config:DownloadConfig=None):
+        self.config=config if config else DownloadConfig()
+        self._client:AsyncClient=None
+        self._semaphore:asyncio.Semaphore=None
+        self._loop=None
+
+    def bind(self):
+        # Connections and the semaphore cannot be shared across event loops (each `asyncio.run` creates a new one)
+        loop=asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            limits=Limits(max_connections=self.config.max_concurrent,max_keepalive_connections=self.config.max_concurrent)
+            self._client=AsyncClient(follow_redirects=True,timeout=Timeout(self.config.timeout),limits=limits)
+            self._semaphore=asyncio.Semaphore(self.config.max_concurrent)
+            self._loop=loop
+
+    async def download(self,url:str,path:Path,headers:dict[str,str]=None,checksum:str=None,on_progress:Progress=None)->int:
+        '''Download the file to `path` and return its size, `checksum` is a sha256 hex digest or `<algorithm>:<digest>`'''
+        self.bind()
+        part=path.with_name(f'{path.name}.part')
+        async with self._semaphore:
+            for attempt in range(self.config.retries+1):
+                try:
+                    size=await self.fetch(url,part,headers or {},on_progress)
+                    break
+                except TransportError:
+                    if attempt==self.config.retries:
+                        raise
+                    await asyncio.sleep(2**attempt)
+        if checksum is not None:
+            await asyncio.to_thread(self.verify,part,checksum)
+        part.replace(path)
+        return size
+
+    async def fetch(self,url:str,part:Path,headers:dict[str,str],on_progress:Progress=None)->int:
+        offset=part.stat().st_size if part.exists() else 0
+        if offset:
+            headers={**headers,'Range':f'bytes={offset}-'}
+        async with self._client.stream('GET',url,headers=headers) as response:
+            if offset and response.status_code==416:
+                # The part already holds the whole file
+                return offset
+            response.raise_for_status()
+            if response.status_code!=206 or not response.headers.get('Content-Range','').startswith(f'bytes {offset}-'):
+                offset=0
+            length=response.headers.get('Content-Length')
+            total=offset+int(length) if length else None
+            done=offset
+            with open(part,'ab' if offset else 'wb') as f:
+                async for chunk in response.aiter_bytes(self.config.chunk_size):
+                    f.write(chunk)
+                    done+=len(chunk)
+                    if on_progress is not None:
+                        on_progress(done,total)
+        return done
+
+    def verify(self,path:Path,checksum:str):
+        algorithm,_,digest=checksum.rpartition(':')
+        hasher=hashlib.new(algorithm or 'sha256')
+        with open(path,'rb') as f:
+            while chunk:=f.read(self.config.chunk_size):
+                hasher.update(chunk)
+        if hasher.hexdigest()!=digest.lower():
+            path.unlink()
+            raise ValueError(f'Checksum mismatch for {path.name.removesuffix(".part")}, expected {digest} but got {hasher.hexdigest()}')
+
+    async def aclose(self):
+        '''Close the connection pool from inside the event loop'''
+        if self._client is not None and self._loop is asyncio.get_running_loop():
+            await self._client.aclose()
+        self._client=None
+        self._semaphore=None
+        self._loop=None
@@ -1,7 +1,8 @@
 from dataclasses import dataclass,field
-from playwright.async_api import Page,BrowserContext as PlaywrightBrowserContext
+from playwright.async_api import Page,BrowserContext as PlaywrightBrowserContext,Request,Error
 from src.agent.web.dom.views import DOMState
 from typing import Optional
+from time import monotonic
 
 @dataclass 
 class Tab:
@@ -16,12 +17,41 @@ class BrowserState:
 	tabs:list[Tab]=field(default_factory=list)
 	screenshot:Optional[str]=None
 	dom_state:DOMState=field(default_factory=DOMState([],{}))
+	# Seconds the page took to settle before this state was taken
+	settle_time:float=0
 	
 	def tabs_to_string(self)->str:
 		return '\n'.join([f'{tab.id} - Title: {tab.title} - URL: {tab.url}' for tab in self.tabs])
 
+def request_page(request:Request)->Page|None:
+	try:
+		return request.frame.page
+	except Error:
+		# The requests of service workers belong to no page
+		return None
+
+@dataclass
+class NetworkStats:
+	blocked_requests:int=0
+	blocked_by_type:dict[str,int]=field(default_factory=dict)
+	# Relevant requests in flight, across all the tabs of the browser context
+	inflight:set[Request]=field(default_factory=set)
+	# When a relevant request of each page last started or finished
+	last_activity:dict[Page|None,float]=field(default_factory=dict)
+
+	def is_quiet(self,page:Page,quiet_time:float)->bool:
+		'''Whether no relevant request of the page is in flight or started or finished in the last `quiet_time` seconds'''
+		if any(request_page(request) is page for request in self.inflight):
+			return False
+		return monotonic()-self.last_activity.get(page,0)>=quiet_time
+
+	def record(self,resource_type:str):
+		self.blocked_requests+=1
+		self.blocked_by_type[resource_type]=self.blocked_by_type.get(resource_type,0)+1
+
 @dataclass
 class BrowserSession:
 	context: PlaywrightBrowserContext
 	current_page: Page
-	state: BrowserState
\ No newline at end of file
+	state: BrowserState
+	network: NetworkStats=field(default_factory=NetworkStats)
\ No newline at end of file
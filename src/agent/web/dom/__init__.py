@@ -1,56 +1,54 @@
 from src.agent.web.dom.views import DOMElementNode, DOMState
-from playwright.async_api import ElementHandle
 from typing import TYPE_CHECKING
-import asyncio
+from src.codec import loads
+from pathlib import Path
 
 if TYPE_CHECKING:
     from src.agent.web.context import Context
 
+# Read once, registered on every new document by Context.setup_context
+SCRIPT=Path(__file__).parent.joinpath('script.js').read_text()
+
 class DOM:
     def __init__(self, context:'Context'):
         self.context=context
 
     async def get_state(self,use_vision:bool=False)->tuple[str|None,DOMState]:
         '''Get the state of the webpage.'''
-        with open('./src/agent/web/dom/script.js') as f:
-                script=f.read()
-        # Loading the script
-        await self.context.execute_script(script)
-        # Get interactive elements
-        await asyncio.sleep(0.2)
-        nodes=await self.context.execute_script('getInteractiveElements()')
-        # print(nodes)
-        # Add bounding boxes to the interactive elements
-        if use_vision:
-            await self.context.execute_script('nodes=>{mark_page(nodes)}',nodes)
+        # A navigation to a document created before the context was set up has no init script
+        if not await self.context.execute_script('()=>Boolean(window.__agentDOM)'):
+            await self.context.execute_script(SCRIPT)
+        # The page sends only the elements that changed since the snapshot the agent already holds
+        session=await self.context.get_session()
+        previous=session.state.dom_state
+        selector_map,changes=await self.get_changes(previous)
+        # Add bounding boxes to the interactive elements, unless the screen is as the agent last saw it
+        if use_vision and not await self.context.screen_unchanged():
+            await self.context.execute_script('window.__agentDOM.mark_page()')
             screenshot=await self.context.get_screenshot(save_screenshot=False)
-            await self.context.execute_script('unmark_page()')
+            await self.context.execute_script('window.__agentDOM.unmark_page()')
         else:
             screenshot=None
-        # Remove bounding boxes
-        selector_map=await self.build_selector_map(nodes)
-        # print(selector_map)
-        return (screenshot,DOMState(nodes=list(selector_map.values()),selector_map=selector_map))
-
+        return (screenshot,DOMState(nodes=list(selector_map.values()),selector_map=selector_map,document=changes['document'],viewport=changes.get('viewport')))
 
-    async def build_selector_map(self, nodes: list[dict]) -> dict[int, tuple[DOMElementNode, ElementHandle]]:
-        """Build a map from element index to node."""
-        async def process_node(index: int, node: dict):
-            handle = await self.context.execute_script(
-                'index => getElementByIndex(index)', 
-                index, 
-                enable_handle=True
-            )
-            element_handle = handle.as_element()
-            element_node = DOMElementNode(
-                tag=node.get('tag'),
-                role=node.get('role'),
-                name=node.get('name'),
-                attributes=node.get('attributes'),
-                bounding_box=node.get('box')
-            )
-            return index, (element_node, element_handle)
+    async def get_changes(self,previous:DOMState)->tuple[dict[int,DOMElementNode],dict]:
+        # A single string crosses the protocol faster than the equivalent object tree
+        script='document=>window.__agentDOM.getElementChanges(document).then(JSON.stringify)'
+        changes=loads(await self.context.execute_script(script,previous.document))
+        known=previous.selector_map if changes['document']==previous.document else {}
+        updated=self.build_selector_map(changes['elements'])
+        if any(id not in updated and id not in known for id in changes['order']):
+            # The page diffed against a snapshot the agent no longer holds, start over from the full list
+            changes=loads(await self.context.execute_script(script,None))
+            known,updated={},self.build_selector_map(changes['elements'])
+        return {id:updated.get(id) or known[id] for id in changes['order']},changes
 
-        tasks = [process_node(index, node) for index, node in enumerate(nodes)]
-        results = await asyncio.gather(*tasks)
-        return dict(results)
\ No newline at end of file
+    def build_selector_map(self, nodes: list[dict]) -> dict[int, DOMElementNode]:
+        """Build a map from element id to node, the handles are resolved on demand by the context."""
+        return {node.get('id'): DOMElementNode(
+            tag=node.get('tag'),
+            role=node.get('role'),
+            name=node.get('name'),
+            attributes=node.get('attributes'),
+            bounding_box=node.get('box')
+        ) for node in nodes}
\ No newline at end of file
@@ -1,54 +1,117 @@
-const INTERACTIVE_TAGS = [
-    'a', 'button', 'details', 'embed', 'input','option','canvas',
-    'menu', 'menuitem', 'object', 'select', 'textarea', 'summary'
-]
-
-const INTERACTIVE_ROLES = [
-    'button', 'menu', 'menuitem', 'link', 'checkbox', 'radio',
-    'slider', 'tab', 'tabpanel', 'textbox', 'combobox', 'grid',
-    'option', 'progressbar', 'scrollbar', 'searchbox','listbox','listbox',
-    'switch', 'tree', 'treeitem', 'spinbutton', 'tooltip', 'a-button-inner', 'a-dropdown-button', 'click',
-    'menuitemcheckbox', 'menuitemradio', 'a-button-text', 'button-text', 'button-icon', 'button-icon-only', 'button-text-icon-only', 'dropdown', 'combobox'
-]
-
-const SAFE_ATTRIBUTES = [
-	'name',
-	'type',
-	'value',
-	'placeholder',
-    'label',
-	'aria-label',
-	'aria-labelledby',
-	'aria-describedby',
-	'role',
-	'for',
-	'autocomplete',
-	'required',
-	'readonly',
-	'alt',
-	'title',
-	'src',
-	'data-testid',
-	'data-id',
-	'data-qa',
-	'data-cy',
-	'href',
-	'target',
-    'id',
-    'class'
-];
+// Registered once per document as an init script, everything is exposed under window.__agentDOM
+(() => {
+    if (window.__agentDOM) return;
+
+    const INTERACTIVE_TAGS = [
+        'a', 'button', 'details', 'embed', 'input','option','canvas',
+        'menu', 'menuitem', 'object', 'select', 'textarea', 'summary'
+    ]
+
+    const INTERACTIVE_ROLES = [
+        'button', 'menu', 'menuitem', 'link', 'checkbox', 'radio',
+        'slider', 'tab', 'tabpanel', 'textbox', 'combobox', 'grid',
+        'option', 'progressbar', 'scrollbar', 'searchbox','listbox','listbox',
+        'switch', 'tree', 'treeitem', 'spinbutton', 'tooltip', 'a-button-inner', 'a-dropdown-button', 'click',
+        'menuitemcheckbox', 'menuitemradio', 'a-button-text', 'button-text', 'button-icon', 'button-icon-only', 'button-text-icon-only', 'dropdown', 'combobox'
+    ]
+
+    const SAFE_ATTRIBUTES = [
+    	'name',
+    	'type',
+    	'value',
+    	'placeholder',
+        'label',
+    	'aria-label',
+    	'aria-labelledby',
+    	'aria-describedby',
+    	'role',
+    	'for',
+    	'autocomplete',
+    	'required',
+    	'readonly',
+    	'alt',
+    	'title',
+    	'src',
+    	'data-testid',
+    	'data-id',
+    	'data-qa',
+    	'data-cy',
+    	'href',
+    	'target',
+        'id',
+        'class'
+    ];
 
     const labels = [];
-    const selectorMap = {};
-
-    // Function to get a random color
-    function getRandomColor() {
-        const letters = '0123456789ABCDEF';
-        let color = '#';
-        for (let i = 0; i < 6; i++) {
-            color += letters[Math.floor(Math.random() * 16)];
+    // Ids are derived from the content of an element, so it keeps its id across snapshots, reloads and sessions
+    const ID_SPACE = 1000000;
+    // Attributes that change while the agent works with an element are left out of its id
+    const VOLATILE_ATTRIBUTES = ['class', 'value'];
+    let elementsById = new Map();
+    // The last snapshot, reused until the page changes
+    let snapshot = null;
+    let dirty = true;
+    // Shadow roots and iframes are not seen by the observer, pages with them are always walked again
+    let opaque = false;
+    let observer = null;
+    let lastMutation = performance.now();
+    // The serialized elements last sent to the agent, to send only what changed
+    let previous = new Map();
+    const documentId = Math.random().toString(36).slice(2);
+
+    // FNV-1a, the ids only need to be stable and well spread
+    function hash(text) {
+        let value = 0x811c9dc5;
+        for (let i = 0; i < text.length; i++) {
+            value ^= text.charCodeAt(i);
+            value = Math.imul(value, 0x01000193);
+        }
+        return value >>> 0;
+    }
+
+    // Identical elements are told apart by their order, and a collision between different ones takes the next free id
+    function contentId(element, frame, occurrences, taken) {
+        const attributes = Object.entries(element.attributes).filter(([name]) => !VOLATILE_ATTRIBUTES.includes(name));
+        const key = JSON.stringify([element.tag, element.role, element.name, attributes, frame]);
+        const occurrence = occurrences.get(key) || 0;
+        occurrences.set(key, occurrence + 1);
+        let id = hash(`${key}#${occurrence}`) % ID_SPACE;
+        while (taken.has(id)) id = (id + 1) % ID_SPACE;
+        taken.add(id);
+        return id;
+    }
+
+    function invalidate() {
+        dirty = true;
+    }
+
+    function isLabelRecord(record) {
+        const nodes = [...record.addedNodes, ...record.removedNodes];
+        return record.type === 'childList' && nodes.length > 0 && nodes.every(node => node.__agentLabel);
+    }
+
+    // Anything that can change which elements are visible, uncovered or where they are marks the snapshot stale
+    function observe() {
+        if (observer) return;
+        observer = new MutationObserver(records => {
+            // The labels drawn by mark_page do not change the interactive elements
+            const relevant = records.filter(record => !isLabelRecord(record));
+            if (relevant.length === 0) return;
+            invalidate();
+            // Attributes churn forever on carousels, tickers and timers, only changes to the content keep the page unsettled
+            if (relevant.some(record => record.type !== 'attributes')) lastMutation = performance.now();
+        });
+        observer.observe(document, { childList: true, subtree: true, attributes: true, characterData: true });
+        window.addEventListener('scroll', invalidate, { capture: true, passive: true });
+        window.addEventListener('resize', invalidate, { passive: true });
+        for (const type of ['load', 'focusin', 'focusout', 'transitionend', 'animationend']) {
+            document.addEventListener(type, invalidate, { capture: true, passive: true });
         }
-        return color;
+    }
+
+    // The color of an element follows its id, so unchanged elements look the same on every screenshot
+    function getColor(id) {
+        return '#' + (hash(String(id)) & 0xFFFFFF).toString(16).padStart(6, '0');
     }
 
     // Function to wait for the page to be fully loaded
@@ -64,110 +127,150 @@ const SAFE_ATTRIBUTES = [
 
     // Extract visible interactive elements
     async function getInteractiveElements(node=document.body) {
-
-        const interactiveElements = [];  
         await waitForPageToLoad()
+        observe();
+        if (!dirty && !opaque && snapshot && node === document.body) return snapshot;
+        // Mutations from here on belong to the next snapshot
+        dirty = false;
+        opaque = false;
+
+        // Every style is computed once per snapshot
+        const styles = new Map();
+        function style(element) {
+            let computed = styles.get(element);
+            if (!computed) {
+                computed = (element.ownerDocument.defaultView || window).getComputedStyle(element);
+                styles.set(element, computed);
+            }
+            return computed;
+        }
+
+        // The radio and checkbox elements are often hidden behind a styled label, they are kept regardless
+        function isToggle(element) {
+            return ['radio', 'checkbox'].includes(element.getAttribute('type'));
+        }
+
+        // Nothing under an element that is not displayed or fully transparent can be seen, the walker skips the whole subtree
+        const filter = {
+            acceptNode(element) {
+                if (isToggle(element)) return NodeFilter.FILTER_ACCEPT;
+                const computed = style(element);
+                return computed.display === 'none' || computed.opacity === '0' ? NodeFilter.FILTER_REJECT : NodeFilter.FILTER_ACCEPT;
+            }
+        };
+
         function isVisible(element) {
-            let type = element.getAttribute('type');
-            // The radio and checkbox elements are all ready invisible so we can skip them
-            if(['radio', 'checkbox'].includes(type)) return true;
-            const style = window.getComputedStyle(element);
-            const hasBoundingBox = element.offsetWidth > 0 && element.offsetHeight > 0;
-            const visible =
-                style.display !== 'none' &&
-                style.visibility !== 'hidden' &&
-                style.opacity !== '0' &&
-                hasBoundingBox;
-
-            return visible;
+            if (isToggle(element)) return true;
+            return style(element).visibility !== 'hidden' && element.offsetWidth > 0 && element.offsetHeight > 0;
         }
 
         function isClickable(element) {
-            return element.hasAttribute('onclick') || element.hasAttribute('@click')||
-            element.getAttribute('role') === 'button' || window.getComputedStyle(element).cursor === 'pointer'
+            return element.hasAttribute('onclick') || element.hasAttribute('@click') ||
+            element.getAttribute('role') === 'button' || style(element).cursor === 'pointer';
         }
 
-        function isElementCovered(element) {
-            let type = element.getAttribute('type');
-            // The radio and checkbox elements are all ready covered so we can skip them
-            if(['radio', 'checkbox'].includes(type)) return false;
-            // Get the bounding box of the element to find its center point
-            const boundingBox = element.getBoundingClientRect();
-            const x = boundingBox.left + boundingBox.width / 2;
-            const y = boundingBox.top + boundingBox.height / 2;
-        
-            // Get the top element under the center of the current element
-            const topElement = document.elementFromPoint(x, y);
-        
-            // If no element is found at the point, return false (no element is covering it)
-            if (!topElement) return false;
-        
-            // Compare if topElement is inside the current element
-            const isInside = element.contains(topElement);
-        
-            // If topElement is inside the current element, it means it's not covered by it
-            if (isInside) return false;        
-            return true;  // If no coverage, return true
+        function isCovered(element, box) {
+            if (isToggle(element)) return false;
+            // Shadow roots and frames resolve the point among their own elements
+            const root = element.getRootNode();
+            const topElement = (root.elementFromPoint ? root : element.ownerDocument).elementFromPoint(box.left + box.width / 2, box.top + box.height / 2);
+            // Nothing at the point or something inside the element is not covering it
+            return topElement !== null && !element.contains(topElement);
         }
 
-        function traverseDom(currentNode) {
-            if (currentNode.nodeType !== Node.ELEMENT_NODE) return;
-
-            const tagName = currentNode.tagName.toLowerCase();
-            const role = currentNode.getAttribute('role');
-
-            const hasInteractiveTag = INTERACTIVE_TAGS.includes(tagName);
-            const hasInteractiveRole = role && INTERACTIVE_ROLES.includes(role);
-
-            if ((hasInteractiveTag || hasInteractiveRole || isClickable(currentNode)) && isVisible(currentNode)) {
-                // Check if the element is covered by another element
-                const isCovered = isElementCovered(currentNode);
-                if (!isCovered) {
-                    interactiveElements.push({
-                        tag: currentNode.tagName.toLowerCase(),
-                        role: currentNode.getAttribute('role'),
-                        name: currentNode.getAttribute('name')||currentNode.getAttribute('aria-label')||currentNode.getAttribute('aria-labelledby')||currentNode.getAttribute('aria-describedby')||currentNode?.textContent,
-                        attributes: Object.fromEntries(
-                            Array.from(currentNode.attributes).filter(attr => SAFE_ATTRIBUTES.includes(attr.name)).map(attr => [attr.name, attr.value])
-                        ),
-                        box: currentNode.getBoundingClientRect(),
-                        handle: currentNode
-                    });
-                }
+        const candidates = [];
+
+        // Returns whether to go deeper, the content of a clickable element is part of it
+        function visit(element, frame) {
+            const tagName = element.tagName.toLowerCase();
+            const role = element.getAttribute('role');
+            const clickable = isClickable(element);
+            if ((INTERACTIVE_TAGS.includes(tagName) || (role && INTERACTIVE_ROLES.includes(role)) || clickable) && isVisible(element)) {
+                candidates.push([element, frame]);
             }
-            const shadowRoot=currentNode.shadowRoot
-            if(shadowRoot){
-                shadowRoot.childNodes.forEach(child => traverseDom(child));
+            if (element.shadowRoot) {
+                opaque = true;
+                walk(element.shadowRoot, frame);
             }
-            if(tagName === 'iframe') {
-                try{
-                    const iframeDocument = currentNode.contentDocument || currentNode.contentWindow.document;
-                    traverseDom(iframeDocument.body);
+            if (tagName === 'iframe') {
+                opaque = true;
+                try {
+                    const iframeDocument = element.contentDocument || element.contentWindow.document;
+                    walk(iframeDocument.body, `${frame}/${element.getAttribute('name') || element.getAttribute('src') || 'iframe'}`);
                 }
                 catch (e) {
                     console.log('The iframe is not accessable');
                 }
             }
-            if(!isClickable(currentNode)) {
-                currentNode.childNodes.forEach(child => traverseDom(child)); // Go deeper if the current node is not interactive
+            return !clickable;
+        }
+
+        function walk(root, frame) {
+            if (!root) return;
+            const isElement = root.nodeType === Node.ELEMENT_NODE;
+            if (isElement && filter.acceptNode(root) === NodeFilter.FILTER_REJECT) return;
+            const walker = (root.ownerDocument || root).createTreeWalker(root, NodeFilter.SHOW_ELEMENT, filter);
+            let descend = isElement ? visit(root, frame) : true;
+            while (true) {
+                if (!(descend && walker.firstChild())) {
+                    while (!walker.nextSibling()) {
+                        if (!walker.parentNode()) return;
+                    }
+                }
+                descend = visit(walker.currentNode, frame);
             }
         }
 
-        traverseDom(node);
-        selectorMapping(interactiveElements);
+        // Style and size reads first, then all the boxes and hit tests, so the layout is computed once
+        walk(node, '');
+        const boxes = candidates.map(([element]) => element.getBoundingClientRect());
+        const interactiveElements = [];
+        const handles = new Map();
+        const occurrences = new Map();
+        const taken = new Set();
+        candidates.forEach(([currentNode, frame], index) => {
+            const box = boxes[index];
+            if (isCovered(currentNode, box)) return;
+            const element = {
+                tag: currentNode.tagName.toLowerCase(),
+                role: currentNode.getAttribute('role'),
+                name: currentNode.getAttribute('name')||currentNode.getAttribute('aria-label')||currentNode.getAttribute('aria-labelledby')||currentNode.getAttribute('aria-describedby')||currentNode?.textContent,
+                attributes: Object.fromEntries(
+                    Array.from(currentNode.attributes).filter(attr => SAFE_ATTRIBUTES.includes(attr.name)).map(attr => [attr.name, attr.value])
+                ),
+                box: box.toJSON()
+            };
+            element.id = contentId(element, frame, occurrences, taken);
+            handles.set(element.id, currentNode);
+            interactiveElements.push(element);
+        });
+        elementsById = handles;
+        snapshot = interactiveElements;
         return interactiveElements;
     }
 
-    // Mark page by placing bounding boxes and labels
-    function mark_page(elements) {
-        let index = 0; // Start numbering from 1
+    // The order of the elements and those added or changed since the last call, all of them when the agent knows another document
+    async function getElementChanges(known) {
+        if (known !== documentId) previous = new Map();
+        const elements = await getInteractiveElements();
+        const current = new Map(elements.map(element => [element.id, JSON.stringify(element)]));
+        const changes = { document: documentId, viewport: { width: window.innerWidth, height: window.innerHeight }, order: [], elements: [] };
+        for (const element of elements) {
+            changes.order.push(element.id);
+            if (previous.get(element.id) !== current.get(element.id)) changes.elements.push(element);
+        }
+        previous = current;
+        return changes;
+    }
 
+    // Mark page by placing bounding boxes and labels
+    function mark_page(elements = snapshot || []) {
         elements.forEach(element => {
-            const { box } = element;
+            const { id, box } = element;
             if (!box) return;
 
             const { left, top, width, height } = box;
-            const color = getRandomColor();
+            const color = getColor(id);
 
             // Create bounding box
             const boundingBox = document.createElement('div');
@@ -182,7 +285,7 @@ const SAFE_ATTRIBUTES = [
 
             // Create a label for numbering
             const label = document.createElement('span');
-            label.textContent = index;
+            label.textContent = id;
             label.style.position = 'absolute';
             label.style.top = '-19px';
             label.style.right = '0px';
@@ -194,9 +297,9 @@ const SAFE_ATTRIBUTES = [
 
             // Append label and bounding box
             boundingBox.appendChild(label);
+            boundingBox.__agentLabel = true;
             labels.push(boundingBox);
             document.body.appendChild(boundingBox);
-            index++;
         });
     }
 
@@ -208,15 +311,16 @@ const SAFE_ATTRIBUTES = [
         labels.length = 0;
     }
 
-
-    // Function to populate the registry with interactive elements
-    function selectorMapping(elements) {
-        elements.forEach((element, index) => {
-            selectorMap[index] = element.handle;  // Store the element object directly
-        });
+    // Milliseconds since the document last changed
+    function quietFor() {
+        return performance.now() - lastMutation;
     }
 
     // Function to get element by index
     function getElementByIndex(index) {
-        return selectorMap[index] || null;
-    }
\ No newline at end of file
+        return elementsById.get(index) || null;
+    }
+
+    observe();
+    window.__agentDOM = { getInteractiveElements, getElementChanges, invalidate, getElementByIndex, quietFor, mark_page, unmark_page };
+})();
@@ -1,5 +1,21 @@
-from dataclasses import dataclass,field
 from playwright.async_api import ElementHandle
+from dataclasses import dataclass,field
+from collections import Counter
+import re
+
+# How an omitted element is counted in the summary of the listing
+KINDS={'a':'link','button':'button','input':'field','textarea':'field','select':'field'}
+# Length the names and values are cut to when a budget is set without a max_length
+BUDGET_VALUE_LENGTH=100
+
+def truncate(value,length:int|None):
+    if length is None or not isinstance(value,str) or len(value)<=length:
+        return value
+    return value[:length]+'...'
+
+def count_tokens(text:str)->int:
+    # Rough estimate, close enough to keep the listing within its budget
+    return len(text)//4+1
 
 @dataclass
 class DOMElementNode:
@@ -17,8 +33,71 @@ class DOMElementNode:
     
 @dataclass
 class DOMState:
-    nodes: list[tuple[DOMElementNode,ElementHandle]]=field(default_factory=list)
-    selector_map:dict[int,tuple[DOMElementNode,ElementHandle]]=field(default_factory=dict)
+    nodes: list[DOMElementNode]=field(default_factory=list)
+    selector_map:dict[int,DOMElementNode]=field(default_factory=dict)
+    # Handles resolved so far for this snapshot, keyed by id
+    handles:dict[int,ElementHandle]=field(default_factory=dict)
+    # The page the ids belong to, the next snapshot of it is sent as a diff against this one
+    document:str|None=None
+    # Size of the viewport the bounding boxes are relative to
+    viewport:dict|None=None
+
+    def element_to_string(self,id:int,max_length:int|None=None)->str:
+        node=self.selector_map[id]
+        attributes={key:truncate(value,max_length) for key,value in node.attributes.items()} if node.attributes else node.attributes
+        return f'{id} - Tag: {node.tag} Role: {node.role} Name: {truncate(node.name,max_length)} attributes: {attributes}'
+
+    def elements_to_string(self,task:str='',budget:int|None=None,max_length:int|None=None)->str:
+        '''
+        Without a budget every element is listed. With one, the elements in view and those matching the words of the task
+        are kept first while their estimated tokens fit, they are listed in page order followed by a count of the rest.
+        '''
+        if budget is None:
+            return '\n'.join([self.element_to_string(id,max_length) for id in self.selector_map])
+        if max_length is None:
+            max_length=BUDGET_VALUE_LENGTH
+        terms=set(re.findall(r'\w{3,}',task.lower()))
+        kept,used=set(),0
+        for id in sorted(self.selector_map,key=lambda id:self.distance(id)-self.relevance(id,terms)):
+            cost=count_tokens(self.element_to_string(id,max_length))
+            if used+cost>budget:
+                # A cheaper element further down may still fit
+                continue
+            kept.add(id)
+            used+=cost
+        lines=[self.element_to_string(id,max_length) for id in self.selector_map if id in kept]
+        omitted=Counter((KINDS.get(node.tag,'element'),self.position(id)) for id,node in self.selector_map.items() if id not in kept)
+        lines.extend(f'{count} more {kind}{"s" if count>1 else ""} {position}' for (kind,position),count in omitted.most_common())
+        return '\n'.join(lines)
+
+    def distance(self,id:int)->float:
+        '''How far the element is from the viewport, in viewports, 0 when it is in view'''
+        box=self.selector_map[id].bounding_box
+        if not self.viewport or not box:
+            return 0
+        width,height=self.viewport['width'] or 1,self.viewport['height'] or 1
+        vertical=max(0,box['top']-height,-(box['top']+box['height']))
+        horizontal=max(0,box['left']-width,-(box['left']+box['width']))
+        return max(vertical/height,horizontal/width)
+
+    def relevance(self,id:int,terms:set[str])->int:
+        '''Number of words of the task found in the name or the attributes of the element'''
+        if not terms:
+            return 0
+        node=self.selector_map[id]
+        text=' '.join(str(value) for value in [node.name,*(node.attributes or {}).values()] if value).lower()
+        return sum(term in text for term in terms)
 
-    def elements_to_string(self)->str:
-        return '\n'.join([f'{index} - Tag: {node.tag} Role: {node.role} Name: {node.name} attributes: {node.attributes}' for index,(node,_) in enumerate(self.nodes)])
\ No newline at end of file
+    def position(self,id:int)->str:
+        box=self.selector_map[id].bounding_box
+        if not self.viewport or not box:
+            return 'in view'
+        if box['top']+box['height']<0:
+            return 'above'
+        if box['top']>self.viewport['height']:
+            return 'below'
+        if box['left']+box['width']<0:
+            return 'to the left'
+        if box['left']>self.viewport['width']:
+            return 'to the right'
+        return 'in view'
\ No newline at end of file
@@ -1,23 +1,24 @@
 from src.agent.web.tools.views import Click,Type,Wait,Scroll,GoTo,Back,Key,Download,ExtractContent,Tab,Upload,Menu,Form
-from main_content_extractor import MainContentExtractor
+from src.agent.web.tools.content import ContentExtractor,paginate
+from src.agent.web.context.download import print_progress
 from src.agent.web.context import Context
 from typing import Literal
 from src.tool import Tool
 from pathlib import Path
+from urllib.parse import urlsplit
 from os import getcwd
-import httpx
+import asyncio
+
+extractor=ContentExtractor()
 
 @Tool('Click Tool',params=Click)
 async def click_tool(index:int,context:Context=None):
     '''For clicking buttons, links, checkboxes, and radio buttons'''
-    page=await context.get_current_page()
     element,handle=await context.get_element_by_index(index)
     if element.attributes.get('type','') in ['checkbox','radio']:
-        await page.wait_for_load_state('load')
         await handle.check(force=True)
         return f'Checked element at index {index}'
     else:
-        await page.wait_for_load_state('load')
         await handle.scroll_into_view_if_needed()
         await handle.click()
         return f'Clicked element at index {index}'
@@ -26,9 +27,7 @@ async def click_tool(index:int,context:Context=None):
 @Tool('Type Tool',params=Type)
 async def type_tool(index:int,text:str,context:Context=None):
     '''To fill input fields or search boxes'''
-    page=await context.get_current_page()
     _,handle=await context.get_element_by_index(index)
-    await page.wait_for_load_state('load')
     await handle.scroll_into_view_if_needed()
     await handle.type(text,delay=80)
     return f'Typed {text} in element {index}'
@@ -82,7 +81,7 @@ async def key_tool(keys:str,context:Context=None):
     return f'Pressed {keys}'
 
 @Tool('Download Tool',params=Download)
-async def download_tool(index:int=None,url:str=None,filename:str=None,context:Context=None):
+async def download_tool(index:int=None,url:str=None,filename:str=None,checksum:str=None,context:Context=None):
     '''To download a file (e.g., pdf, image, video, audio) to the system'''
     folder_path=Path(getcwd()).joinpath('./downloads')
     folder_path.mkdir(parents=True,exist_ok=True)
@@ -97,45 +96,60 @@ async def download_tool(index:int=None,url:str=None,filename:str=None,context:Co
             filename=download.suggested_filename
         path=folder_path.joinpath(filename)
         await download.save_as(path=path)
-    except:
-        async with httpx.AsyncClient() as client:
-            response=await client.get(url)
+    except Exception:
+        if url is None:
+            raise
+        if filename is None:
+            filename=Path(urlsplit(url).path).name or 'download'
         path=folder_path.joinpath(filename)
-        with open(path,'wb') as f:
-            f.write(response.content)
-    return f'Downloaded {filename} from {url} and saved it to {path}'
+        # The cookies of the browser context come along so downloads behind a login work too
+        session=await context.get_session()
+        cookies=await session.context.cookies(url)
+        headers={'Cookie':'; '.join(f"{cookie['name']}={cookie['value']}" for cookie in cookies)} if cookies else {}
+        await context.downloads.download(url,path,headers=headers,checksum=checksum,on_progress=print_progress(filename))
+    else:
+        if checksum is not None:
+            await asyncio.to_thread(context.downloads.verify,path,checksum)
+    return f'Downloaded {filename} ({path.stat().st_size/1e6:.1f} MB) from {url} and saved it to {path}'
 
 @Tool('ExtractContent Tool',params=ExtractContent)
-async def extract_content_tool(value:str,context:Context=None):
-    '''Extract the information present in a webpage such as text, images, etc'''
+async def extract_content_tool(value:str,part:int=1,context:Context=None):
+    '''Extract the information present in a webpage such as text, images, etc, a long page is read one part at a time'''
     page=await context.get_current_page()
     html=await page.content()
-    content=MainContentExtractor.extract(html,output_format=value)
-    return f'Extracted Page Content:\n{content}'
+    content=await extractor.extract(page.url,html,value)
+    parts=paginate(content)
+    if len(parts)==1:
+        return f'Extracted Page Content:\n{content}'
+    if not 1<=part<=len(parts):
+        raise IndexError(f'The page content has {len(parts)} parts')
+    more=f', set part to {part+1} for the next one' if part<len(parts) else ''
+    return f'Extracted Page Content (part {part} of {len(parts)}{more}):\n{parts[part-1]}'
 
 @Tool('Tab Tool',params=Tab)
 async def tab_tool(mode:Literal['open','close','switch'],tab_index:int=None,context:Context=None):
     '''To open a new tab, close the current tab and switch from current tab to the specified tab'''
     session=await context.get_session()
     if mode=='open':
-        page=await session.context.new_page()
+        page=await context.new_page()
         session.current_page=page
         await page.wait_for_load_state('load')
         return f'Opened new tab and switched to it'
     elif mode=='close':
         page=session.current_page
         await page.close()
-        pages=session.context.pages
+        pages=await context.get_pages()
         if tab_index is not None and tab_index>len(pages):
             raise IndexError('Index out of range')
-        page=pages[0]
+        # A tab agent that closed its last tab gets a blank one
+        page=pages[0] if pages else await context.new_page()
         session.current_page=page
         await page.bring_to_front()
         await page.wait_for_load_state('load')
         return f'Closed current tab and switched to tab 0'
     elif mode=='switch':
-        pages=session.context.pages
-        if tab_index>len(pages):
+        pages=await context.get_pages()
+        if tab_index>=len(pages):
             raise IndexError('Index out of range')
         page=pages[tab_index]
         session.current_page=page
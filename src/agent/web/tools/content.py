@@ -0,0 +1,50 @@
+from main_content_extractor import MainContentExtractor
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from functools import partial
+from threading import Lock
+from hashlib import blake2b
+import asyncio
+
+# Characters in a part of a long page, about two thousand tokens
+PART_SIZE=8000
+
+class ContentExtractor:
+    '''
+    Runs MainContentExtractor on a worker pool so the event loop keeps driving the browser meanwhile, and keeps the
+    last `size` extractions keyed by URL, content hash and format so reading the same page again costs nothing.
+    '''
+    def __init__(self,size:int=32,workers:int=2):
+        self.executor=ThreadPoolExecutor(max_workers=workers,thread_name_prefix='extract')
+        self.cache:OrderedDict[tuple[str,bytes,str],str]=OrderedDict()
+        self.size=size
+        # Agents on the loop of a browser pool and on their own loops share the cache
+        self.lock=Lock()
+
+    async def extract(self,url:str,html:str,output_format:str)->str:
+        key=(url,blake2b(html.encode(),digest_size=16).digest(),output_format)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        loop=asyncio.get_running_loop()
+        content=await loop.run_in_executor(self.executor,partial(MainContentExtractor.extract,html,output_format=output_format))
+        with self.lock:
+            self.cache[key]=content
+            if len(self.cache)>self.size:
+                self.cache.popitem(last=False)
+        return content
+
+def paginate(content:str,size:int=PART_SIZE)->list[str]:
+    '''Split the content into parts of at most `size` characters, at paragraph breaks where possible'''
+    parts,current=[],''
+    for paragraph in content.split('\n\n'):
+        # A paragraph longer than a part is cut wherever it must
+        for piece in [paragraph[i:i+size] for i in range(0,len(paragraph),size)] or ['']:
+            if current and len(current)+2+len(piece)>size:
+                parts.append(current)
+                current=piece
+            else:
+                current=f'{current}\n\n{piece}' if current else piece
+    parts.append(current)
+    return parts
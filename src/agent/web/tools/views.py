@@ -32,9 +32,11 @@ class Download(SharedBaseModel):
     index:int = Field(...,description="the index of the element to download file",examples=[0])
     url:str = Field(...,description="url of the file to download",examples=["https://www.example.com/file.txt","https://abc.org/pdf/54655"])
     filename:str=Field(...,description="the name of the file to download",examples=["file.txt","xy4rs.pdf"])
+    checksum:str = Field(description="the sha256 digest of the file if the page gives one, to verify the download",examples=["9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08"],default=None)
 
 class ExtractContent(SharedBaseModel):
     value:Literal['markdown','html','text'] = Field(description="the type of content to be like",examples=['markdown'],default='text')
+    part:int = Field(description="the part of a long page to read, starting from 1",examples=[1],default=1)
 
 class Tab(SharedBaseModel):
     mode:Literal['open','close','switch'] = Field(...,description="the mode of the tab",examples=['open'])
@@ -0,0 +1,41 @@
+'''
+JSON codec of the inference I/O, backed by orjson or msgspec when one of them is installed and the standard library otherwise.
+'''
+from importlib.util import find_spec
+import json
+
+if find_spec('orjson') is not None:
+    import orjson
+
+    backend='orjson'
+
+    def dumps(obj,indent:bool=False)->bytes:
+        return orjson.dumps(obj,option=orjson.OPT_INDENT_2 if indent else None)
+
+    def loads(data:str|bytes):
+        return orjson.loads(data)
+
+elif find_spec('msgspec') is not None:
+    import msgspec
+
+    backend='msgspec'
+    encoder=msgspec.json.Encoder()
+    decoder=msgspec.json.Decoder()
+
+    def dumps(obj,indent:bool=False)->bytes:
+        data=encoder.encode(obj)
+        return msgspec.json.format(data,indent=2) if indent else data
+
+    def loads(data:str|bytes):
+        return decoder.decode(data)
+
+else:
+    backend='json'
+
+    def dumps(obj,indent:bool=False)->bytes:
+        if indent:
+            return json.dumps(obj,indent=2,ensure_ascii=False).encode()
+        return json.dumps(obj,separators=(',',':'),ensure_ascii=False).encode()
+
+    def loads(data:str|bytes):
+        return json.loads(data)
@@ -0,0 +1,94 @@
+'''
+Image pipeline of the screenshots sent to the vision models.
+'''
+from src.image.config import ImageConfig
+from PIL import Image,ImageChops
+from io import BytesIO
+
+def mime_type(data:bytes)->str:
+    '''The MIME type of an encoded image from its signature'''
+    if data.startswith(b'\x89PNG'):
+        return 'image/png'
+    if data.startswith(b'\xff\xd8'):
+        return 'image/jpeg'
+    if data[:4]==b'RIFF' and data[8:12]==b'WEBP':
+        return 'image/webp'
+    if data[:6] in (b'GIF87a',b'GIF89a'):
+        return 'image/gif'
+    return 'image/png'
+
+def dhash(image:Image.Image,size:int=16)->int:
+    '''Difference hash, one bit per pixel telling whether it is brighter than its right neighbour'''
+    pixels=image.convert('L').resize((size+1,size),Image.Resampling.BILINEAR).tobytes()
+    bits=0
+    for row in range(size):
+        offset=row*(size+1)
+        for column in range(size):
+            bits=(bits<<1)|(pixels[offset+column]>pixels[offset+column+1])
+    return bits
+
+class ImagePipeline:
+    '''
+    Downscales, optionally grays and crops the screenshots before they are encoded, fewer pixels upload faster
+    and cost fewer vision tokens. Cropping compares each frame with the one before, so keep one pipeline per screen.
+    '''
+    def __init__(self,config:ImageConfig=None):
+        self.config=config if config else ImageConfig()
+        self.previous:Image.Image=None
+        self.last_hash:int=None
+
+    def reset(self):
+        '''Forget the previous frame, the next one is sent whole as the first of a conversation'''
+        self.previous=None
+        self.last_hash=None
+
+    def region(self,image:Image.Image)->tuple[int,int,int,int]|None:
+        '''The box around what changed since the previous frame, None when the whole frame is to be sent'''
+        if self.previous is None or self.previous.size!=image.size:
+            return None
+        box=ImageChops.difference(self.previous,image).getbbox()
+        if box is None:
+            return None
+        margin=self.config.crop_margin
+        left,top,right,bottom=box
+        box=(max(0,left-margin),max(0,top-margin),min(image.width,right+margin),min(image.height,bottom+margin))
+        if (box[2]-box[0])*(box[3]-box[1])>self.config.max_crop_area*image.width*image.height:
+            return None
+        return box
+
+    def unchanged(self,image:Image.Image|bytes)->bool:
+        '''Whether the frame looks like the last one that was sent, a changed frame becomes the new reference'''
+        if isinstance(image,bytes):
+            image=Image.open(BytesIO(image))
+        hash=dhash(image,self.config.hash_size)
+        # Compared with the sent frame, not the previous capture, so a gradual change still adds up
+        if self.last_hash is not None and (hash^self.last_hash).bit_count()<=self.config.unchanged_distance:
+            return True
+        self.last_hash=hash
+        return False
+
+    def process(self,image:Image.Image|bytes)->bytes:
+        config=self.config
+        if isinstance(image,bytes):
+            image=Image.open(BytesIO(image))
+        image=image.convert('RGB')
+        if config.crop:
+            box=self.region(image)
+            self.previous=image
+            if box is not None:
+                image=image.crop(box)
+        if config.grayscale:
+            image=image.convert('L')
+        scale=config.max_edge/max(image.size)
+        if scale<1:
+            # Not in place, the frame may be kept for the next comparison
+            image=image.resize((round(image.width*scale),round(image.height*scale)),Image.Resampling.LANCZOS)
+        io=BytesIO()
+        match config.format:
+            case 'png':
+                image.save(io,format='PNG',optimize=True)
+            case 'webp':
+                image.save(io,format='WEBP',quality=config.quality)
+            case _:
+                image.save(io,format='JPEG',quality=config.quality,optimize=True)
+        return io.getvalue()
@@ -0,0 +1,20 @@
+from dataclasses import dataclass
+from typing import Literal
+
+@dataclass
+class ImageConfig:
+    # Longest side in pixels, larger screenshots are downscaled
+    max_edge:int=1280
+    format:Literal['jpeg','png','webp']='jpeg'
+    quality:int=75
+    grayscale:bool=False
+    # Send only the region that changed since the previous frame, padded by `crop_margin` pixels,
+    # unless the change covers more than `max_crop_area` of the frame
+    crop:bool=False
+    crop_margin:int=64
+    max_crop_area:float=0.6
+    # Skip the screenshot when the screen looks the same as the previous one, two frames are the same
+    # when their difference hashes of `hash_size` squared bits differ in at most `unchanged_distance` bits
+    skip_unchanged:bool=True
+    hash_size:int=16
+    unchanged_distance:int=2
@@ -1,12 +1,24 @@
-from src.message import AIMessage,SystemMessage
+from src.message import AIMessage,BaseMessage,SystemMessage
+from httpx import Client,AsyncClient,Limits,Timeout,Response
+from typing import Generator,AsyncGenerator
+from src.inference.limiter import RateLimiter,get_limiter
+from src.inference.compiler import PayloadCompiler,body
+from src.inference.usage import record_usage
+from src.inference.config import HTTPConfig
+from importlib.util import find_spec
 from abc import ABC,abstractmethod
 from pydantic import BaseModel
 from src.tool import Tool
+from time import perf_counter
+from src.codec import loads
+import asyncio
 
 class Token(BaseModel):
     input: int
     output: int
     total: int
+    # Input tokens served from the provider's prompt cache
+    cached: int=0
 
 structured_output_prompt='''
 ### JSON Response Format:
@@ -21,8 +33,56 @@ If there is code block inside the JSON adheres to the following formatting guide
 Validate all fields, use `null` or empty values for missing data, and format the JSON in a clear, indented code block.
 '''
 
+class StreamUsage:
+    '''
+    Usage of a streamed call as far as it got. The consumer closes the stream as soon as the response is actionable,
+    usually before the provider reports the usage, so whatever was not reported is estimated from the request body
+    and the text streamed so far.
+    '''
+    def __init__(self,body:bytes):
+        self.body=body
+        self.input:int|None=None
+        self.output:int|None=None
+        self.cached=0
+        self.characters=0
+        self.received=False
+
+    def report(self,input:int=None,output:int=None,cached:int=None):
+        self.received=True
+        if input is not None:
+            self.input=input
+        if output is not None:
+            self.output=output
+        if cached is not None:
+            self.cached=cached
+
+    def add(self,text:str)->str:
+        self.received=True
+        self.characters+=len(text or '')
+        return text
+
+    def token(self)->Token:
+        # Roughly four characters per token
+        input=self.input if self.input else len(self.body)//4
+        output=self.output if self.output else self.characters//4
+        return Token(input=input,output=output,total=input+output,cached=self.cached)
+
+# Statuses of overloaded, rate limited or failing servers, a request that got one may succeed when sent again
+RETRYABLE_STATUSES={408,409,425,429,500,502,503,504,529}
+
+class InferenceError(Exception):
+    '''Raised when a provider fails to return a completion'''
+    def __init__(self,message:str,status:int|None=None,retryable:bool=False):
+        super().__init__(message)
+        self.status=status
+        self.retryable=retryable
+
 class BaseInference(ABC):
-    def __init__(self,model:str,api_key:str='',base_url:str='',tools:list[Tool]=[],temperature:float=0.5):
+    provider:str=''
+    # Whether the provider's endpoint negotiates HTTP/2 over TLS
+    http2:bool=True
+
+    def __init__(self,model:str,api_key:str='',base_url:str='',tools:list[Tool]=[],temperature:float=0.5,http_config:HTTPConfig=None,requests_per_minute:int|None=15,tokens_per_minute:int|None=None):
         self.model=model
         self.api_key=api_key
         self.base_url=base_url
@@ -31,6 +91,127 @@ class BaseInference(ABC):
         self.headers={'Content-Type': 'application/json'}
         self.structured_output_prompt=structured_output_prompt
         self.tokens:Token=Token(input=0,output=0,total=0)
+        self.http_config=http_config if http_config else HTTPConfig()
+        self._client:Client=None
+        self._async_client:AsyncClient=None
+        self._async_client_loop=None
+        self.limiter:RateLimiter=get_limiter(self.provider or self.__class__.__name__,api_key,requests_per_minute=requests_per_minute,tokens_per_minute=tokens_per_minute)
+        self.started:float=None
+        self.compiler=PayloadCompiler(self.encode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+
+    def acquire(self):
+        '''Wait for the rate limits and start timing the request'''
+        self.limiter.acquire()
+        self.started=perf_counter()
+
+    async def async_acquire(self):
+        '''Wait for the rate limits without blocking the event loop and start timing the request'''
+        await self.limiter.async_acquire()
+        self.started=perf_counter()
+
+    def update_tokens(self,tokens:Token):
+        '''Keep the usage of the latest call, debit it from the rate limits and add it to the open usage ledgers'''
+        self.tokens=tokens
+        self.limiter.record(tokens.total)
+        latency=perf_counter()-self.started if self.started is not None else None
+        record_usage(self.provider or self.__class__.__name__,self.model,tokens.input,tokens.output,tokens.total,cached=tokens.cached,latency=latency)
+
+    def error(self,err:Exception)->InferenceError:
+        '''The typed error of a failed request, with the status of the response and whether sending it again may succeed'''
+        response=getattr(err,'response',None)
+        if response is None:
+            # The connection failed or timed out before any response
+            return InferenceError(f'{self.provider} request to {self.model} failed: {err}',retryable=True)
+        status=response.status_code
+        try:
+            detail=response.text
+        except Exception:
+            # The body of a streamed response is gone once its stream is closed
+            detail=str(err)
+        return InferenceError(f'{self.provider} request to {self.model} failed with status {status}: {detail}',status=status,retryable=status in RETRYABLE_STATUSES)
+
+    def record_stream(self,usage:StreamUsage):
+        '''Record a streamed call once it ends or is closed, a request that failed before any response is not a call'''
+        if usage.received:
+            self.update_tokens(usage.token())
+
+    def encode(self,message:BaseMessage)->dict|None:
+        '''The JSON of a message in the provider's dialect, None to leave it out'''
+        return message.to_dict()
+
+    def with_schema(self,messages:list[BaseMessage],model:BaseModel=None)->list[BaseMessage]:
+        '''The messages with the output schema appended to a copy of the system prompt, the original stays untouched'''
+        if model is None:
+            return messages
+        return [SystemMessage(self.structured(message,model)) if isinstance(message,SystemMessage) else message for message in messages]
+
+    def body(self,payload:dict)->bytes:
+        '''Serialize the payload into the request body'''
+        return body(payload)
+
+    def client_parameters(self)->dict:
+        config=self.http_config
+        limits=Limits(max_connections=config.max_connections,max_keepalive_connections=config.max_keepalive_connections,keepalive_expiry=config.keepalive_expiry)
+        # HTTP/2 needs the optional `h2` package, otherwise fall back to HTTP/1.1 keep-alive
+        http2=config.http2 and self.http2 and find_spec('h2') is not None
+        return {'limits':limits,'http2':http2,'timeout':Timeout(config.timeout)}
+
+    @property
+    def client(self)->Client:
+        '''Long-lived connection pool shared by the synchronous calls'''
+        if self._client is None or self._client.is_closed:
+            self._client=Client(**self.client_parameters())
+        return self._client
+
+    @property
+    def async_client(self)->AsyncClient:
+        '''Long-lived connection pool shared by the asynchronous calls, bound to the running event loop'''
+        try:
+            loop=asyncio.get_running_loop()
+        except RuntimeError:
+            loop=None
+        # Connections cannot be shared across event loops (each `asyncio.run` creates a new one)
+        if self._async_client is None or self._async_client.is_closed or self._async_client_loop is not loop:
+            self._async_client=AsyncClient(**self.client_parameters())
+            self._async_client_loop=loop
+        return self._async_client
+
+    def close(self):
+        '''
+        Close the connection pools, the asynchronous one is closed on its event loop if that is still running.
+        Once its loop has ended the pool can no longer be closed cleanly, call `aclose` inside the loop instead.
+        '''
+        if self._client is not None:
+            self._client.close()
+            self._client=None
+        client,loop=self._async_client,self._async_client_loop
+        if client is not None and not client.is_closed and loop is not None and loop.is_running():
+            # A synchronous call cannot await the close, so it is scheduled on the loop that owns the connections
+            asyncio.run_coroutine_threadsafe(client.aclose(),loop)
+        self._async_client=None
+        self._async_client_loop=None
+
+    async def aclose(self):
+        '''Close the connection pools from inside the event loop'''
+        if self._async_client is not None and self._async_client_loop is asyncio.get_running_loop():
+            await self._async_client.aclose()
+        self._async_client=None
+        self._async_client_loop=None
+        if self._client is not None:
+            self._client.close()
+            self._client=None
 
     @abstractmethod
     def invoke(self,messages:list[dict],json:bool=False,model:BaseModel=None)->AIMessage|BaseModel:
@@ -41,8 +222,30 @@ class BaseInference(ABC):
         pass
 
     @abstractmethod
-    def stream(self,messages:list[dict],json:bool=False)->AIMessage:
+    def stream(self,messages:list[dict],json:bool=False)->Generator[str,None,None]:
         pass
 
+    @abstractmethod
+    async def async_stream(self,messages:list[dict],json:bool=False)->AsyncGenerator[str,None]:
+        pass
+
+    def iter_sse(self,response:Response)->Generator[dict,None,None]:
+        '''Decode the `data:` events of a server-sent events response'''
+        for line in response.iter_lines():
+            if not line.startswith('data:'):
+                continue
+            data=line[5:].strip()
+            if data and data!='[DONE]':
+                yield loads(data)
+
+    async def aiter_sse(self,response:Response)->AsyncGenerator[dict,None]:
+        '''Decode the `data:` events of a server-sent events response'''
+        async for line in response.aiter_lines():
+            if not line.startswith('data:'):
+                continue
+            data=line[5:].strip()
+            if data and data!='[DONE]':
+                yield loads(data)
+
     def structured(self,message:SystemMessage,model:BaseModel):
         return f'{message.content}\n{structured_output_prompt.format(json_schema=model.model_json_schema())}'
\ No newline at end of file
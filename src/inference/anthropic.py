@@ -1,65 +1,31 @@
-from src.message import AIMessage,BaseMessage,SystemMessage,ImageMessage,HumanMessage,ToolMessage
+from src.message import AIMessage,BaseMessage,SystemMessage,ToolMessage
 from tenacity import retry,stop_after_attempt,retry_if_exception_type
 from requests import RequestException,HTTPError,ConnectionError
-from ratelimit import limits,sleep_and_retry
-from httpx import Client,AsyncClient
-from src.inference import BaseInference,Token
+from src.inference import BaseInference,InferenceError,Token,StreamUsage
+from src.inference.compiler import encode_anthropic
+from httpx import HTTPStatusError,TransportError
 from pydantic import BaseModel
-from typing import Generator
+from typing import Generator,AsyncGenerator
 from typing import Literal
 from pathlib import Path
-from json import loads
+from src.codec import loads
 from uuid import uuid4
 import mimetypes
 import requests
 
 class ChatAnthropic(BaseInference):
-    @sleep_and_retry
-    @limits(calls=15,period=60)
-    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
-    def invoke(self, messages: list[BaseMessage],json:bool=False,model:BaseModel=None)->AIMessage|ToolMessage|BaseModel:
-        self.headers.update({
-            'x-api-key': self.api_key,
-            "anthropic-version": "2023-06-01",
-            })
-        headers=self.headers
-        temperature=self.temperature
-        url=self.base_url or "https://api.anthropic.com/v1/messages"
-        contents=[]
-        system_instruct=None
-        for message in messages:
-            if isinstance(message,(HumanMessage,AIMessage)):
-                contents.append(message.to_dict())
-            elif isinstance(message,ImageMessage):
-                text,image=message.content
-                contents.append([
-                    {
-                        'role':'user',
-                        'content':[
-                            {
-                                'type':'text',
-                                'text':text
-                            },
-                            {
-                                'type':'image',
-                                'source':{
-                                    'type':'base64',
-                                    'media_type':'image/png',
-                                    'data':image
-                                }
-                            }
-                        ]
-                    }
-                ])
-            elif isinstance(message,SystemMessage):
-                system_instruct=self.structured(message,model) if model else message.content
-            else:
-                raise Exception("Invalid Message")
+    provider='anthropic'
+    encode=staticmethod(encode_anthropic)
+
+    def payload(self,messages:list[BaseMessage],json:bool=False,model:BaseModel=None)->dict:
+        messages=self.with_schema(messages,model)
+        contents=self.compiler.compile(messages)
+        system_instruct=next((message.content for message in messages if isinstance(message,SystemMessage)),None)
 
         payload={
             "model": self.model,
             "messages": contents,
-            "temperature": temperature,
+            "temperature": self.temperature,
             "response_format": {
                 "type": "json_object" if json or model else "text"
             },
@@ -75,131 +41,140 @@ class ChatAnthropic(BaseInference):
                 }
             } for tool in self.tools]
         if system_instruct:
-            payload['system']=system_instruct
+            # Cache breakpoint after the static prefix (tools and system prompt) that every step of an agent resends
+            payload['system']=[{'type':'text','text':system_instruct,'cache_control':{'type':'ephemeral'}}]
+        return payload
+
+    def usage(self,usage_metadata:dict)->tuple[int,int]:
+        '''Input tokens including the ones read from and written to the prompt cache, and the cached ones'''
+        cached=usage_metadata.get('cache_read_input_tokens') or 0
+        input=usage_metadata.get('input_tokens',0)+cached+(usage_metadata.get('cache_creation_input_tokens') or 0)
+        return input,cached
+
+    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
+    def invoke(self, messages: list[BaseMessage],json:bool=False,model:BaseModel=None)->AIMessage|ToolMessage|BaseModel:
+        self.acquire()
+        self.headers.update({
+            'x-api-key': self.api_key,
+            "anthropic-version": "2023-06-01",
+            })
+        headers=self.headers
+        url=self.base_url or "https://api.anthropic.com/v1/messages"
+        payload=self.payload(messages,json=json,model=model)
         try:
-            with Client() as client:
-                response=client.post(url=url,json=payload,headers=headers,timeout=None)
-            json_object=response.json()
+            response=self.client.post(url=url,content=self.body(payload),headers=headers)
+            json_object=loads(response.content)
             # print(json_object)
             if json_object.get('error'):
-                raise HTTPError(json_object['error']['message'])
+                raise HTTPError(json_object['error']['message'],response=response)
             message = json_object['content'][0]
             usage_metadata=json_object['usage']
-            input,output,total=usage_metadata['input_tokens'],usage_metadata['output_tokens']
+            (input,cached),output=self.usage(usage_metadata),usage_metadata['output_tokens']
             total=input+output
-            self.tokens=Token(input=input,output=output,total=total)
+            self.update_tokens(Token(input=input,output=output,total=total,cached=cached))
             if model:
                 return model.model_validate_json(message.get('text'))
             if json:
                 return AIMessage(loads(message.get('text')))
-            if message.get('content'):
+            if message.get('type')=='text':
                 return AIMessage(message.get('text'))
             else:
                 tool_call=message
                 return ToolMessage(id= tool_call['id'] or str(uuid4()),name=tool_call['name'],args=tool_call['input']) 
-        except HTTPError as err:
-            err_object=loads(err.response.text)
-            print(f'\nError: {err_object["error"]["message"]}\nStatus Code: {err.response.status_code}')
-        except ConnectionError as err:
-            print(err)
-        exit()
+        except (HTTPError,HTTPStatusError,ConnectionError,TransportError) as err:
+            raise self.error(err) from err
 
-    @sleep_and_retry
-    @limits(calls=15,period=60)
     @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
     async def async_invoke(self, messages: list[BaseMessage], json: bool = False, model: BaseModel = None) -> AIMessage | ToolMessage | BaseModel:
+        await self.async_acquire()
         self.headers.update({
             'x-api-key': self.api_key,
             "anthropic-version": "2023-06-01",
         })
         headers = self.headers
-        temperature = self.temperature
         url = self.base_url or "https://api.anthropic.com/v1/messages"
-        contents = []
-        system_instruct = None
+        payload = self.payload(messages, json=json, model=model)
 
-        for message in messages:
-            if isinstance(message, (HumanMessage, AIMessage)):
-                contents.append(message.to_dict())
-            elif isinstance(message, ImageMessage):
-                text, image = message.content
-                contents.append([
-                    {
-                        'role': 'user',
-                        'content': [
-                            {
-                                'type': 'text',
-                                'text': text
-                            },
-                            {
-                                'type': 'image',
-                                'source': {
-                                    'type': 'base64',
-                                    'media_type': 'image/png',
-                                    'data': image
-                                }
-                            }
-                        ]
-                    }
-                ])
-            elif isinstance(message, SystemMessage):
-                system_instruct = self.structured(message, model) if model else message.content
+        try:
+            response=await self.async_client.post(url, content=self.body(payload), headers=headers)
+            response.raise_for_status()
+            json_object = loads(response.content)
+            if json_object.get('error'):
+                raise HTTPError(json_object['error']['message'],response=response)
+            message = json_object['content'][0]
+            usage_metadata = json_object['usage']
+            (input, cached), output= self.usage(usage_metadata), usage_metadata['output_tokens']
+            total=input+output
+            self.update_tokens(Token(input=input, output=output, total=total, cached=cached))
+            if model:
+                return model.model_validate_json(message.get('text'))
+            if json:
+                return AIMessage(loads(message.get('text')))
+            if message.get('type')=='text':
+                return AIMessage(message.get('text'))
             else:
-                raise Exception("Invalid Message")
-
-        payload = {
-            "model": self.model,
-            "messages": contents,
-            "temperature": temperature,
-            "response_format": {
-                "type": "json_object" if json or model else "text"
-            },
-            "stream": False,
-        }
-        if self.tools:
-            payload["tools"] = [{
-                'type': 'function',
-                'function': {
-                    'name': tool.name,
-                    'description': tool.description,
-                    'input_schema': tool.schema
-                }
-            } for tool in self.tools]
-        if system_instruct:
-            payload['system'] = system_instruct
+                tool_call = message
+                return ToolMessage(id=tool_call['id'] or str(uuid4()), name=tool_call['name'], args=tool_call['input'])
+        except (HTTPError,HTTPStatusError,ConnectionError,TransportError) as err:
+            raise self.error(err) from err
+    
+    def stream(self, messages: list[BaseMessage],json=False)->Generator[str,None,None]:
+        self.acquire()
+        self.headers.update({
+            'x-api-key': self.api_key,
+            "anthropic-version": "2023-06-01",
+            })
+        headers=self.headers
+        url=self.base_url or "https://api.anthropic.com/v1/messages"
+        payload=self.payload(messages,json=json)|{'stream':True}
+        body=self.body(payload)
+        usage=StreamUsage(body)
+        try:
+            with self.client.stream('POST',url=url,content=body,headers=headers) as response:
+                response.raise_for_status()
+                for event in self.iter_sse(response):
+                    if event.get('type')=='message_start':
+                        input,cached=self.usage(event['message']['usage'])
+                        usage.report(input=input,cached=cached)
+                    elif event.get('type')=='content_block_delta':
+                        yield usage.add(event['delta'].get('text',''))
+                    elif event.get('type')=='message_delta':
+                        usage.report(output=event['usage']['output_tokens'])
+                    elif event.get('type')=='error':
+                        raise InferenceError(f"{self.provider} stream from {self.model} failed: {event['error']['message']}",retryable=event['error'].get('type') in ('overloaded_error','api_error'))
+        except (HTTPStatusError,TransportError) as err:
+            raise self.error(err) from err
+        finally:
+            self.record_stream(usage)
 
+    async def async_stream(self, messages: list[BaseMessage],json=False)->AsyncGenerator[str,None]:
+        await self.async_acquire()
+        self.headers.update({
+            'x-api-key': self.api_key,
+            "anthropic-version": "2023-06-01",
+            })
+        headers=self.headers
+        url=self.base_url or "https://api.anthropic.com/v1/messages"
+        payload=self.payload(messages,json=json)|{'stream':True}
+        body=self.body(payload)
+        usage=StreamUsage(body)
         try:
-            async with AsyncClient() as client:
-                response = await client.post(url, json=payload, headers=headers)
+            async with self.async_client.stream('POST',url=url,content=body,headers=headers) as response:
                 response.raise_for_status()
-                json_object = response.json()
-                if json_object.get('error'):
-                    raise HTTPError(json_object['error']['message'])
-                message = json_object['content'][0]
-                usage_metadata = json_object['usage']
-                input, output= usage_metadata['input_tokens'], usage_metadata['output_tokens']
-                total=input+output
-                self.tokens = Token(input=input, output=output, total=total)
-                if model:
-                    return model.model_validate_json(message.get('text'))
-                if json:
-                    return AIMessage(loads(message.get('text')))
-                if message.get('content'):
-                    return AIMessage(message.get('text'))
-                else:
-                    tool_call = message
-                    return ToolMessage(id=tool_call['id'] or str(uuid4()), name=tool_call['name'], args=tool_call['input'])
-        except HTTPError as err:
-            err_object = loads(err.response.text)
-            print(f'\nError: {err_object["error"]["message"]}\nStatus Code: {err.response.status_code}')
-        except Exception as err:
-            print(err)
-    
-    @sleep_and_retry
-    @limits(calls=15,period=60)
-    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
-    def stream(self, messages: list[BaseMessage],json=False)->Generator[str,None,None]:
-        pass
+                async for event in self.aiter_sse(response):
+                    if event.get('type')=='message_start':
+                        input,cached=self.usage(event['message']['usage'])
+                        usage.report(input=input,cached=cached)
+                    elif event.get('type')=='content_block_delta':
+                        yield usage.add(event['delta'].get('text',''))
+                    elif event.get('type')=='message_delta':
+                        usage.report(output=event['usage']['output_tokens'])
+                    elif event.get('type')=='error':
+                        raise InferenceError(f"{self.provider} stream from {self.model} failed: {event['error']['message']}",retryable=event['error'].get('type') in ('overloaded_error','api_error'))
+        except (HTTPStatusError,TransportError) as err:
+            raise self.error(err) from err
+        finally:
+            self.record_stream(usage)
     
     def available_models(self):
         url='https://api.groq.com/openai/v1/models'
@@ -207,5 +182,5 @@ class ChatAnthropic(BaseInference):
         headers=self.headers
         response=requests.get(url=url,headers=headers)
         response.raise_for_status()
-        models=response.json()
+        models=loads(response.content)
         return [model['id'] for model in models['data'] if model['active']]
\ No newline at end of file
@@ -0,0 +1,209 @@
+from src.message import AIMessage,BaseMessage,ImageMessage,ToolMessage
+from typing import Generator,AsyncGenerator
+from src.inference.config import CacheConfig
+from src.inference import BaseInference,Token
+from collections import OrderedDict
+from json import dumps,loads
+from pydantic import BaseModel
+from threading import Lock
+from hashlib import sha256
+from time import time
+import sqlite3
+
+class ResponseCache:
+    '''In-memory LRU of serialized responses, backed by an optional SQLite file shared across runs'''
+    def __init__(self,config:CacheConfig=None):
+        self.config=config if config else CacheConfig()
+        self.entries:OrderedDict[str,tuple[str,float|None]]=OrderedDict()
+        self.lock=Lock()
+        self.hits=0
+        self.misses=0
+        self.connection=None
+        if self.config.path:
+            self.connection=sqlite3.connect(self.config.path,check_same_thread=False)
+            self.connection.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)')
+            self.connection.commit()
+
+    def get(self,key:str)->str|None:
+        now=time()
+        with self.lock:
+            if key in self.entries:
+                value,expires=self.entries[key]
+                if expires is None or expires>now:
+                    self.entries.move_to_end(key)
+                    self.hits+=1
+                    return value
+                del self.entries[key]
+            if self.connection is not None:
+                row=self.connection.execute('SELECT value,expires FROM cache WHERE key=?',(key,)).fetchone()
+                if row is not None:
+                    value,expires=row
+                    if expires is None or expires>now:
+                        self._remember(key,value,expires)
+                        self.hits+=1
+                        return value
+                    self.connection.execute('DELETE FROM cache WHERE key=?',(key,))
+                    self.connection.commit()
+            self.misses+=1
+            return None
+
+    def set(self,key:str,value:str):
+        expires=time()+self.config.ttl if self.config.ttl else None
+        with self.lock:
+            self._remember(key,value,expires)
+            if self.connection is not None:
+                self.connection.execute('INSERT OR REPLACE INTO cache (key,value,expires) VALUES (?,?,?)',(key,value,expires))
+                self.connection.commit()
+
+    def _remember(self,key:str,value:str,expires:float|None):
+        self.entries[key]=(value,expires)
+        self.entries.move_to_end(key)
+        while len(self.entries)>self.config.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            if self.connection is not None:
+                self.connection.execute('DELETE FROM cache')
+                self.connection.commit()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection=None
+
+    @property
+    def stats(self)->dict[str,int]:
+        return {'hits':self.hits,'misses':self.misses,'entries':len(self.entries)}
+
+class CachedInference:
+    '''
+    Opt-in response cache around any `BaseInference`.
+
+    Calls are keyed on a hash of the provider, model, temperature, tools, messages and the requested output format.
+    Only deterministic (temperature 0) calls are cached unless `deterministic_only` is turned off in the config.
+    Every other attribute is forwarded to the wrapped inference.
+    '''
+    def __init__(self,llm:BaseInference,config:CacheConfig=None,cache:ResponseCache=None):
+        self.llm=llm
+        self.cache=cache if cache else ResponseCache(config)
+        self.tokens:Token=llm.tokens
+
+    def __getattr__(self,name:str):
+        return getattr(self.llm,name)
+
+    @property
+    def cacheable(self)->bool:
+        return not self.cache.config.deterministic_only or self.llm.temperature==0
+
+    def key(self,messages:list[BaseMessage]|str,json:bool=False,model:BaseModel=None,stream:bool=False)->str:
+        if isinstance(messages,str):
+            messages=[messages]
+        request={
+            'provider':self.llm.provider or self.llm.__class__.__name__,
+            'model':self.llm.model,
+            'temperature':self.llm.temperature,
+            'tools':[{'name':tool.name,'description':tool.description,'parameters':tool.schema} for tool in self.llm.tools],
+            'messages':[self.serialize_message(message) for message in messages],
+            'json':json,
+            'schema':model.model_json_schema() if model else None,
+            'stream':stream
+        }
+        return sha256(dumps(request,sort_keys=True,default=str).encode()).hexdigest()
+
+    def serialize_message(self,message:BaseMessage|str)->dict|str:
+        if isinstance(message,str):
+            return message
+        if isinstance(message,ToolMessage):
+            return {'role':message.role,'name':message.name,'args':message.args}
+        if isinstance(message,ImageMessage):
+            text,image=message.content
+            return {'role':message.role,'text':text,'image':sha256(image.encode()).hexdigest()}
+        return {'role':message.role,'content':message.content}
+
+    def dump(self,response:AIMessage|ToolMessage|BaseModel)->str:
+        if isinstance(response,BaseModel):
+            return dumps({'type':'model','content':response.model_dump(mode='json')})
+        if isinstance(response,ToolMessage):
+            return dumps({'type':'tool','id':response.id,'name':response.name,'args':response.args})
+        return dumps({'type':'ai','content':response.content})
+
+    def load(self,value:str,model:BaseModel=None)->AIMessage|ToolMessage|BaseModel:
+        data=loads(value)
+        match data['type']:
+            case 'model':
+                return model.model_validate(data['content'])
+            case 'tool':
+                return ToolMessage(id=data['id'],name=data['name'],args=data['args'])
+            case _:
+                return AIMessage(data['content'])
+
+    def lookup(self,key:str,model:BaseModel=None)->AIMessage|ToolMessage|BaseModel|None:
+        value=self.cache.get(key)
+        if value is None:
+            return None
+        self.tokens=Token(input=0,output=0,total=0)
+        return self.load(value,model)
+
+    def store(self,key:str,response:AIMessage|ToolMessage|BaseModel|None):
+        self.tokens=self.llm.tokens
+        # Failed calls raise before anything is stored, an empty response is not kept either
+        if response is not None:
+            self.cache.set(key,self.dump(response))
+
+    def invoke(self,messages:list[BaseMessage]|str,json:bool=False,model:BaseModel=None)->AIMessage|ToolMessage|BaseModel:
+        if not self.cacheable:
+            response=self.llm.invoke(messages,json=json,model=model)
+            self.tokens=self.llm.tokens
+            return response
+        key=self.key(messages,json=json,model=model)
+        if (response:=self.lookup(key,model)) is not None:
+            return response
+        response=self.llm.invoke(messages,json=json,model=model)
+        self.store(key,response)
+        return response
+
+    async def async_invoke(self,messages:list[BaseMessage]|str,json:bool=False,model:BaseModel=None)->AIMessage|ToolMessage|BaseModel:
+        if not self.cacheable:
+            response=await self.llm.async_invoke(messages,json=json,model=model)
+            self.tokens=self.llm.tokens
+            return response
+        key=self.key(messages,json=json,model=model)
+        if (response:=self.lookup(key,model)) is not None:
+            return response
+        response=await self.llm.async_invoke(messages,json=json,model=model)
+        self.store(key,response)
+        return response
+
+    def stream(self,messages:list[BaseMessage]|str,json:bool=False)->Generator[str,None,None]:
+        if not self.cacheable:
+            yield from self.llm.stream(messages,json=json)
+            self.tokens=self.llm.tokens
+            return
+        key=self.key(messages,json=json,stream=True)
+        if (response:=self.lookup(key)) is not None:
+            yield response.content
+            return
+        chunks=[]
+        for chunk in self.llm.stream(messages,json=json):
+            chunks.append(chunk)
+            yield chunk
+        # Only a stream consumed to the end is a complete response
+        self.store(key,AIMessage(''.join(chunks)))
+
+    async def async_stream(self,messages:list[BaseMessage]|str,json:bool=False)->AsyncGenerator[str,None]:
+        if not self.cacheable:
+            async for chunk in self.llm.async_stream(messages,json=json):
+                yield chunk
+            self.tokens=self.llm.tokens
+            return
+        key=self.key(messages,json=json,stream=True)
+        if (response:=self.lookup(key)) is not None:
+            yield response.content
+            return
+        chunks=[]
+        async for chunk in self.llm.async_stream(messages,json=json):
+            chunks.append(chunk)
+            yield chunk
+        self.store(key,AIMessage(''.join(chunks)))
@@ -0,0 +1,139 @@
+from src.message import AIMessage,BaseMessage,HumanMessage,ImageMessage,SystemMessage
+from weakref import WeakKeyDictionary
+from src.codec import dumps
+from typing import Callable
+
+class Encoded(list):
+    '''Messages already serialized to JSON, spliced verbatim into the request body'''
+
+class PayloadCompiler:
+    '''
+    Serializes messages to the JSON of a provider dialect and memoizes the encoding of every message object,
+    so the history resent on each step is not rebuilt and only the new tail messages are serialized.
+
+    An encoding is reused while the message still holds the same content object, messages are dropped from the memo with their last reference.
+    '''
+    def __init__(self,encoder:Callable[[BaseMessage],dict|None]):
+        self.encoder=encoder
+        self.encodings:WeakKeyDictionary[BaseMessage,tuple[object,bytes|None]]=WeakKeyDictionary()
+
+    def encode(self,message:BaseMessage)->bytes|None:
+        content=getattr(message,'content',None)
+        entry=self.encodings.get(message)
+        if entry is not None and entry[0] is content:
+            return entry[1]
+        encoded=self.encoder(message)
+        data=None if encoded is None else dumps(encoded)
+        self.encodings[message]=(content,data)
+        return data
+
+    def compile(self,messages:list[BaseMessage])->Encoded:
+        return Encoded(data for message in messages if (data:=self.encode(message)) is not None)
+
+def body(payload:dict)->bytes:
+    '''The JSON request body of a payload, with its encoded messages spliced in as they are'''
+    fields=[]
+    for key,value in payload.items():
+        if isinstance(value,Encoded):
+            fields.append(dumps(key)+b':['+b','.join(value)+b']')
+        else:
+            fields.append(dumps({key:value})[1:-1])
+    return b'{'+b','.join(fields)+b'}'
+
+def data_url(image:str,mime_type:str='image/png')->str:
+    if image.startswith(('data:','http://','https://')):
+        return image
+    return f'data:{mime_type};base64,{image}'
+
+def encode_openai(message:BaseMessage)->dict|None:
+    '''Chat completions dialect shared by OpenAI, Groq, Mistral and OpenRouter'''
+    if isinstance(message,ImageMessage):
+        text,image=message.content
+        return {
+            'role':'user',
+            'content':[
+                {
+                    'type':'text',
+                    'text':text
+                },
+                {
+                    'type':'image_url',
+                    'image_url':{
+                        'url':data_url(image,message.mime_type)
+                    }
+                }
+            ]
+        }
+    if isinstance(message,(SystemMessage,HumanMessage,AIMessage)):
+        return message.to_dict()
+    return None
+
+def encode_anthropic(message:BaseMessage)->dict|None:
+    '''Messages API dialect, the system prompt is sent apart from the messages'''
+    if isinstance(message,ImageMessage):
+        text,image=message.content
+        return {
+            'role':'user',
+            'content':[
+                {
+                    'type':'text',
+                    'text':text
+                },
+                {
+                    'type':'image',
+                    'source':{
+                        'type':'base64',
+                        'media_type':message.mime_type,
+                        'data':image
+                    }
+                }
+            ]
+        }
+    if isinstance(message,(HumanMessage,AIMessage)):
+        return message.to_dict()
+    if isinstance(message,SystemMessage):
+        return None
+    raise Exception("Invalid Message")
+
+def encode_gemini(message:BaseMessage)->dict|None:
+    '''generateContent dialect, the system instruction is sent apart from the contents'''
+    if isinstance(message,HumanMessage):
+        return {
+            'role':'user',
+            'parts':[{
+                'text':message.content
+            }]
+        }
+    if isinstance(message,AIMessage):
+        return {
+            'role':'model',
+            'parts':[{
+                'text':message.content
+            }]
+        }
+    if isinstance(message,ImageMessage):
+        text,image=message.content
+        return {
+            'role':'user',
+            'parts':[
+                {
+                    'text':text
+                },
+                {
+                    'inline_data':{
+                        'mime_type':message.mime_type,
+                        'data':image
+                    }
+                }
+            ]
+        }
+    if isinstance(message,SystemMessage):
+        return None
+    raise Exception("Invalid Message")
+
+def encode_ollama(message:BaseMessage)->dict|None:
+    '''Ollama chat dialect, images are attached as raw base64'''
+    if isinstance(message,ImageMessage):
+        text,image=message.content
+        return {'role':'user','content':text,'images':[image]}
+    return message.to_dict()
@@ -0,0 +1,231 @@
+from concurrent.futures import ThreadPoolExecutor,wait,FIRST_COMPLETED
+from src.inference import BaseInference,InferenceError
+from typing import Generator,AsyncGenerator
+from src.message import AIMessage,BaseMessage
+from contextvars import copy_context
+from collections import deque
+from pydantic import BaseModel
+from time import perf_counter
+import asyncio
+
+# Shared by the synchronous calls that need a timeout or a hedge, a thread blocked on a request cannot be cancelled
+executor=ThreadPoolExecutor(max_workers=8,thread_name_prefix='inference')
+
+class FallbackInference(BaseInference):
+    '''
+    Tries the providers in order and fails over to the next one when a call raises, returns nothing or exceeds `timeout` seconds.
+
+    A stream only fails over until its first chunk, once text has been yielded it cannot be replaced.
+    '''
+    provider='fallback'
+
+    def __init__(self,llms:list[BaseInference],timeout:float|None=None):
+        if not llms:
+            raise ValueError('At least one inference is required')
+        primary=llms[0]
+        # The wrapped providers enforce their own rate limits
+        super().__init__(primary.model,tools=primary.tools,temperature=primary.temperature,requests_per_minute=None)
+        self.llms=llms
+        self.timeout=timeout
+        self.llm:BaseInference=primary
+
+    def call(self,llm:BaseInference,messages:list[BaseMessage],json:bool=False,model:BaseModel=None)->AIMessage|BaseModel:
+        if self.timeout is None:
+            response=llm.invoke(messages,json=json,model=model)
+        else:
+            future=executor.submit(copy_context().run,llm.invoke,messages,json=json,model=model)
+            response=future.result(timeout=self.timeout)
+        if response is None:
+            raise InferenceError(f'{llm.provider} returned no completion')
+        return response
+
+    async def async_call(self,llm:BaseInference,messages:list[BaseMessage],json:bool=False,model:BaseModel=None)->AIMessage|BaseModel:
+        response=await asyncio.wait_for(llm.async_invoke(messages,json=json,model=model),timeout=self.timeout)
+        if response is None:
+            raise InferenceError(f'{llm.provider} returned no completion')
+        return response
+
+    def close(self):
+        for llm in self.llms:
+            llm.close()
+
+    async def aclose(self):
+        for llm in self.llms:
+            await llm.aclose()
+
+    def answered(self,llm:BaseInference):
+        self.llm=llm
+        self.model=llm.model
+        self.tokens=llm.tokens
+
+    def invoke(self,messages:list[BaseMessage],json:bool=False,model:BaseModel=None)->AIMessage|BaseModel:
+        return self.failover(self.llms,messages,json=json,model=model)
+
+    async def async_invoke(self,messages:list[BaseMessage],json:bool=False,model:BaseModel=None)->AIMessage|BaseModel:
+        return await self.async_failover(self.llms,messages,json=json,model=model)
+
+    def failover(self,llms:list[BaseInference],messages:list[BaseMessage],json:bool=False,model:BaseModel=None,errors:list[Exception]=None)->AIMessage|BaseModel:
+        errors=errors if errors is not None else []
+        for llm in llms:
+            try:
+                response=self.call(llm,messages,json=json,model=model)
+            except Exception as err:
+                errors.append(err)
+                continue
+            self.answered(llm)
+            return response
+        raise InferenceError(f'All providers failed: {errors}')
+
+    async def async_failover(self,llms:list[BaseInference],messages:list[BaseMessage],json:bool=False,model:BaseModel=None,errors:list[Exception]=None)->AIMessage|BaseModel:
+        errors=errors if errors is not None else []
+        for llm in llms:
+            try:
+                response=await self.async_call(llm,messages,json=json,model=model)
+            except Exception as err:
+                errors.append(err)
+                continue
+            self.answered(llm)
+            return response
+        raise InferenceError(f'All providers failed: {errors}')
+
+    def stream(self,messages:list[BaseMessage],json:bool=False)->Generator[str,None,None]:
+        errors=[]
+        for llm in self.llms:
+            stream=llm.stream(messages,json=json)
+            try:
+                first=next(stream)
+            except StopIteration:
+                self.answered(llm)
+                return
+            except Exception as err:
+                errors.append(err)
+                continue
+            yield first
+            yield from stream
+            self.answered(llm)
+            return
+        raise InferenceError(f'All providers failed: {errors}')
+
+    async def async_stream(self,messages:list[BaseMessage],json:bool=False)->AsyncGenerator[str,None]:
+        errors=[]
+        for llm in self.llms:
+            stream=llm.async_stream(messages,json=json)
+            try:
+                first=await asyncio.wait_for(anext(stream),timeout=self.timeout)
+            except StopAsyncIteration:
+                self.answered(llm)
+                return
+            except Exception as err:
+                await stream.aclose()
+                errors.append(err)
+                continue
+            yield first
+            async for chunk in stream:
+                yield chunk
+            self.answered(llm)
+            return
+        raise InferenceError(f'All providers failed: {errors}')
+
+class HedgedInference(FallbackInference):
+    '''
+    Sends the request to the first provider and, if it has not answered once its recent `quantile` latency has passed,
+    fires a duplicate request to the second one. Whichever finishes first wins and the other is cancelled,
+    the remaining providers are tried in order if both fail.
+
+    `hedge_after` fixes the threshold in seconds, otherwise it is learned from the last `window` latencies of the
+    first provider (no hedging until `min_samples` have been observed).
+    '''
+    provider='hedged'
+
+    def __init__(self,llms:list[BaseInference],timeout:float|None=None,hedge_after:float|None=None,quantile:float=0.95,window:int=100,min_samples:int=10):
+        super().__init__(llms,timeout=timeout)
+        self.hedge_after=hedge_after
+        self.quantile=quantile
+        self.min_samples=min_samples
+        self.latencies:deque[float]=deque(maxlen=window)
+
+    @property
+    def threshold(self)->float|None:
+        if self.hedge_after is not None:
+            return self.hedge_after
+        if len(self.latencies)<self.min_samples:
+            return None
+        latencies=sorted(self.latencies)
+        return latencies[min(len(latencies)-1,int(self.quantile*len(latencies)))]
+
+    def invoke(self,messages:list[BaseMessage],json:bool=False,model:BaseModel=None)->AIMessage|BaseModel:
+        threshold=self.threshold
+        if len(self.llms)<2 or threshold is None:
+            started=perf_counter()
+            response=self.failover(self.llms,messages,json=json,model=model)
+            if self.llm is self.llms[0]:
+                self.latencies.append(perf_counter()-started)
+            return response
+        primary,secondary=self.llms[:2]
+        errors=[]
+        started=perf_counter()
+        futures={executor.submit(copy_context().run,self.call,primary,messages,json=json,model=model):primary}
+        done,_=wait(futures,timeout=threshold)
+        if not done:
+            futures[executor.submit(copy_context().run,self.call,secondary,messages,json=json,model=model)]=secondary
+        pending=set(futures)
+        while pending:
+            done,pending=wait(pending,return_when=FIRST_COMPLETED)
+            for future in done:
+                llm=futures[future]
+                try:
+                    response=future.result()
+                except Exception as err:
+                    errors.append(err)
+                    # The primary failed before the hedge fired, fail over to the secondary right away
+                    if llm is primary and secondary not in futures.values():
+                        hedge=executor.submit(copy_context().run,self.call,secondary,messages,json=json,model=model)
+                        futures[hedge]=secondary
+                        pending.add(hedge)
+                    continue
+                for other in pending:
+                    other.cancel()
+                # A primary still running when the secondary wins took at least this long
+                if llm is primary or primary in (futures[other] for other in pending):
+                    self.latencies.append(perf_counter()-started)
+                self.answered(llm)
+                return response
+        return self.failover(self.llms[2:],messages,json=json,model=model,errors=errors)
+
+    async def async_invoke(self,messages:list[BaseMessage],json:bool=False,model:BaseModel=None)->AIMessage|BaseModel:
+        threshold=self.threshold
+        if len(self.llms)<2 or threshold is None:
+            started=perf_counter()
+            response=await self.async_failover(self.llms,messages,json=json,model=model)
+            if self.llm is self.llms[0]:
+                self.latencies.append(perf_counter()-started)
+            return response
+        primary,secondary=self.llms[:2]
+        errors=[]
+        started=perf_counter()
+        tasks={asyncio.create_task(self.async_call(primary,messages,json=json,model=model)):primary}
+        done,_=await asyncio.wait(tasks,timeout=threshold)
+        if not done:
+            tasks[asyncio.create_task(self.async_call(secondary,messages,json=json,model=model))]=secondary
+        pending=set(tasks)
+        try:
+            while pending:
+                done,pending=await asyncio.wait(pending,return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    llm=tasks[task]
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                        if llm is primary and secondary not in tasks.values():
+                            hedge=asyncio.create_task(self.async_call(secondary,messages,json=json,model=model))
+                            tasks[hedge]=secondary
+                            pending.add(hedge)
+                        continue
+                    # A primary still running when the secondary wins took at least this long
+                    if llm is primary or primary in (tasks[other] for other in pending):
+                        self.latencies.append(perf_counter()-started)
+                    self.answered(llm)
+                    return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+        return await self.async_failover(self.llms[2:],messages,json=json,model=model,errors=errors)
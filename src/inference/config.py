@@ -0,0 +1,17 @@
+from dataclasses import dataclass
+
+@dataclass
+class HTTPConfig:
+    http2:bool=True
+    max_connections:int=10
+    max_keepalive_connections:int=5
+    keepalive_expiry:float=60
+    timeout:float|None=None
+
+@dataclass
+class CacheConfig:
+    max_entries:int=256
+    ttl:float|None=3600
+    # SQLite file of the on-disk tier, the cache is in-memory only without it
+    path:str|None=None
+    deterministic_only:bool=True
@@ -1,72 +1,39 @@
-from src.message import AIMessage,BaseMessage,HumanMessage,ImageMessage,SystemMessage,ToolMessage
+from src.message import AIMessage,BaseMessage,SystemMessage,ToolMessage
 from tenacity import retry,stop_after_attempt,retry_if_exception_type
 from requests import get,RequestException,ConnectionError
-from ratelimit import limits,sleep_and_retry
-from src.inference import BaseInference,Token
-from httpx import Client,AsyncClient,HTTPError
+from src.inference import BaseInference,Token,StreamUsage
+from src.inference.compiler import encode_gemini
+from src.inference.config import HTTPConfig
 from pydantic import BaseModel
+from httpx import HTTPError,HTTPStatusError
+from typing import Generator,AsyncGenerator
 from typing import Literal
-from json import loads
+from src.codec import loads
+from json import dumps
+from hashlib import sha256
+from time import monotonic
 from uuid import uuid4
 
 class ChatGemini(BaseInference):
-    def __init__(self,model:str,api_version:Literal['v1','v1beta','v1alpha']='v1beta',modality:Literal['text','audio']='text',api_key:str='',base_url:str='',tools:list=[],temperature:float=0.5):
-        super().__init__(model,api_key=api_key,base_url=base_url,tools=tools,temperature=temperature)
+    provider='gemini'
+    encode=staticmethod(encode_gemini)
+
+    def __init__(self,model:str,api_version:Literal['v1','v1beta','v1alpha']='v1beta',modality:Literal['text','audio']='text',api_key:str='',base_url:str='',tools:list=[],temperature:float=0.5,http_config:HTTPConfig=None,requests_per_minute:int|None=15,tokens_per_minute:int|None=None,cache_ttl:int|None=300):
+        super().__init__(model,api_key=api_key,base_url=base_url,tools=tools,temperature=temperature,http_config=http_config,requests_per_minute=requests_per_minute,tokens_per_minute=tokens_per_minute)
         self.api_version=api_version
         self.modality=modality
+        self.cache_ttl=cache_ttl
+        self.cached_contents:dict[str,tuple[str|None,float]]={}
 
-    @sleep_and_retry
-    @limits(calls=15,period=60)
-    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
-    def invoke(self, messages: list[BaseMessage],json=False,model:BaseModel|None=None) -> AIMessage|ToolMessage|BaseModel:
-        headers=self.headers
-        temperature=self.temperature
-        url=self.base_url or f"https://generativelanguage.googleapis.com/{self.api_version}/models/{self.model}:generateContent"
-        params={'key':self.api_key}
-        contents=[]
-        system_instruct=None
-        for message in messages:
-            if isinstance(message,HumanMessage):
-                contents.append({
-                    'role':'user',
-                    'parts':[{
-                        'text':message.content
-                    }]
-                })
-            elif isinstance(message,AIMessage):
-                contents.append({
-                    'role':'model',
-                    'parts':[{
-                        'text':message.content
-                    }]
-                })
-            elif isinstance(message,ImageMessage):
-                text,image=message.content
-                contents.append({
-                        'role':'user',
-                        'parts':[{
-                            'text':text
-                    },
-                    {
-                        'inline_data':{
-                            'mime_type':'image/jpeg',
-                            'data': image
-                        }
-                    }]
-                })
-            elif isinstance(message,SystemMessage):
-                system_instruct={
-                    'parts':{
-                        'text': self.structured(message,model) if model else message.content
-                    }
-                }
-            else:
-                raise Exception("Invalid Message")
+    def payload(self,messages:list[BaseMessage],json:bool=False,model:BaseModel=None)->dict:
+        messages=self.with_schema(messages,model)
+        contents=self.compiler.compile(messages)
+        system_instruct=next(({'parts':{'text':message.content}} for message in messages if isinstance(message,SystemMessage)),None)
 
         payload={
             'contents': contents,
             'generationConfig':{
-                'temperature': temperature,
+                'temperature': self.temperature,
                 'responseMimeType':'application/json' if json or model else 'text/plain',
                 'responseModalities': [self.modality]
             }
@@ -85,17 +52,79 @@ class ChatGemini(BaseInference):
             ]
         if system_instruct:
             payload['system_instruction']=system_instruct
+        return payload
+
+    def cache_body(self,payload:dict)->dict|None:
+        '''The cachedContents resource holding the static prefix (system instruction and tools) of the payload'''
+        if not self.cache_ttl or self.base_url or 'system_instruction' not in payload:
+            return None
+        body={'model':f'models/{self.model}','system_instruction':payload['system_instruction'],'ttl':f'{self.cache_ttl}s'}
+        if 'tools' in payload:
+            body['tools']=payload['tools']
+        return body
+
+    def with_cache(self,payload:dict,name:str|None)->dict:
+        if name is None:
+            return payload
+        payload={key:value for key,value in payload.items() if key not in ('system_instruction','tools')}
+        payload['cachedContent']=name
+        return payload
+
+    def cache(self,payload:dict)->dict:
+        '''Send the static prefix through the context cache instead of inline, when the model supports it'''
+        body=self.cache_body(payload)
+        if body is None:
+            return payload
+        key=sha256(dumps(body,sort_keys=True).encode()).hexdigest()
+        name,expires=self.cached_contents.get(key,(None,0))
+        if expires<=monotonic():
+            url=f"https://generativelanguage.googleapis.com/{self.api_version}/cachedContents"
+            try:
+                response=self.client.post(url=url,headers=self.headers,json=body,params={'key':self.api_key})
+                response.raise_for_status()
+                name=loads(response.content)['name']
+            except HTTPError:
+                # Models without context caching or prompts below the minimum cacheable size, not retried until the entry expires
+                name=None
+            self.cached_contents[key]=(name,monotonic()+self.cache_ttl*0.9)
+        return self.with_cache(payload,name)
+
+    async def async_cache(self,payload:dict)->dict:
+        '''Send the static prefix through the context cache instead of inline, when the model supports it'''
+        body=self.cache_body(payload)
+        if body is None:
+            return payload
+        key=sha256(dumps(body,sort_keys=True).encode()).hexdigest()
+        name,expires=self.cached_contents.get(key,(None,0))
+        if expires<=monotonic():
+            url=f"https://generativelanguage.googleapis.com/{self.api_version}/cachedContents"
+            try:
+                response=await self.async_client.post(url=url,headers=self.headers,json=body,params={'key':self.api_key})
+                response.raise_for_status()
+                name=loads(response.content)['name']
+            except HTTPError:
+                name=None
+            self.cached_contents[key]=(name,monotonic()+self.cache_ttl*0.9)
+        return self.with_cache(payload,name)
+
+    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
+    def invoke(self, messages: list[BaseMessage],json=False,model:BaseModel|None=None) -> AIMessage|ToolMessage|BaseModel:
+        self.acquire()
+        headers=self.headers
+        url=self.base_url or f"https://generativelanguage.googleapis.com/{self.api_version}/models/{self.model}:generateContent"
+        params={'key':self.api_key}
+        payload=self.cache(self.payload(messages,json=json,model=model))
         try:
-            with Client() as client:
-                response=client.post(url=url,headers=headers,json=payload,params=params,timeout=None)
-            json_obj=response.json()
+            response=self.client.post(url=url,headers=headers,content=self.body(payload),params=params)
+            json_obj=loads(response.content)
             # print(json_obj)
             if json_obj.get('error'):
-                raise Exception(json_obj['error']['message'])
+                raise HTTPStatusError(json_obj['error']['message'],request=response.request,response=response)
             message=json_obj['candidates'][0]['content']['parts'][0]
             usage_metadata=json_obj['usageMetadata']
             input,output,total=usage_metadata['promptTokenCount'],usage_metadata['candidatesTokenCount'],usage_metadata['totalTokenCount']
-            self.tokens=Token(input=input,output=output,total=total)
+            cached=usage_metadata.get('cachedContentTokenCount',0)
+            self.update_tokens(Token(input=input,output=output,total=total,cached=cached))
             # print(message)
             if model:
                 return model.model_validate_json(message['text'])
@@ -109,93 +138,27 @@ class ChatGemini(BaseInference):
                 tool_call=message['functionCall']
                 return ToolMessage(id=str(uuid4()),name=tool_call['name'],args=tool_call['args'])
                 
-        except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
-        except ConnectionError as err:
-            print(err)
-        exit()
+        except (HTTPError,ConnectionError) as err:
+            raise self.error(err) from err
 
-    @sleep_and_retry
-    @limits(calls=15,period=60)
     @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
     async def async_invoke(self, messages: list[BaseMessage],json=False,model:BaseModel=None) -> AIMessage|ToolMessage|BaseModel:
+        await self.async_acquire()
         headers=self.headers
-        temperature=self.temperature
-        url=self.base_url or f"https://generativelanguage.googleapis.com/v1beta/models/{self.model}:generateContent"
+        url=self.base_url or f"https://generativelanguage.googleapis.com/{self.api_version}/models/{self.model}:generateContent"
         params={'key':self.api_key}
-        contents=[]
-        system_instruction=None
-        for message in messages:
-            if isinstance(message,HumanMessage):
-                contents.append({
-                    'role':'user',
-                    'parts':[{
-                        'text':message.content
-                    }]
-                })
-            elif isinstance(message,AIMessage):
-                contents.append({
-                    'role':'model',
-                    'parts':[{
-                        'text':message.content
-                    }]
-                })
-            elif isinstance(message,ImageMessage):
-                text,image=message.content
-                contents.append({
-                        'role':'user',
-                        'parts':[{
-                            'text':text
-                    },
-                    {
-                        'inline_data':{
-                            'mime_type':'image/jpeg',
-                            'data': image
-                        }
-                    }]
-                })
-            elif isinstance(message,SystemMessage):
-                system_instruction={
-                    'parts':{
-                        'text': self.structured(message,model) if model else message.content
-                    }
-                }
-            else:
-                raise Exception("Invalid Message")
-
-        payload={
-            'contents': contents,
-            'generationConfig':{
-                'temperature': temperature,
-                'responseMimeType':'application/json' if json or model else 'text/plain',
-                'responseModalities': [self.modality]
-            }
-        }
-        if self.tools:
-            payload['tools']=[
-                {
-                    'function_declarations':[
-                        {
-                            'name': tool.name,
-                            'description': tool.description,
-                            'parameters': tool.schema
-                        }
-                    for tool in self.tools]
-                }
-            ]
-        if system_instruction:
-            payload['system_instruction']=system_instruction
+        payload=await self.async_cache(self.payload(messages,json=json,model=model))
         try:
-            async with AsyncClient() as client:
-                response=await client.post(url=url,headers=headers,json=payload,params=params,timeout=None)
-            json_obj=response.json()
+            response=await self.async_client.post(url=url,headers=headers,content=self.body(payload),params=params)
+            json_obj=loads(response.content)
             # print(json_obj)
             if json_obj.get('error'):
-                raise Exception(json_obj['error']['message'])
+                raise HTTPStatusError(json_obj['error']['message'],request=response.request,response=response)
             message=json_obj['candidates'][0]['content']['parts'][0]
             usage_metadata=json_obj['usageMetadata']
             input,output,total=usage_metadata['promptTokenCount'],usage_metadata['candidatesTokenCount'],usage_metadata['totalTokenCount']
-            self.tokens=Token(input=input,output=output,total=total)
+            cached=usage_metadata.get('cachedContentTokenCount',0)
+            self.update_tokens(Token(input=input,output=output,total=total,cached=cached))
             if model:
                 return model.model_validate_json(message['text'])
             if json:
@@ -208,26 +171,67 @@ class ChatGemini(BaseInference):
                 tool_call=message['functionCall']
                 return ToolMessage(id=str(uuid4()),name=tool_call['name'],args=tool_call['args'])
                 
-        except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
-        except ConnectionError as err:
-            print(err)
-        exit()
+        except (HTTPError,ConnectionError) as err:
+            raise self.error(err) from err
     
-    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
-    def stream(self, query:str):
+    def stream(self, messages: list[BaseMessage],json=False)->Generator[str,None,None]:
+        self.acquire()
         headers=self.headers
-        temperature=self.temperature
-        url=self.base_url or f"https://generativelanguage.googleapis.com/v1beta/models/{self.model}:generateContent"
+        url=self.base_url or f"https://generativelanguage.googleapis.com/{self.api_version}/models/{self.model}:streamGenerateContent"
+        params={'key':self.api_key,'alt':'sse'}
+        payload=self.cache(self.payload(messages,json=json))
+        body=self.body(payload)
+        usage=StreamUsage(body)
+        try:
+            with self.client.stream('POST',url=url,headers=headers,content=body,params=params) as response:
+                response.raise_for_status()
+                for chunk in self.iter_sse(response):
+                    if chunk.get('usageMetadata'):
+                        usage_metadata=chunk['usageMetadata']
+                        input,output=usage_metadata.get('promptTokenCount',0),usage_metadata.get('candidatesTokenCount',0)
+                        cached=usage_metadata.get('cachedContentTokenCount',0)
+                        usage.report(input=input,output=output,cached=cached)
+                    for candidate in chunk.get('candidates',[])[:1]:
+                        for part in candidate.get('content',{}).get('parts',[]):
+                            yield usage.add(part.get('text',''))
+        except HTTPError as err:
+            raise self.error(err) from err
+        finally:
+            self.record_stream(usage)
+
+    async def async_stream(self, messages: list[BaseMessage],json=False)->AsyncGenerator[str,None]:
+        await self.async_acquire()
+        headers=self.headers
+        url=self.base_url or f"https://generativelanguage.googleapis.com/{self.api_version}/models/{self.model}:streamGenerateContent"
+        params={'key':self.api_key,'alt':'sse'}
+        payload=await self.async_cache(self.payload(messages,json=json))
+        body=self.body(payload)
+        usage=StreamUsage(body)
+        try:
+            async with self.async_client.stream('POST',url=url,headers=headers,content=body,params=params) as response:
+                response.raise_for_status()
+                async for chunk in self.aiter_sse(response):
+                    if chunk.get('usageMetadata'):
+                        usage_metadata=chunk['usageMetadata']
+                        input,output=usage_metadata.get('promptTokenCount',0),usage_metadata.get('candidatesTokenCount',0)
+                        cached=usage_metadata.get('cachedContentTokenCount',0)
+                        usage.report(input=input,output=output,cached=cached)
+                    for candidate in chunk.get('candidates',[])[:1]:
+                        for part in candidate.get('content',{}).get('parts',[]):
+                            yield usage.add(part.get('text',''))
+        except HTTPError as err:
+            raise self.error(err) from err
+        finally:
+            self.record_stream(usage)
     
     def available_models(self):
-        url='https://generativelanguage.googleapis.com/v1beta/models'
+        url=f"https://generativelanguage.googleapis.com/{self.api_version}/models"
         headers=self.headers
         params={'key':self.api_key}
         try:
             response=get(url=url,headers=headers,params=params)
             response.raise_for_status()
-            json_obj=response.json()
+            json_obj=loads(response.content)
             models=json_obj['models']
         except HTTPError as err:
             print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
@@ -0,0 +1,113 @@
+from time import monotonic,sleep
+from threading import Lock
+from hashlib import sha256
+import warnings
+import asyncio
+
+class TokenBucket:
+    '''Holds up to `capacity` units and refills them evenly over a minute'''
+    def __init__(self,capacity:int):
+        self.capacity=capacity
+        self.level=capacity
+        self.updated=monotonic()
+
+    def refill(self):
+        now=monotonic()
+        self.level=min(self.capacity,self.level+(now-self.updated)*self.capacity/60)
+        self.updated=now
+
+    def resize(self,capacity:int):
+        self.refill()
+        self.level=min(capacity,self.level)
+        self.capacity=capacity
+
+    def wait_time(self,amount:float)->float:
+        '''Seconds until `amount` units are available'''
+        self.refill()
+        if self.level>=amount:
+            return 0
+        return (amount-self.level)*60/self.capacity
+
+class RateLimiter:
+    '''
+    Requests-per-minute and tokens-per-minute limits for one provider and API key.
+
+    The token count of a request is only known from the usage the provider returns, so a request
+    is admitted while the token bucket is not empty and its actual usage is debited afterwards via `record`.
+    '''
+    def __init__(self,requests_per_minute:int|None=None,tokens_per_minute:int|None=None):
+        self.requests=TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens=TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.lock=Lock()
+
+    @property
+    def limits(self)->tuple[int|None,int|None]:
+        return (self.requests.capacity if self.requests else None,self.tokens.capacity if self.tokens else None)
+
+    def update(self,requests_per_minute:int|None=None,tokens_per_minute:int|None=None):
+        '''Apply new limits, the units already used this minute still count against them'''
+        with self.lock:
+            self.requests=self.resized(self.requests,requests_per_minute)
+            self.tokens=self.resized(self.tokens,tokens_per_minute)
+
+    @staticmethod
+    def resized(bucket:TokenBucket|None,capacity:int|None)->TokenBucket|None:
+        if not capacity:
+            return None
+        if bucket is None:
+            return TokenBucket(capacity)
+        bucket.resize(capacity)
+        return bucket
+
+    def reserve(self)->float:
+        '''Take a request slot if one is free, otherwise return how long to wait for it'''
+        with self.lock:
+            delay=0
+            if self.requests:
+                delay=max(delay,self.requests.wait_time(1))
+            if self.tokens:
+                delay=max(delay,self.tokens.wait_time(1))
+            if delay==0 and self.requests:
+                self.requests.level-=1
+            return delay
+
+    def acquire(self):
+        '''Block the calling thread until a request can be sent'''
+        while (delay:=self.reserve())>0:
+            sleep(delay)
+
+    async def async_acquire(self):
+        '''Suspend the calling coroutine, without blocking the event loop, until a request can be sent'''
+        while (delay:=self.reserve())>0:
+            await asyncio.sleep(delay)
+
+    def record(self,tokens:int):
+        '''Debit the tokens consumed by a completed request'''
+        if self.tokens is None:
+            return
+        with self.lock:
+            self.tokens.refill()
+            self.tokens.level-=tokens
+
+limiters:dict[tuple[str,str],RateLimiter]={}
+limiters_lock=Lock()
+
+def tightest(current:int|None,stated:int|None)->int|None:
+    '''The lower of two limits, a missing limit has no say'''
+    limits=[limit for limit in (current,stated) if limit]
+    return min(limits) if limits else None
+
+def get_limiter(provider:str,api_key:str,requests_per_minute:int|None=None,tokens_per_minute:int|None=None)->RateLimiter:
+    '''The limiter shared by every client of the same provider and API key, held to the tightest limits any of them stated'''
+    key=(provider,sha256(api_key.encode()).hexdigest())
+    with limiters_lock:
+        if key not in limiters:
+            limiters[key]=RateLimiter(requests_per_minute=requests_per_minute,tokens_per_minute=tokens_per_minute)
+        limiter=limiters[key]
+        current=limiter.limits
+        limits=(tightest(current[0],requests_per_minute),tightest(current[1],tokens_per_minute))
+        if limits!=current:
+            # The limits belong to the account, a client that knows of a lower one lowers it for all of them
+            warnings.warn(f'{provider} rate limits lowered from {current} to {limits} (requests, tokens per minute) for every client sharing the API key')
+            limiter.update(requests_per_minute=limits[0],tokens_per_minute=limits[1])
+    return limiter
@@ -0,0 +1,159 @@
+from src.inference.mock.dialects import Dialect,detect,is_stream,is_json,count_tokens,render,error,split_events
+from http.server import ThreadingHTTPServer,BaseHTTPRequestHandler
+from urllib.parse import urlsplit,parse_qsl
+from src.inference.mock.config import MockConfig
+from src.inference.mock.cassette import Cassette
+from typing import Callable
+from threading import Thread
+from httpx import Client
+from time import sleep
+import json
+
+FINAL_ANSWER='''<Option>
+<Thought>The task is complete.</Thought>
+<Final-Answer>Done.</Final-Answer>
+<Route>Final</Route>
+</Option>'''
+
+Responder=Callable[[Dialect,dict,bool],str]
+
+def default_responder(dialect:Dialect,body:dict,json:bool)->str:
+    '''Ends any agent on its first step and sends the episodic memory down the idle route'''
+    return '{"route":"IDLE"}' if json else FINAL_ANSWER
+
+class ScriptedResponder:
+    '''Answers with the given responses in order and repeats the last one once they run out'''
+    def __init__(self,responses:list[str],json_responses:list[str]=['{"route":"IDLE"}']):
+        self.responses=responses
+        self.json_responses=json_responses
+        self.index=0
+        self.json_index=0
+
+    def __call__(self,dialect:Dialect,body:dict,json:bool)->str:
+        if json:
+            response=self.json_responses[min(self.json_index,len(self.json_responses)-1)]
+            self.json_index+=1
+        else:
+            response=self.responses[min(self.index,len(self.responses)-1)]
+            self.index+=1
+        return response
+
+class Handler(BaseHTTPRequestHandler):
+    server:'ThreadingHTTPServer'
+
+    def do_POST(self):
+        self.server.mock.handle(self)
+
+    def do_GET(self):
+        self.server.mock.handle(self)
+
+    def log_message(self, format, *args):
+        if self.server.mock.verbose:
+            super().log_message(format,*args)
+
+class MockServer:
+    '''
+    Local stand-in for the Gemini, OpenAI-compatible, Anthropic and Ollama APIs, point a provider's `base_url` at it.
+
+    In `mock` mode the responder scripts the completions, `record` forwards the requests to `upstream` and saves every
+    exchange to the cassette, and `replay` serves the cassette without any network access.
+
+    with MockServer(MockConfig(mode='replay',cassette='cassettes/web.jsonl',latency=0.3)) as server:
+        llm=ChatOpenAI(model='gpt-4o-mini',base_url=f'{server.url}/v1/chat/completions')
+    '''
+    def __init__(self,config:MockConfig=None,responder:Responder=None,verbose:bool=False):
+        self.config=config if config else MockConfig()
+        self.responder=responder if responder else default_responder
+        self.verbose=verbose
+        self.cassette=Cassette(self.config.cassette) if self.config.cassette else None
+        if self.config.mode in ('record','replay') and self.cassette is None:
+            raise ValueError(f'A cassette is required in {self.config.mode} mode')
+        if self.config.mode=='record' and not self.config.upstream:
+            raise ValueError('An upstream URL is required in record mode')
+        self.upstream=Client(timeout=None) if self.config.mode=='record' else None
+        self.server:ThreadingHTTPServer=None
+        self.thread:Thread=None
+
+    def __enter__(self)->'MockServer':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @property
+    def url(self)->str:
+        host,port=self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self)->'MockServer':
+        self.server=ThreadingHTTPServer((self.config.host,self.config.port),Handler)
+        self.server.daemon_threads=True
+        self.server.mock=self
+        self.thread=Thread(target=self.server.serve_forever,daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server=None
+        if self.upstream is not None:
+            self.upstream.close()
+
+    def handle(self,handler:Handler):
+        url=urlsplit(handler.path)
+        length=int(handler.headers.get('Content-Length') or 0)
+        raw=handler.rfile.read(length) if length else b''
+        match self.config.mode:
+            case 'record':
+                status,content_type,events=self.record(handler,url.path,raw)
+            case 'replay':
+                status,content_type,events=self.replay(handler.command,url.path,raw)
+            case _:
+                status,content_type,events=self.mock(url.path,dict(parse_qsl(url.query)),raw)
+        self.respond(handler,status,content_type,events,delay=self.config.mode!='record')
+
+    def mock(self,path:str,query:dict,raw:bytes)->tuple[int,str,list[str]]:
+        dialect=detect(path)
+        if dialect is None:
+            return 404,'application/json',[error(dialect,f'Unknown endpoint {path}')]
+        body=json.loads(raw) if raw else {}
+        text='' if dialect=='gemini-cache' else self.responder(dialect,body,is_json(dialect,body))
+        content_type,events=render(dialect,text,count_tokens(raw.decode(errors='replace')),is_stream(dialect,path,query,body),model=body.get('model') or 'mock',chunk_size=self.config.chunk_size)
+        return 200,content_type,events
+
+    def record(self,handler:Handler,path:str,raw:bytes)->tuple[int,str,list[str]]:
+        # Credentials travel in the headers (or the query for Gemini), neither is written to the cassette
+        headers={key:value for key,value in handler.headers.items() if key.lower() not in ('host','content-length','accept-encoding','connection')}
+        url=self.config.upstream.rstrip('/')+handler.path
+        response=self.upstream.request(handler.command,url,content=raw,headers=headers)
+        content_type=response.headers.get('content-type','application/json')
+        self.cassette.record(Cassette.key(handler.command,path,raw),handler.command,path,raw,response.status_code,content_type,response.text)
+        return response.status_code,content_type,split_events(content_type,response.text)
+
+    def replay(self,method:str,path:str,raw:bytes)->tuple[int,str,list[str]]:
+        entry=self.cassette.replay(Cassette.key(method,path,raw),method,path)
+        if entry is None:
+            return 404,'application/json',[error(detect(path),f'No recording for {method} {path}')]
+        return entry['status'],entry['content_type'],split_events(entry['content_type'],entry['response'])
+
+    def respond(self,handler:Handler,status:int,content_type:str,events:list[str],delay:bool=True):
+        if delay and self.config.latency:
+            sleep(self.config.latency)
+        handler.send_response(status)
+        handler.send_header('Content-Type',content_type)
+        if len(events)==1:
+            data=events[0].encode()
+            handler.send_header('Content-Length',str(len(data)))
+            handler.end_headers()
+            handler.wfile.write(data)
+            return
+        # Streams are delimited by closing the connection
+        handler.send_header('Connection','close')
+        handler.end_headers()
+        for index,event in enumerate(events):
+            if delay and index and self.config.chunk_latency:
+                sleep(self.config.chunk_latency)
+            handler.wfile.write(event.encode())
+            handler.wfile.flush()
@@ -0,0 +1,21 @@
+from src.inference.mock import MockServer,MockConfig
+from argparse import ArgumentParser
+
+parser=ArgumentParser(description='Offline stand-in for the LLM providers')
+parser.add_argument('--host',default='127.0.0.1')
+parser.add_argument('--port',type=int,default=8808)
+parser.add_argument('--mode',choices=['mock','record','replay'],default='mock')
+parser.add_argument('--cassette',default=None)
+parser.add_argument('--upstream',default=None,help='Base URL the requests are forwarded to in record mode')
+parser.add_argument('--latency',type=float,default=0,help='Seconds before the first byte of a response')
+parser.add_argument('--chunk-latency',type=float,default=0,help='Seconds between the chunks of a stream')
+parser.add_argument('--verbose',action='store_true')
+args=parser.parse_args()
+
+config=MockConfig(host=args.host,port=args.port,mode=args.mode,cassette=args.cassette,upstream=args.upstream,latency=args.latency,chunk_latency=args.chunk_latency)
+server=MockServer(config,verbose=args.verbose).start()
+print(f'Serving {config.mode} responses on {server.url}')
+try:
+    server.thread.join()
+except KeyboardInterrupt:
+    server.stop()
@@ -0,0 +1,83 @@
+from threading import Lock
+from hashlib import sha256
+from pathlib import Path
+import json
+import re
+
+# Parts of a request that differ from run to run of the same agent: the time in the system prompts,
+# the screenshots and the names of the prompt caches created on the fly
+VOLATILE=[
+    (re.compile(r'\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(?:\.\d+)?'),'<datetime>'),
+    (re.compile(r'data:image/[\w.+-]+;base64,[A-Za-z0-9+/=]+'),'<image>'),
+    (re.compile(r'^[A-Za-z0-9+/]{256,}={0,2}$'),'<image>'),
+    (re.compile(r'cachedContents/[\w-]+'),'cachedContents/<id>'),
+]
+
+def normalize(value):
+    if isinstance(value,str):
+        for pattern,replacement in VOLATILE:
+            value=pattern.sub(replacement,value)
+        return value
+    if isinstance(value,dict):
+        return {key:normalize(item) for key,item in value.items()}
+    if isinstance(value,list):
+        return [normalize(item) for item in value]
+    return value
+
+class Cassette:
+    '''
+    Recorded request/response pairs in a JSON lines file, keyed on the method, path and body of the request.
+
+    Identical requests recorded several times are replayed in the order they were recorded, the last one is repeated after that.
+    The volatile parts of the body (see VOLATILE) are left out of the key, and a request without a match gets the next
+    recording of the same endpoint that has not been replayed yet, in the order of the recording.
+    '''
+    def __init__(self,path:str):
+        self.path=Path(path)
+        self.lock=Lock()
+        self.entries:dict[str,list[dict]]={}
+        self.replayed:dict[str,int]={}
+        self.endpoints:dict[tuple[str,str],list[dict]]={}
+        self.used:set[int]=set()
+        if self.path.exists():
+            with open(self.path) as f:
+                for line in f:
+                    if line.strip():
+                        entry=json.loads(line)
+                        # Keyed again, so cassettes recorded before a change of the normalization still match
+                        entry['key']=self.key(entry['method'],entry['path'],entry['request'].encode())
+                        self.add(entry)
+
+    @staticmethod
+    def key(method:str,path:str,body:bytes)->str:
+        try:
+            # Canonical form so the key does not depend on the key order of the client's serializer
+            body=json.dumps(normalize(json.loads(body)),sort_keys=True).encode()
+        except ValueError:
+            pass
+        return sha256(method.encode()+b' '+path.encode()+b'\n'+body).hexdigest()
+
+    def add(self,entry:dict):
+        self.entries.setdefault(entry['key'],[]).append(entry)
+        self.endpoints.setdefault((entry['method'],entry['path']),[]).append(entry)
+
+    def record(self,key:str,method:str,path:str,body:bytes,status:int,content_type:str,response:str):
+        entry={'key':key,'method':method,'path':path,'request':body.decode(errors='replace'),'status':status,'content_type':content_type,'response':response}
+        with self.lock:
+            self.add(entry)
+            self.path.parent.mkdir(parents=True,exist_ok=True)
+            with open(self.path,'a') as f:
+                f.write(json.dumps(entry)+'\n')
+
+    def replay(self,key:str,method:str,path:str)->dict|None:
+        with self.lock:
+            entries=self.entries.get(key)
+            if entries:
+                index=self.replayed.get(key,0)
+                self.replayed[key]=index+1
+                entry=entries[min(index,len(entries)-1)]
+            else:
+                entry=next((entry for entry in self.endpoints.get((method,path),[]) if id(entry) not in self.used),None)
+            if entry is not None:
+                self.used.add(id(entry))
+            return entry
@@ -0,0 +1,15 @@
+from dataclasses import dataclass
+from typing import Literal
+
+@dataclass
+class MockConfig:
+    host:str='127.0.0.1'
+    port:int=8808
+    # mock: scripted responses, record: proxy to `upstream` and save the exchanges, replay: serve the saved exchanges
+    mode:Literal['mock','record','replay']='mock'
+    cassette:str|None=None
+    upstream:str|None=None
+    # Artificial delay in seconds before the first byte and between the chunks of a stream
+    latency:float=0
+    chunk_latency:float=0
+    chunk_size:int=16
@@ -0,0 +1,119 @@
+from typing import Literal
+from uuid import uuid4
+import json
+
+Dialect=Literal['openai','anthropic','gemini','gemini-cache','ollama-chat','ollama-generate']
+
+def detect(path:str)->Dialect|None:
+    '''The wire format of a request from its path'''
+    if path.endswith('/chat/completions'):
+        return 'openai'
+    if path.endswith('/messages'):
+        return 'anthropic'
+    if path.endswith('/cachedContents'):
+        return 'gemini-cache'
+    if 'generateContent' in path or 'GenerateContent' in path:
+        return 'gemini'
+    if path.endswith('/api/chat'):
+        return 'ollama-chat'
+    if path.endswith('/api/generate'):
+        return 'ollama-generate'
+    return None
+
+def is_stream(dialect:Dialect,path:str,query:dict,body:dict)->bool:
+    if dialect=='gemini':
+        return 'streamGenerateContent' in path or query.get('alt')=='sse'
+    return bool(body.get('stream'))
+
+def is_json(dialect:Dialect,body:dict)->bool:
+    '''Whether the client asked for a JSON response'''
+    match dialect:
+        case 'openai'|'anthropic':
+            return (body.get('response_format') or {}).get('type')=='json_object'
+        case 'gemini':
+            return (body.get('generationConfig') or {}).get('responseMimeType')=='application/json'
+        case 'ollama-chat'|'ollama-generate':
+            return bool(body.get('format'))
+    return False
+
+def count_tokens(text:str)->int:
+    # Rough estimate, deterministic so replays and benchmarks are comparable
+    return max(1,len(text)//4)
+
+def chunks(text:str,size:int)->list[str]:
+    return [text[i:i+size] for i in range(0,len(text),size)] or ['']
+
+def sse(data:dict,event:str=None)->str:
+    prefix=f'event: {event}\n' if event else ''
+    return f'{prefix}data: {json.dumps(data)}\n\n'
+
+def render(dialect:Dialect,text:str,prompt_tokens:int,stream:bool,model:str='mock',chunk_size:int=16)->tuple[str,list[str]]:
+    '''The content type and the body of a response carrying `text`, split into the events of a stream if requested'''
+    output_tokens=count_tokens(text)
+    total=prompt_tokens+output_tokens
+    match dialect:
+        case 'openai':
+            usage={'prompt_tokens':prompt_tokens,'completion_tokens':output_tokens,'total_tokens':total,'prompt_tokens_details':{'cached_tokens':0}}
+            if not stream:
+                return 'application/json',[json.dumps({
+                    'id':f'chatcmpl-{uuid4().hex}','object':'chat.completion','model':model,
+                    'choices':[{'index':0,'message':{'role':'assistant','content':text},'finish_reason':'stop'}],
+                    'usage':usage
+                })]
+            events=[sse({'object':'chat.completion.chunk','model':model,'choices':[{'index':0,'delta':{'content':piece}}]}) for piece in chunks(text,chunk_size)]
+            events.append(sse({'object':'chat.completion.chunk','model':model,'choices':[],'usage':usage}))
+            events.append('data: [DONE]\n\n')
+            return 'text/event-stream',events
+        case 'anthropic':
+            if not stream:
+                return 'application/json',[json.dumps({
+                    'id':f'msg_{uuid4().hex}','type':'message','role':'assistant','model':model,
+                    'content':[{'type':'text','text':text}],'stop_reason':'end_turn',
+                    'usage':{'input_tokens':prompt_tokens,'output_tokens':output_tokens}
+                })]
+            events=[sse({'type':'message_start','message':{'id':f'msg_{uuid4().hex}','role':'assistant','model':model,'usage':{'input_tokens':prompt_tokens,'output_tokens':0}}},'message_start')]
+            events.extend(sse({'type':'content_block_delta','index':0,'delta':{'type':'text_delta','text':piece}},'content_block_delta') for piece in chunks(text,chunk_size))
+            events.append(sse({'type':'message_delta','delta':{'stop_reason':'end_turn'},'usage':{'output_tokens':output_tokens}},'message_delta'))
+            events.append(sse({'type':'message_stop'},'message_stop'))
+            return 'text/event-stream',events
+        case 'gemini':
+            usage={'promptTokenCount':prompt_tokens,'candidatesTokenCount':output_tokens,'totalTokenCount':total}
+            if not stream:
+                return 'application/json',[json.dumps({
+                    'candidates':[{'content':{'role':'model','parts':[{'text':text}]},'finishReason':'STOP'}],
+                    'usageMetadata':usage
+                })]
+            pieces=chunks(text,chunk_size)
+            events=[sse({'candidates':[{'content':{'role':'model','parts':[{'text':piece}]}}]}) for piece in pieces[:-1]]
+            events.append(sse({'candidates':[{'content':{'role':'model','parts':[{'text':pieces[-1]}]},'finishReason':'STOP'}],'usageMetadata':usage}))
+            return 'text/event-stream',events
+        case 'gemini-cache':
+            return 'application/json',[json.dumps({'name':f'cachedContents/{uuid4().hex}','model':f'models/{model}'})]
+        case 'ollama-chat'|'ollama-generate':
+            def chunk(piece:str,done:bool)->dict:
+                data={'model':model,'done':done}
+                if dialect=='ollama-chat':
+                    data['message']={'role':'assistant','content':piece}
+                else:
+                    data['response']=piece
+                if done:
+                    data.update({'prompt_eval_count':prompt_tokens,'eval_count':output_tokens})
+                return data
+            if not stream:
+                return 'application/json',[json.dumps(chunk(text,True))]
+            lines=[json.dumps(chunk(piece,False))+'\n' for piece in chunks(text,chunk_size)]
+            lines.append(json.dumps(chunk('',True))+'\n')
+            return 'application/x-ndjson',lines
+
+def error(dialect:Dialect|None,message:str)->str:
+    if dialect=='gemini':
+        return json.dumps({'error':{'code':404,'message':message,'status':'NOT_FOUND'}})
+    return json.dumps({'error':{'type':'not_found_error','message':message}})
+
+def split_events(content_type:str,body:str)->list[str]:
+    '''Split a recorded response back into the events of its stream'''
+    if content_type.startswith('text/event-stream'):
+        return [event+'\n\n' for event in body.split('\n\n') if event.strip()]
+    if content_type.startswith('application/x-ndjson'):
+        return [line+'\n' for line in body.split('\n') if line.strip()]
+    return [body]
@@ -1,27 +1,25 @@
 from tenacity import retry,stop_after_attempt,retry_if_exception_type
 from src.message import AIMessage,BaseMessage,ToolMessage
 from requests import get,RequestException,ConnectionError
-from httpx import Client,AsyncClient,HTTPError
-from ratelimit import limits,sleep_and_retry
-from src.inference import BaseInference,Token
+from src.inference import BaseInference,Token,StreamUsage
+from src.inference.compiler import encode_ollama
 from pydantic import BaseModel
-from typing import Generator
-from json import loads
+from httpx import HTTPError
+from typing import Generator,AsyncGenerator
+from src.codec import loads
 from uuid import uuid4
 
 class ChatOllama(BaseInference):
-    @sleep_and_retry
-    @limits(calls=15,period=60)
-    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
-    def invoke(self,messages: list[BaseMessage],json=False,model:BaseModel=None)->AIMessage:
-        headers=self.headers
-        temperature=self.temperature
-        url=self.base_url or "http://localhost:11434/api/chat"
+    provider='ollama'
+    encode=staticmethod(encode_ollama)
+    http2=False
+
+    def payload(self,messages:list[BaseMessage],json:bool=False,model:BaseModel=None)->dict:
         payload={
             "model": self.model,
-            "messages": [message.to_dict() for message in messages],
+            "messages": self.compiler.compile(messages),
             "options":{
-                "temperature": temperature,
+                "temperature": self.temperature,
             },
             "stream":False
         }
@@ -38,14 +36,21 @@ class ChatOllama(BaseInference):
                     'parameters':tool.schema
                 }
             } for tool in self.tools]
+        return payload
+
+    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
+    def invoke(self,messages: list[BaseMessage],json=False,model:BaseModel=None)->AIMessage:
+        self.acquire()
+        headers=self.headers
+        url=self.base_url or "http://localhost:11434/api/chat"
+        payload=self.payload(messages,json=json,model=model)
         try:
-            with Client() as client:
-                response=client.post(url=url,json=payload,headers=headers,timeout=None)
+            response=self.client.post(url=url,content=self.body(payload),headers=headers)
             response.raise_for_status()
-            json_object=response.json()
+            json_object=loads(response.content)
             message=json_object['message']
             input,output,total=json_object['prompt_eval_count'],json_object['eval_count'],json_object['prompt_eval_count']+json_object['eval_count']
-            self.tokens=Token(input=input,output=output,total=total)
+            self.update_tokens(Token(input=input,output=output,total=total))
             if model:
                 return model.model_validate_json(message.get('content'))
             if json:
@@ -55,45 +60,22 @@ class ChatOllama(BaseInference):
             else:
                 tool_call=message.get('tool_calls')[0]['function']
                 return ToolMessage(id=str(uuid4()),name=tool_call['name'],args=tool_call['arguments']) 
-        except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
+        except (HTTPError,ConnectionError) as err:
+            raise self.error(err) from err
 
-    @sleep_and_retry
-    @limits(calls=15,period=60)
     @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
     async def async_invoke(self,messages: list[BaseMessage],json=False,model:BaseModel=None)->AIMessage:
+        await self.async_acquire()
         headers=self.headers
-        temperature=self.temperature
         url=self.base_url or "http://localhost:11434/api/chat"
-        payload={
-            "model": self.model,
-            "messages": [message.to_dict() for message in messages],
-            "options":{
-                "temperature": temperature,
-            },
-            "stream":False
-        }
-        if json:
-            payload['format']='json'
-        if model:
-            payload['format']=model.model_json_schema()
-        if self.tools:
-            payload["tools"]=[{
-                'type':'function',
-                'function':{
-                    'name':tool.name,
-                    'description':tool.description,
-                    'parameters':tool.schema
-                }
-            } for tool in self.tools]
+        payload=self.payload(messages,json=json,model=model)
         try:
-            async with AsyncClient() as client:
-                response=await client.post(url=url,json=payload,headers=headers,timeout=None)
+            response=await self.async_client.post(url=url,content=self.body(payload),headers=headers)
             response.raise_for_status()
-            json_object=response.json()
+            json_object=loads(response.content)
             message=json_object['message']
             input,output,total=json_object['prompt_eval_count'],json_object['eval_count'],json_object['prompt_eval_count']+json_object['eval_count']
-            self.tokens=Token(input=input,output=output,total=total)
+            self.update_tokens(Token(input=input,output=output,total=total))
             if model:
                 return model.model_validate_json(message.get('content'))
             if json:
@@ -103,59 +85,73 @@ class ChatOllama(BaseInference):
             else:
                 tool_call=message.get('tool_calls')[0]['function']
                 return ToolMessage(id=str(uuid4()),name=tool_call['name'],args=tool_call['arguments']) 
-        except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
+        except (HTTPError,ConnectionError) as err:
+            raise self.error(err) from err
     
-    @sleep_and_retry
-    @limits(calls=15,period=60)
-    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
     def stream(self,messages: list[BaseMessage],json=False)->Generator[str,None,None]:
+        self.acquire()
         headers=self.headers
-        temperature=self.temperature
         url=self.base_url or "http://localhost:11434/api/chat"
-        payload={
-            "model": self.model,
-            "messages": [message.to_dict() for message in messages],
-            "options":{
-                "temperature": temperature,
-            },
-            "stream":True
-        }
-        if json:
-            payload['format']='json'
+        payload=self.payload(messages,json=json)|{'stream':True}
+        body=self.body(payload)
+        usage=StreamUsage(body)
         try:
-            with Client() as client:
-                response=client.post(url=url,json=payload,headers=headers,stream=True,timeout=None)
-            response.raise_for_status()
-            chunks=response.iter_lines(decode_unicode=True)
-            return (loads(chunk)['message']['content'] for chunk in chunks)
+            with self.client.stream('POST',url=url,content=body,headers=headers) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk=loads(line)
+                    if chunk.get('done'):
+                        input,output=chunk.get('prompt_eval_count',0),chunk.get('eval_count',0)
+                        usage.report(input=input,output=output)
+                    yield usage.add(chunk['message']['content'])
         except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
-        except ConnectionError as err:
-            print(err)
-        exit()
+            raise self.error(err) from err
+        finally:
+            self.record_stream(usage)
+
+    async def async_stream(self,messages: list[BaseMessage],json=False)->AsyncGenerator[str,None]:
+        await self.async_acquire()
+        headers=self.headers
+        url=self.base_url or "http://localhost:11434/api/chat"
+        payload=self.payload(messages,json=json)|{'stream':True}
+        body=self.body(payload)
+        usage=StreamUsage(body)
+        try:
+            async with self.async_client.stream('POST',url=url,content=body,headers=headers) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    chunk=loads(line)
+                    if chunk.get('done'):
+                        input,output=chunk.get('prompt_eval_count',0),chunk.get('eval_count',0)
+                        usage.report(input=input,output=output)
+                    yield usage.add(chunk['message']['content'])
+        except HTTPError as err:
+            raise self.error(err) from err
+        finally:
+            self.record_stream(usage)
     
     def available_models(self):
         url='http://localhost:11434/api/tags'
         headers=self.headers
         response=get(url=url,headers=headers)
         response.raise_for_status()
-        models=response.json()
+        models=loads(response.content)
         return [model['name'] for model in models['models']]
         
 class Ollama(BaseInference):
-    @sleep_and_retry
-    @limits(calls=15,period=60)
-    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
-    def invoke(self, query:str,json=False,model:BaseModel=None)->AIMessage:
-        headers=self.headers
-        temperature=self.temperature
-        url=self.base_url or "http://localhost:11434/api/generate"
+    provider='ollama'
+    http2=False
+
+    def payload(self,query:str,json:bool=False,model:BaseModel=None)->dict:
         payload={
             "model": self.model,
             "prompt": query,
             "options":{
-                "temperature": temperature,
+                "temperature": self.temperature,
             },
             "format":'json' if json else '',
             "stream":False
@@ -164,88 +160,98 @@ class Ollama(BaseInference):
             payload['format']='json'
         if model:
             payload['format']=model.model_json_schema()
+        return payload
+
+    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
+    def invoke(self, query:str,json=False,model:BaseModel=None)->AIMessage:
+        self.acquire()
+        headers=self.headers
+        url=self.base_url or "http://localhost:11434/api/generate"
+        payload=self.payload(query,json=json,model=model)
         try:
-            with Client() as client:
-                response=client.post(url=url,json=payload,headers=headers)
+            response=self.client.post(url=url,content=self.body(payload),headers=headers)
             response.raise_for_status()
-            json_object=response.json()
+            json_object=loads(response.content)
             input,output,total=json_object['prompt_eval_count'],json_object['eval_count'],json_object['prompt_eval_count']+json_object['eval_count']
-            self.tokens=Token(input=input,output=output,total=total)
+            self.update_tokens(Token(input=input,output=output,total=total))
             if model:
                 return model.model_validate_json(json_object.get('response'))
             if json:
                 return AIMessage(loads(json_object.get('response')))
             return AIMessage(json_object.get('response'))
-        except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
+        except (HTTPError,ConnectionError) as err:
+            raise self.error(err) from err
 
-    @sleep_and_retry
-    @limits(calls=15,period=60)
     @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
     async def async_invoke(self, query:str,json=False,model:BaseModel=None)->AIMessage:
+        await self.async_acquire()
         headers=self.headers
-        temperature=self.temperature
         url=self.base_url or "http://localhost:11434/api/generate"
-        payload={
-            "model": self.model,
-            "prompt": query,
-            "options":{
-                "temperature": temperature,
-            },
-            "format":'json' if json else '',
-            "stream":False
-        }
-        if json:
-            payload['format']='json'
-        if model:
-            payload['format']=model.model_json_schema()
+        payload=self.payload(query,json=json,model=model)
         try:
-            async with AsyncClient() as client:
-                response=await client.post(url=url,json=payload,headers=headers)
+            response=await self.async_client.post(url=url,content=self.body(payload),headers=headers)
             response.raise_for_status()
-            json_object=response.json()
+            json_object=loads(response.content)
             input,output,total=json_object['prompt_eval_count'],json_object['eval_count'],json_object['prompt_eval_count']+json_object['eval_count']
-            self.tokens=Token(input=input,output=output,total=total)
+            self.update_tokens(Token(input=input,output=output,total=total))
             if model:
                 return model.model_validate_json(json_object.get('response'))
             if json:
                 return AIMessage(loads(json_object.get('response')))
             return AIMessage(json_object.get('response'))
-        except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
+        except (HTTPError,ConnectionError) as err:
+            raise self.error(err) from err
 
-    @sleep_and_retry
-    @limits(calls=15,period=60)
-    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
     def stream(self,query:str,json=False)->Generator[str,None,None]:
+        self.acquire()
         headers=self.headers
-        temperature=self.temperature
         url=self.base_url or "http://localhost:11434/api/generate"
-        payload={
-            "model": self.model,
-            "prompt": query,
-            "options":{
-                "temperature": temperature,
-            },
-            "format":'json' if json else '',
-            "stream":True
-        }
+        payload=self.payload(query,json=json)|{'stream':True}
+        body=self.body(payload)
+        usage=StreamUsage(body)
         try:
-            with Client() as client:
-                response=client.post(url=url,json=payload,headers=headers,stream=True)
-            response.raise_for_status()
-            chunks=response.iter_lines(decode_unicode=True)
-            return (loads(chunk)['response'] for chunk in chunks)
+            with self.client.stream('POST',url=url,content=body,headers=headers) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk=loads(line)
+                    if chunk.get('done'):
+                        input,output=chunk.get('prompt_eval_count',0),chunk.get('eval_count',0)
+                        usage.report(input=input,output=output)
+                    yield usage.add(chunk['response'])
+        except HTTPError as err:
+            raise self.error(err) from err
+        finally:
+            self.record_stream(usage)
+
+    async def async_stream(self,query:str,json=False)->AsyncGenerator[str,None]:
+        await self.async_acquire()
+        headers=self.headers
+        url=self.base_url or "http://localhost:11434/api/generate"
+        payload=self.payload(query,json=json)|{'stream':True}
+        body=self.body(payload)
+        usage=StreamUsage(body)
+        try:
+            async with self.async_client.stream('POST',url=url,content=body,headers=headers) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    chunk=loads(line)
+                    if chunk.get('done'):
+                        input,output=chunk.get('prompt_eval_count',0),chunk.get('eval_count',0)
+                        usage.report(input=input,output=output)
+                    yield usage.add(chunk['response'])
         except HTTPError as err:
-            print(f'Error: {err.response.text}, Status Code: {err.response.status_code}')
-        except ConnectionError as err:
-            print(err)
-        exit()
+            raise self.error(err) from err
+        finally:
+            self.record_stream(usage)
     
     def available_models(self):
         url='http://localhost:11434/api/tags'
         headers=self.headers
         response=get(url=url,headers=headers)
         response.raise_for_status()
-        models=response.json()
+        models=loads(response.content)
         return [model['name'] for model in models['models']]
@@ -1,59 +1,29 @@
-from src.message import AIMessage,BaseMessage,SystemMessage,ImageMessage,HumanMessage,ToolMessage
+from src.message import AIMessage,BaseMessage,ToolMessage
 from tenacity import retry,stop_after_attempt,retry_if_exception_type
 from requests import RequestException,HTTPError,ConnectionError
-from ratelimit import limits,sleep_and_retry
-from httpx import Client,AsyncClient
-from src.inference import BaseInference,Token
+from src.inference import BaseInference,Token,StreamUsage
+from src.inference.compiler import encode_openai
+from httpx import HTTPStatusError,TransportError
 from pydantic import BaseModel
-from typing import Generator
+from typing import Generator,AsyncGenerator
 from typing import Literal
 from pathlib import Path
-from json import loads
+from src.codec import loads
 from uuid import uuid4
 import mimetypes
 import requests
 
 class ChatOpenAI(BaseInference):
-    @sleep_and_retry
-    @limits(calls=15,period=60)
-    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
-    def invoke(self, messages: list[BaseMessage],json:bool=False,model:BaseModel=None)->AIMessage|ToolMessage|BaseModel:
-        self.headers.update({'Authorization': f'Bearer {self.api_key}'})
-        headers=self.headers
-        temperature=self.temperature
-        url=self.base_url or "https://api.openai.com/v1/chat/completions"
-        contents=[]
-        for message in messages:
-            if isinstance(message,SystemMessage):
-                if model:
-                    message.content=self.structured(message,model) 
-                contents.append(message.to_dict())
-            if isinstance(message,(HumanMessage,AIMessage)):
-                contents.append(message.to_dict())
-            if isinstance(message,ImageMessage):
-                text,image=message.content
-                contents.append([
-                    {
-                        'role':'user',
-                        'content':[
-                            {
-                                'type':'text',
-                                'text':text
-                            },
-                            {
-                                'type':'image_url',
-                                'image_url':{
-                                    'url':image
-                                }
-                            }
-                        ]
-                    }
-                ])
+    provider='openai'
+    encode=staticmethod(encode_openai)
+
+    def payload(self,messages:list[BaseMessage],json:bool=False,model:BaseModel=None)->dict:
+        contents=self.compiler.compile(self.with_schema(messages,model))
 
         payload={
             "model": self.model,
             "messages": contents,
-            "temperature": temperature,
+            "temperature": self.temperature,
             "response_format": {
                 "type": "json_object" if json or model else "text"
             },
@@ -68,17 +38,26 @@ class ChatOpenAI(BaseInference):
                     'parameters':tool.schema
                 }
             } for tool in self.tools]
+        return payload
+
+    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
+    def invoke(self, messages: list[BaseMessage],json:bool=False,model:BaseModel=None)->AIMessage|ToolMessage|BaseModel:
+        self.acquire()
+        self.headers.update({'Authorization': f'Bearer {self.api_key}'})
+        headers=self.headers
+        url=self.base_url or "https://api.openai.com/v1/chat/completions"
+        payload=self.payload(messages,json=json,model=model)
         try:
-            with Client() as client:
-                response=client.post(url=url,json=payload,headers=headers,timeout=None)
-            json_object=response.json()
+            response=self.client.post(url=url,content=self.body(payload),headers=headers)
+            json_object=loads(response.content)
             # print(json_object)
             if json_object.get('error'):
-                raise HTTPError(json_object['error']['message'])
+                raise HTTPError(json_object['error']['message'],response=response)
             message=json_object['choices'][0]['message']
             usage_metadata=json_object['usage']
             input,output,total=usage_metadata['prompt_tokens'],usage_metadata['completion_tokens'],usage_metadata['total_tokens']
-            self.tokens=Token(input=input,output=output,total=total)
+            cached=(usage_metadata.get('prompt_tokens_details') or {}).get('cached_tokens',0)
+            self.update_tokens(Token(input=input,output=output,total=total,cached=cached))
             if model:
                 return model.model_validate_json(message.get('content'))
             if json:
@@ -88,78 +67,27 @@ class ChatOpenAI(BaseInference):
             else:
                 tool_call=message.get('tool_calls')[0]['function']
                 return ToolMessage(id=str(uuid4()),name=tool_call['name'],args=tool_call['arguments']) 
-        except HTTPError as err:
-            err_object=loads(err.response.text)
-            print(f'\nError: {err_object["error"]["message"]}\nStatus Code: {err.response.status_code}')
-        except ConnectionError as err:
-            print(err)
-        exit()
+        except (HTTPError,HTTPStatusError,ConnectionError,TransportError) as err:
+            raise self.error(err) from err
 
-    @sleep_and_retry
-    @limits(calls=15,period=60)
     @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
     async def async_invoke(self, messages: list[BaseMessage],json=False,model:BaseModel=None) -> AIMessage|ToolMessage|BaseModel:
+        await self.async_acquire()
         self.headers.update({'Authorization': f'Bearer {self.api_key}'})
         headers=self.headers
-        temperature=self.temperature
         url=self.base_url or "https://api.openai.com/v1/chat/completions"
-        contents=[]
-        for message in messages:
-            if isinstance(message,SystemMessage):
-                if model:
-                    message.content=self.structured(message,model) 
-                contents.append(message.to_dict())
-            if isinstance(message,(HumanMessage,AIMessage)):
-                contents.append(message.to_dict())
-            if isinstance(message,ImageMessage):
-                text,image=message.content
-                contents.append([
-                    {
-                        'role':'user',
-                        'content':[
-                            {
-                                'type':'text',
-                                'text':text
-                            },
-                            {
-                                'type':'image_url',
-                                'image_url':{
-                                    'url':image
-                                }
-                            }
-                        ]
-                    }
-                ])
-
-        payload={
-            "model": self.model,
-            "messages": contents,
-            "temperature": temperature,
-            "response_format": {
-                "type": "json_object" if json or model else "text"
-            },
-            "stream":False,
-        }
-        if self.tools:
-            payload["tools"]=[{
-                'type':'function',
-                'function':{
-                    'name':tool.name,
-                    'description':tool.description,
-                    'parameters':tool.schema
-                }
-            } for tool in self.tools]
+        payload=self.payload(messages,json=json,model=model)
         try:
-            async with AsyncClient() as client:
-                response=await client.post(url=url,json=payload,headers=headers,timeout=None)
-            json_object=response.json()
+            response=await self.async_client.post(url=url,content=self.body(payload),headers=headers)
+            json_object=loads(response.content)
             # print(json_object)
             if json_object.get('error'):
-                raise HTTPError(json_object['error']['message'])
+                raise HTTPError(json_object['error']['message'],response=response)
             message=json_object['choices'][0]['message']
             usage_metadata=json_object['usage']
             input,output,total=usage_metadata['prompt_tokens'],usage_metadata['completion_tokens'],usage_metadata['total_tokens']
-            self.tokens=Token(input=input,output=output,total=total)
+            cached=(usage_metadata.get('prompt_tokens_details') or {}).get('cached_tokens',0)
+            self.update_tokens(Token(input=input,output=output,total=total,cached=cached))
             if model:
                 return model.model_validate_json(message.get('content'))
             if json:
@@ -169,46 +97,56 @@ class ChatOpenAI(BaseInference):
             else:
                 tool_call=message.get('tool_calls')[0]['function']
                 return ToolMessage(id=str(uuid4()),name=tool_call['name'],args=tool_call['arguments']) 
-        except HTTPError as err:
-            err_object=loads(err.response.text)
-            print(f'\nError: {err_object["error"]["message"]}\nStatus Code: {err.response.status_code}')
-        except ConnectionError as err:
-            print(err)
-        exit()
+        except (HTTPError,HTTPStatusError,ConnectionError,TransportError) as err:
+            raise self.error(err) from err
     
-    @sleep_and_retry
-    @limits(calls=15,period=60)
-    @retry(stop=stop_after_attempt(3),retry=retry_if_exception_type(RequestException))
     def stream(self, messages: list[BaseMessage],json=False)->Generator[str,None,None]:
+        self.acquire()
         self.headers.update({'Authorization': f'Bearer {self.api_key}'})
         headers=self.headers
-        temperature=self.temperature
         url=self.base_url or "https://api.openai.com/v1/chat/completions"
-        messages=[message.to_dict() for message in messages]
-        payload={
-            "model": self.model,
-            "messages": messages,
-            "temperature": temperature,
-            "response_format": {
-                "type": "json_object" if json else "text"
-            },
-            "stream":True,
-        }
+        payload=self.payload(messages,json=json)|{'stream':True,'stream_options':{'include_usage':True}}
+        body=self.body(payload)
+        usage=StreamUsage(body)
         try:
-            response=requests.post(url=url,json=payload,headers=headers)
-            response.raise_for_status()
-            chunks=response.iter_lines(decode_unicode=True)
-            for chunk in chunks:
-                chunk=chunk.replace('data: ','')
-                if chunk and chunk!='[DONE]':
-                    delta=loads(chunk)['choices'][0]['delta']
-                    yield delta.get('content','')
-        except HTTPError as err:
-            err_object=loads(err.response.text)
-            print(f'\nError: {err_object["error"]["message"]}\nStatus Code: {err.response.status_code}')
-        except ConnectionError as err:
-            print(err)
-        exit()
+            with self.client.stream('POST',url=url,content=body,headers=headers) as response:
+                response.raise_for_status()
+                for chunk in self.iter_sse(response):
+                    if chunk.get('usage'):
+                        usage_metadata=chunk['usage']
+                        input,output=usage_metadata['prompt_tokens'],usage_metadata['completion_tokens']
+                        cached=(usage_metadata.get('prompt_tokens_details') or {}).get('cached_tokens',0)
+                        usage.report(input=input,output=output,cached=cached)
+                    if chunk.get('choices'):
+                        yield usage.add(chunk['choices'][0]['delta'].get('content') or '')
+        except (HTTPStatusError,TransportError) as err:
+            raise self.error(err) from err
+        finally:
+            self.record_stream(usage)
+
+    async def async_stream(self, messages: list[BaseMessage],json=False)->AsyncGenerator[str,None]:
+        await self.async_acquire()
+        self.headers.update({'Authorization': f'Bearer {self.api_key}'})
+        headers=self.headers
+        url=self.base_url or "https://api.openai.com/v1/chat/completions"
+        payload=self.payload(messages,json=json)|{'stream':True,'stream_options':{'include_usage':True}}
+        body=self.body(payload)
+        usage=StreamUsage(body)
+        try:
+            async with self.async_client.stream('POST',url=url,content=body,headers=headers) as response:
+                response.raise_for_status()
+                async for chunk in self.aiter_sse(response):
+                    if chunk.get('usage'):
+                        usage_metadata=chunk['usage']
+                        input,output=usage_metadata['prompt_tokens'],usage_metadata['completion_tokens']
+                        cached=(usage_metadata.get('prompt_tokens_details') or {}).get('cached_tokens',0)
+                        usage.report(input=input,output=output,cached=cached)
+                    if chunk.get('choices'):
+                        yield usage.add(chunk['choices'][0]['delta'].get('content') or '')
+        except (HTTPStatusError,TransportError) as err:
+            raise self.error(err) from err
+        finally:
+            self.record_stream(usage)
     
     def available_models(self):
         url='https://api.openai.com/v1/models'
@@ -216,10 +154,12 @@ class ChatOpenAI(BaseInference):
         headers=self.headers
         response=requests.get(url=url,headers=headers)
         response.raise_for_status()
-        models=response.json()
+        models=loads(response.content)
         return [model['id'] for model in models['data'] if model['active']]
 
 class AudioOpenAI(BaseInference):
+    provider='openai'
+
     def __init__(self,mode:Literal['transcriptions','translations']='transcriptions', model: str = '', api_key: str = '', base_url: str = '', temperature: float = 0.5):
         self.mode=mode
         super().__init__(model, api_key, base_url, temperature)
@@ -241,20 +181,15 @@ class AudioOpenAI(BaseInference):
             'file': (path.name,self.__read_audio(path),mime_type)
         }
         try:
-            with Client() as client:
-                response=client.post(url=url,data=data,files=files,headers=headers,timeout=None)
+            response=self.client.post(url=url,data=data,files=files,headers=headers)
             response.raise_for_status()
             if json:
                 content=loads(response.text)['text']
             else:
                 content=response.text
             return AIMessage(content)
-        except HTTPError as err:
-            err_object=loads(err.response.text)
-            print(f'\nError: {err_object["error"]["message"]}\nStatus Code: {err.response.status_code}')
-        except ConnectionError as err:
-            print(err)
-        exit()
+        except (HTTPError,HTTPStatusError,ConnectionError,TransportError) as err:
+            raise self.error(err) from err
     
     def __read_audio(self,file_path:str):
         with open(file_path,'rb') as f:
@@ -267,11 +202,14 @@ class AudioOpenAI(BaseInference):
     def stream(self, messages:BaseMessage=[]):
         pass
     
+    async def async_stream(self, messages:BaseMessage=[]):
+        pass
+    
     def available_models(self):
         url='https://api.groq.com/openai/v1/models'
         self.headers.update({'Authorization': f'Bearer {self.api_key}'})
         headers=self.headers
         response=requests.get(url=url,headers=headers)
         response.raise_for_status()
-        models=response.json()
+        models=loads(response.content)
         return [model['id'] for model in models['data'] if model['active']]
@@ -0,0 +1,170 @@
+from contextvars import ContextVar
+from pydantic import BaseModel
+from threading import Lock
+from datetime import datetime
+from pathlib import Path
+import json
+
+# USD per million (input, output, cached input) tokens, matched on the longest model name prefix
+PRICES:dict[str,tuple[float,float,float]]={
+    'gpt-4o-mini':(0.15,0.6,0.075),
+    'gpt-4o':(2.5,10,1.25),
+    'gpt-4.1-nano':(0.1,0.4,0.025),
+    'gpt-4.1-mini':(0.4,1.6,0.1),
+    'gpt-4.1':(2,8,0.5),
+    'o3-mini':(1.1,4.4,0.55),
+    'o4-mini':(1.1,4.4,0.275),
+    'claude-3-5-haiku':(0.8,4,0.08),
+    'claude-3-5-sonnet':(3,15,0.3),
+    'claude-3-7-sonnet':(3,15,0.3),
+    'claude-sonnet-4':(3,15,0.3),
+    'claude-3-opus':(15,75,1.5),
+    'claude-opus-4':(15,75,1.5),
+    'gemini-1.5-flash':(0.075,0.3,0.01875),
+    'gemini-1.5-pro':(1.25,5,0.3125),
+    'gemini-2.0-flash-lite':(0.075,0.3,0.075),
+    'gemini-2.0-flash':(0.1,0.4,0.025),
+    'gemini-2.5-flash':(0.3,2.5,0.075),
+    'gemini-2.5-pro':(1.25,10,0.31),
+    'mistral-large':(2,6,2),
+    'mistral-small':(0.2,0.6,0.2),
+    'llama-3.3-70b':(0.59,0.79,0.59),
+    'llama-3.1-8b':(0.05,0.08,0.05),
+}
+
+# Local models cost nothing per token
+FREE_PROVIDERS={'ollama'}
+
+class Usage(BaseModel):
+    provider:str
+    model:str
+    input:int
+    output:int
+    cached:int=0
+    total:int
+    latency:float|None=None
+    cost:float|None=None
+    timestamp:str
+
+class UsageLedger:
+    '''
+    Accumulates the usage of every inference call made while the ledger is open, including the calls
+    of nested agents and memory operations running in the same thread or task.
+
+    with UsageLedger() as ledger:
+        agent.invoke(task)
+    print(ledger.summary())
+    '''
+    def __init__(self,prices:dict[str,tuple[float,float,float]]=None):
+        self.prices=prices if prices else PRICES
+        self.records:list[Usage]=[]
+        self.lock=Lock()
+        self.token=None
+
+    def __enter__(self)->'UsageLedger':
+        self.token=active_ledgers.set(active_ledgers.get()+(self,))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        active_ledgers.reset(self.token)
+        self.token=None
+
+    def price(self,provider:str,model:str)->tuple[float,float,float]|None:
+        if provider in FREE_PROVIDERS:
+            return (0,0,0)
+        # Provider prefixed names such as `openai/gpt-4o` on OpenRouter
+        name=model.split('/')[-1].lower()
+        matches=[prefix for prefix in self.prices if name.startswith(prefix)]
+        if not matches:
+            return None
+        return self.prices[max(matches,key=len)]
+
+    def estimate(self,provider:str,model:str,input:int,output:int,cached:int=0)->float|None:
+        '''Cost in USD of a call, None when the model has no known price'''
+        price=self.price(provider,model)
+        if price is None:
+            return None
+        input_price,output_price,cached_price=price
+        return ((input-cached)*input_price+cached*cached_price+output*output_price)/1_000_000
+
+    def record(self,provider:str,model:str,input:int,output:int,total:int,cached:int=0,latency:float|None=None):
+        usage=Usage(provider=provider,model=model,input=input,output=output,cached=cached,total=total,latency=latency,
+        cost=self.estimate(provider,model,input,output,cached),timestamp=datetime.now().isoformat())
+        with self.lock:
+            self.records.append(usage)
+
+    @property
+    def calls(self)->int:
+        return len(self.records)
+
+    @property
+    def input(self)->int:
+        return sum(record.input for record in self.records)
+
+    @property
+    def output(self)->int:
+        return sum(record.output for record in self.records)
+
+    @property
+    def cached(self)->int:
+        return sum(record.cached for record in self.records)
+
+    @property
+    def total(self)->int:
+        return sum(record.total for record in self.records)
+
+    @property
+    def latency(self)->float:
+        return sum(record.latency or 0 for record in self.records)
+
+    @property
+    def cost(self)->float:
+        return sum(record.cost or 0 for record in self.records)
+
+    def by_model(self)->dict[str,dict]:
+        models={}
+        for record in self.records:
+            entry=models.setdefault(f'{record.provider}/{record.model}',{'calls':0,'input':0,'output':0,'cached':0,'total':0,'latency':0,'cost':0})
+            entry['calls']+=1
+            entry['input']+=record.input
+            entry['output']+=record.output
+            entry['cached']+=record.cached
+            entry['total']+=record.total
+            entry['latency']+=record.latency or 0
+            entry['cost']+=record.cost or 0
+        return models
+
+    def summary(self,title:str='Usage')->str:
+        lines=[f'{title}: {self.calls} calls, Input Tokens: {self.input} (Cached: {self.cached}) Output Tokens: {self.output} Total Tokens: {self.total} Latency: {self.latency:.2f}s Cost: ${self.cost:.4f}']
+        models=self.by_model()
+        if len(models)>1:
+            for name,entry in models.items():
+                lines.append(f'  {name}: {entry["calls"]} calls, Input Tokens: {entry["input"]} Output Tokens: {entry["output"]} Cost: ${entry["cost"]:.4f}')
+        unpriced={f'{record.provider}/{record.model}' for record in self.records if record.cost is None}
+        if unpriced:
+            lines.append(f'  No price known for: {", ".join(sorted(unpriced))}')
+        return '\n'.join(lines)
+
+    def to_dict(self)->dict:
+        return {
+            'calls':self.calls,
+            'input':self.input,
+            'output':self.output,
+            'cached':self.cached,
+            'total':self.total,
+            'latency':self.latency,
+            'cost':self.cost,
+            'models':self.by_model(),
+            'records':[record.model_dump() for record in self.records]
+        }
+
+    def export(self,path:str|Path):
+        '''Write the ledger as a JSON record'''
+        Path(path).write_text(json.dumps(self.to_dict(),indent=2))
+
+active_ledgers:ContextVar[tuple[UsageLedger,...]]=ContextVar('active_ledgers',default=())
+
+def record_usage(provider:str,model:str,input:int,output:int,total:int,cached:int=0,latency:float|None=None):
+    '''Add a call to every ledger open in the current context'''
+    for ledger in active_ledgers.get():
+        ledger.record(provider,model,input,output,total,cached=cached,latency=latency)
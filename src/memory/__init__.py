@@ -1,7 +1,7 @@
 from abc import ABC,abstractmethod
 from src.inference import BaseInference
 from src.message import BaseMessage,SystemMessage
-import json
+from src.codec import dumps,loads
 import os
 
 class BaseMemory(ABC):
@@ -28,10 +28,10 @@ class BaseMemory(ABC):
         if not os.path.exists(f'./memory/{self.knowledge_base}'):
             os.makedirs('./memory',exist_ok=True)
             with open(f'./memory/{self.knowledge_base}','w') as f:
-                f.write(json.dumps(self.memories,indent=2))
+                f.write(dumps(self.memories,indent=True).decode())
         else:
             with open(f'./memory/{self.knowledge_base}','r') as f:
-                self.memories=json.loads(f.read())
+                self.memories=loads(f.read())
     def conversation_to_text(self,conversation:list[BaseMessage]):
         conversation=list(self.__filter_conversation(conversation))
         return '\n'.join([f'{message.role}: {message.content}' for message in conversation])
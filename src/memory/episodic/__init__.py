@@ -3,12 +3,13 @@ from src.message import SystemMessage,HumanMessage
 from src.message import BaseMessage
 from src.memory import BaseMemory
 from src.router import LLMRouter
+from src.codec import dumps,loads
 from termcolor import colored
 from uuid import uuid4
 import json
 
 with open('./src/memory/episodic/routes.json','r') as f:
-    routes=json.load(f)
+    routes=loads(f.read())
 
 class EpisodicMemory(BaseMemory):
     def router(self,conversation:list[BaseMessage]):
@@ -42,10 +43,10 @@ class EpisodicMemory(BaseMemory):
         if self.verbose:
             print(f'{colored(f'Adding memory to Knowledge Base:',color='yellow',attrs=['bold'])}\n{json.dumps(memory,indent=2)}')
         with open(f'./memory/{self.knowledge_base}','r+') as f:
-            knowledge_base:list[dict] = json.load(f)
+            knowledge_base:list[dict] = loads(f.read())
             knowledge_base.append(memory)
             f.seek(0)
-            json.dump(knowledge_base, f, indent=2)
+            f.write(dumps(knowledge_base,indent=True).decode())
 
     def update_memory(self,conversation:list[BaseMessage]):
         system_prompt=read_markdown_file('src/memory/episodic/prompt/update.md')
@@ -56,12 +57,12 @@ class EpisodicMemory(BaseMemory):
         if self.verbose:
             print(f'{colored(f'Updated memories from Knowledge Base:',color='yellow',attrs=['bold'])}\n{json.dumps(memories,indent=2)}')
         with open(f'./memory/{self.knowledge_base}','r+') as f:
-            knowledge_base:list[dict] = json.load(f)
+            knowledge_base:list[dict] = loads(f.read())
             memory_ids=[memory.get('id') for memory in self.memories]
             updated_knowledge_base=list(filter(lambda memory:memory.get('id') not in memory_ids,knowledge_base))
             updated_knowledge_base.extend(memories)
             f.seek(0)
-            json.dump(updated_knowledge_base, f, indent=2)
+            f.write(dumps(updated_knowledge_base,indent=True).decode())
             f.truncate()
 
     def replace_memory(self,conversation:list[BaseMessage]):
@@ -74,12 +75,12 @@ class EpisodicMemory(BaseMemory):
         if self.verbose:
             print(f'{colored(f'Replacing memory from Knowledge Base:',color='yellow',attrs=['bold'])}\n{json.dumps(memory,indent=2)}')
         with open(f'./memory/{self.knowledge_base}','r+') as f:
-            knowledge_base:list[dict] = json.load(f)
+            knowledge_base:list[dict] = loads(f.read())
             memory_ids=[memory.get('id') for memory in self.memories]
             updated_knowledge_base=list(filter(lambda memory:memory.get('id') not in memory_ids,knowledge_base))
             updated_knowledge_base.append(memory)
             f.seek(0)
-            json.dump(updated_knowledge_base, f, indent=2)
+            f.write(dumps(updated_knowledge_base,indent=True).decode())
             f.truncate()
 
     def retrieve(self, query: str)->list[dict]:
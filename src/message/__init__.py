@@ -1,4 +1,6 @@
+from src.image import mime_type as sniff_mime_type
 from io import BytesIO
+from copy import copy
 from abc import ABC
 import requests
 import base64
@@ -36,7 +38,7 @@ class SystemMessage(BaseMessage):
         self.content=content
 
 class ImageMessage(BaseMessage):
-    def __init__(self,text:str=None,image_path:str=None,image_obj:str=None):
+    def __init__(self,text:str=None,image_path:str=None,image_obj:str=None,mime_type:str=None):
         self.role='user'
         if image_obj is not None or image_path is None:
             self.content=(text,self.__encoder(image_obj))
@@ -44,7 +46,15 @@ class ImageMessage(BaseMessage):
             self.content=(text,self.__image_to_base64(image_path))
         else:
             raise Exception('image_path and image_base_64 cannot be both None or both not None')
+        # The signature is in the first bytes, 24 base64 characters decode to 18 of them
+        self.mime_type=mime_type if mime_type else sniff_mime_type(base64.b64decode(self.content[1][:24]))
     
+    def with_text(self,text:str)->'ImageMessage':
+        '''The same image under another text'''
+        message=copy(self)
+        message.content=(text,self.content[1])
+        return message
+
     def __is_url(self,image_path:str)->bool:
         url_pattern = re.compile(r'^https?://')
         return url_pattern.match(image_path) is not None
@@ -0,0 +1,22 @@
+from src.agent.parser import StreamParser
+import pytest
+import re
+
+RESPONSE='''<Option>
+<Thought>The search box is visible, typing the query</Thought>
+<Action-Name>Type Tool</Action-Name>
+<Action-Input>{"index":3,"text":"flights to Lisbon"}</Action-Input>
+<Route>Action</Route>
+</Option>'''
+
+def chunks(text:str,size:int):
+    for i in range(0,len(text),size):
+        yield text[i:i+size]
+
+@pytest.mark.parametrize('size',[1,4,16,64])
+def test_stream_cut_short_has_a_single_route(size):
+    parser=StreamParser().parse_stream(chunks(RESPONSE,size))
+    assert parser.done
+    assert parser.text.count('<Route>')==1
+    assert re.search(r'<Route>(.*?)</Route>',parser.text,re.DOTALL).group(1).strip()=='Action'
+    assert parser.tags['Action-Name']=='Type Tool'